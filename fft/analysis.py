@@ -3,182 +3,177 @@ import fftmatch as fft
 import boyermoore as bm
 import argparse
 import collections
-from timer import Timer
 import json
-import cvmatch
+import bench
+import fftbackend
+import dispatch
+import rabinkarp
+
+def run(name, func, expected=None, **fields):
+    """ Benchmarks func with the repeats and warmup from the command line """
+    record, matches = bench.benchmark(name, func, expected,
+                                      repeats=args.repeats, warmup=args.warmup)
+    record.update(fields)
+    return record, matches
+
+def run_boyer_moore(genomes):
+    """ Benchmarks Boyer-Moore, whose matches the others are checked against """
+    record, matches = run('boyermoore',
+        lambda: bm.boyer_moore_mult_match_index(genomes, args.pattern))
+    record['accuracy'] = 1
+    record['correct'] = True
+    return record, matches
 
 def nlogm_chunk_analysis(genomes, chunk_max, total_length):
-    # analysis dictionary holds all data about the algorithms
-    analysis = {'substring_length':len(args.pattern), 'substring': args.pattern,
-                'text_length':total_length}
-
     # Get time to run algorithm on all substrings
-    boyermoore_data = {'name': 'boyermoore'}
-    nlogm_data = {'name': 'nlogm'}
-
-    with Timer() as t:
-        bm_matches = bm.boyer_moore_mult_match_index(genomes, args.pattern)
-    boyermoore_data['time'] = t.msecs
-    boyermoore_data['accuracy'] = 1
+    boyermoore_data, bm_matches = run_boyer_moore(genomes)
 
     for i in range(3,chunk_max,3):
-        nlogm_matches = []
-        with Timer() as t:
-            for g in genomes:
-                nlogm_matches.append(fft.fft_match_index_n_log_m(g, args.pattern, chunk_size=i))
-        nlogm_data['time'] = t.msecs
-        nlogm_data['chunk_size'] = i
-
-        accuracy = 0
-        for i in range(len(nlogm_matches)):
-            i_accuracy = len(nlogm_matches[i]) / len(bm_matches[i])
-            accuracy += i_accuracy
-        nlogm_data['accuracy'] = accuracy / len(bm_matches)
-
-        algorithms = []
-        algorithms.append(boyermoore_data)
-        algorithms.append(nlogm_data)
-
-        analysis['algorithms'] = algorithms
-        # make pretty json format
+        nlogm_data, _ = run('nlogm',
+            lambda: [fft.fft_match_index_n_log_m(g, args.pattern, chunk_size=i)
+                     for g in genomes],
+            bm_matches, chunk_size=i)
+
+        # analysis dictionary holds all data about the algorithms
+        analysis = bench.run_record(substring_length=len(args.pattern),
+                                    substring=args.pattern,
+                                    text_length=total_length,
+                                    algorithms=[boyermoore_data, nlogm_data])
         print json.dumps(analysis)
 
 def opencv_chunk_analysis(genomes, chunk_max, total_length):
-    # analysis dictionary holds all data about the algorithms
-    analysis = {'substring_length':len(args.pattern), 'substring': args.pattern,
-                'text_length':total_length}
-
+    import cvmatch
     # Get time to run algorithm on all substrings
-    boyermoore_data = {'name': 'boyermoore'}
-    opencv_data = {'name': 'opencv'}
-
-    with Timer() as t:
-        bm_matches = bm.boyer_moore_mult_match_index(genomes, args.pattern)
-    boyermoore_data['time'] = t.msecs
-    boyermoore_data['accuracy'] = 1
+    boyermoore_data, bm_matches = run_boyer_moore(genomes)
 
     for i in range(3,chunk_max,3):
-        with Timer() as t:
-            opencv_matches = cvmatch.cv_match_index_chunk(genomes, args.pattern, chunk_size=i)
-        opencv_data['time'] = t.msecs
-        opencv_data['chunk_size'] = i
-
-        accuracy = 0
-        for i in range(len(opencv_matches)):
-            i_accuracy = len(opencv_matches[i]) / len(bm_matches[i])
-            accuracy += i_accuracy
-        opencv_data['accuracy'] = accuracy / len(bm_matches)
-
-        algorithms = []
-        algorithms.append(boyermoore_data)
-        algorithms.append(opencv_data)
-
-        analysis['algorithms'] = algorithms
-        # make pretty json format
+        opencv_data, _ = run('opencv',
+            lambda: cvmatch.cv_match_index_chunk(genomes, args.pattern,
+                                                 chunk_size=i),
+            bm_matches, chunk_size=i)
+
+        # analysis dictionary holds all data about the algorithms
+        analysis = bench.run_record(substring_length=len(args.pattern),
+                                    substring=args.pattern,
+                                    text_length=total_length,
+                                    algorithms=[boyermoore_data, opencv_data])
         print json.dumps(analysis)
 
 def k_analysis(genomes):
-    # analysis dictionary holds all data about the algorithms
-    analysis = {'substring_length':len(args.pattern), 'substring': args.pattern}
-
-    # Get time to run algorithm on all substrings
-    boyermoore_data = {'name': 'boyermoore'}
-    nlogn_data = {'name': 'nlogn'}
-    opencv_data = {'name': 'opencv'}
+    import cvmatch
     for i in range(0,len(genomes)):
-        analysis['k'] = i
         if len(genomes[:i]) == 0:
             k_genomes = [genomes[0]]
         else:
             k_genomes = genomes[:i]
-        with Timer() as t:
-            bm_matches = bm.boyer_moore_mult_match_index(k_genomes, args.pattern)
-        boyermoore_data['time'] = t.msecs
-        boyermoore_data['accuracy'] = 1
-
-        with Timer() as t:
-            nlogn_matches = fft.fft_match_index_n_sq_log_n(k_genomes, args.pattern)
-        nlogn_data['time'] = t.msecs
-        accuracy = 0
-
-        for i in range(len(nlogn_matches)):
-            i_accuracy = len(nlogn_matches[i]) / len(bm_matches[i])
-            accuracy += i_accuracy
-        nlogn_data['accuracy'] = accuracy / len(bm_matches)
-
-        with Timer() as t:
-            cvmatch.cv_match_index(k_genomes, args.pattern)
-        opencv_data['time'] = t.msecs
-
-        algorithms = []
-        algorithms.append(boyermoore_data)
-        algorithms.append(nlogn_data)
-        algorithms.append(opencv_data)
 
-        analysis['algorithms'] = algorithms
-        # make pretty json format
+        # Get time to run algorithm on all substrings
+        boyermoore_data, bm_matches = run_boyer_moore(k_genomes)
+        nlogn_data, _ = run('nlogn',
+            lambda: fft.fft_match_index_n_sq_log_n(k_genomes, args.pattern),
+            bm_matches)
+        opencv_data, _ = run('opencv',
+            lambda: cvmatch.cv_match_index(k_genomes, args.pattern),
+            bm_matches)
+        rabinkarp_data, _ = run('rabinkarp',
+            lambda: rabinkarp.rabin_karp_match_index(k_genomes, args.pattern),
+            bm_matches)
+
+        # analysis dictionary holds all data about the algorithms
+        analysis = bench.run_record(substring_length=len(args.pattern),
+                                    substring=args.pattern, k=i,
+                                    algorithms=[boyermoore_data, nlogn_data,
+                                                opencv_data, rabinkarp_data])
         print json.dumps(analysis)
 
 def time_analysis(genomes, total_length, chunk_size='m'):
+    import cvmatch
+    # Get time to run algorithm on all substrings
+    boyermoore_data, bm_matches = run_boyer_moore(genomes)
+    nlogn_data, _ = run('nlogn',
+        lambda: fft.fft_match_index_n_sq_log_n(genomes, args.pattern),
+        bm_matches)
+    nlogm_data, _ = run('nlogm',
+        lambda: [fft.fft_match_index_n_log_m(g, args.pattern, chunk_size)
+                 for g in genomes],
+        bm_matches)
+    opencv_data, _ = run('opencv',
+        lambda: cvmatch.cv_match_index(genomes, args.pattern), bm_matches)
+    rabinkarp_data, _ = run('rabinkarp',
+        lambda: rabinkarp.rabin_karp_match_index(genomes, args.pattern),
+        bm_matches)
+
     # analysis dictionary holds all data about the algorithms
-    analysis = {'substring_length':len(args.pattern), 'substring': args.pattern,
-                    'text_length':total_length}
+    analysis = bench.run_record(substring_length=len(args.pattern),
+                                substring=args.pattern,
+                                text_length=total_length,
+                                algorithms=[boyermoore_data, nlogn_data,
+                                            nlogm_data, opencv_data,
+                                            rabinkarp_data])
+    print json.dumps(analysis)
 
-    # Get time to run algorithm on all substrings
-    boyermoore_data = {'name': 'boyermoore'}
-    nlogn_data = {'name': 'nlogn'}
-    nlogm_data = {'name': 'nlogm'}
-    opencv_data = {'name': 'opencv'}
-
-    with Timer() as t:
-        bm_matches = bm.boyer_moore_mult_match_index(genomes, args.pattern)
-    boyermoore_data['time'] = t.msecs
-    boyermoore_data['accuracy'] = 1
-
-    with Timer() as t:
-        nlogn_matches = fft.fft_match_index_n_sq_log_n(genomes, args.pattern)
-    nlogn_data['time'] = t.msecs
-    accuracy = 0
-
-    for i in range(len(nlogn_matches)):
-        i_accuracy = len(nlogn_matches[i]) / len(bm_matches[i])
-        accuracy += i_accuracy
-    nlogn_data['accuracy'] = accuracy / len(bm_matches)
-
-    nlogm_matches = []
-    total_length = 0
-    with Timer() as t:
-        for g in genomes:
-            total_length += len(g)
-            nlogm_matches.append(fft.fft_match_index_n_log_m(g, args.pattern, chunk_size))
-    nlogm_data['time'] = t.msecs
-
-    accuracy = 0
-    for i in range(len(nlogm_matches)):
-        i_accuracy = len(nlogm_matches[i]) / len(bm_matches[i])
-        accuracy += i_accuracy
-    nlogm_data['accuracy'] = accuracy / len(bm_matches)
-
-    with Timer() as t:
-        cvmatch.cv_match_index(genomes, args.pattern)
-    opencv_data['time'] = t.msecs
-
-    accuracy = 0
-    for i in range(len(nlogm_matches)):
-        i_accuracy = len(nlogm_matches[i]) / len(bm_matches[i])
-        accuracy += i_accuracy
-    opencv_data['accuracy'] = accuracy / len(bm_matches)
-
-    algorithms = []
-    algorithms.append(boyermoore_data)
-    algorithms.append(nlogn_data)
+def backend_analysis(genomes, total_length):
+    boyermoore_data, bm_matches = run_boyer_moore(genomes)
+
+    algorithms = [boyermoore_data]
+    for backend in fftbackend.available_backends():
+        nlogn_data, _ = run('nlogn',
+            lambda: fft.fft_match_index_n_sq_log_n(genomes, args.pattern,
+                                                   backend=backend),
+            bm_matches, backend=backend)
+        nlogm_data, _ = run('nlogm',
+            lambda: [fft.fft_match_index_n_log_m(g, args.pattern,
+                                                 backend=backend)
+                     for g in genomes],
+            bm_matches, backend=backend)
+
+        algorithms.append(nlogn_data)
+        algorithms.append(nlogm_data)
+
+    #the exact number-theoretic transform of ntt.py, which has no backend
+    nlogm_data, _ = run('nlogm',
+        lambda: [fft.fft_match_index_n_log_m(g, args.pattern, exact=True)
+                 for g in genomes],
+        bm_matches, backend='ntt')
     algorithms.append(nlogm_data)
-    algorithms.append(opencv_data)
 
-    analysis['algorithms'] = algorithms
-    # make pretty json format
+    # analysis dictionary holds all data about the algorithms
+    analysis = bench.run_record(substring_length=len(args.pattern),
+                                substring=args.pattern,
+                                text_length=total_length,
+                                algorithms=algorithms)
     print json.dumps(analysis)
 
+def calibration_analysis(genomes):
+    '''Times every algorithm that dispatch.py can choose on prefixes of the
+    genomes and on subsets of them, and saves the cost model fit to the times.'''
+    samples = []
+    n = max(map(len, genomes))
+    #nlogn needs texts that are at least as long as the pattern
+    shortest = min(n, 2*len(args.pattern))
+    for k in sorted(set([1, len(genomes)])):
+        for text_length in sorted(set([max(n // 16, shortest),
+                                       max(n // 4, shortest), n])):
+            texts = [g[:text_length] for g in genomes[:k]]
+
+            algorithms = []
+            for name in dispatch.available_algorithms(len(args.pattern)):
+                data, _ = run(name,
+                    lambda: dispatch.ALGORITHMS[name](texts, args.pattern))
+                algorithms.append(data)
+                samples.append({'name': name, 'k': k,
+                                'text_length': text_length,
+                                'substring_length': len(args.pattern),
+                                'time': data['time']})
+
+            analysis = bench.run_record(substring_length=len(args.pattern),
+                                        substring=args.pattern, k=k,
+                                        text_length=text_length,
+                                        algorithms=algorithms)
+            print json.dumps(analysis)
+
+    dispatch.CostModel.fit(samples).save()
+
 parser = argparse.ArgumentParser(description='Get time data on algorithms.')
 
 # Pattern arg: substring to search genomes for.
@@ -192,6 +187,17 @@ parser.add_argument('-k','--genenum', action="store_true",
                     help='Analyze by number of texts the algorithms.')
 parser.add_argument('-o','--optimize', action="store_true",
                     help='Optimize n^2logm partition size.')
+parser.add_argument('-f','--fft-backends', action="store_true",
+                    help='Compare the installed FFT backends and the exact \
+NTT.')
+parser.add_argument('-C','--calibrate', action="store_true",
+                    help='Fit the cost model of cli.py -a auto and save it to '
+                         + dispatch.COST_MODEL_PATH)
+
+parser.add_argument('-r','--repeats', type=int, default=5,
+                    help='Number of timed runs of every algorithm. Default=5')
+parser.add_argument('-w','--warmup', type=int, default=1,
+                    help='Number of untimed runs before them. Default=1')
 
 parser.add_argument('pattern', help='The pattern that you want to search for in\
  the genome(s)')
@@ -203,26 +209,29 @@ You can also pass in 1 or more genomes, separated by spaces')
 
 args = parser.parse_args()
 genomes = []
-total_length = 0
 
 # Scan files and store the title and genome string in genomes dictionary
 for genome_fn in args.genomes:
     with open(genome_fn) as gn:
         first_line = gn.readline()
         genome = ''
-        total_length = 0
         if first_line[0] == '>':
             title = first_line
         else:
-            genome = first_line
-            total_length += len(genome)
+            genome = first_line.rstrip()
         for line in gn:
             genome += line.rstrip()
-            total_length += len(genome)
     genomes.append(genome)
 
+# the length of the longest text, n
+total_length = max(map(len, genomes))
+
 if args.genenum:
     k_analysis(genomes)
+elif args.fft_backends:
+    backend_analysis(genomes, total_length)
+elif args.calibrate:
+    calibration_analysis(genomes)
 elif args.chunk:
     if args.opencv:
         opencv_chunk_analysis(genomes,args.chunk, total_length)
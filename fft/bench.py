@@ -0,0 +1,179 @@
+'''
+Benchmark harness for the match-index algorithms.
+
+Every benchmark runs the algorithm `warmup` times untimed, then `repeats`
+times with the highest resolution clock available, and reports the median and
+interquartile range of the times together with the peak memory use.  The
+matches are checked against Boyer-Moore's by comparing the sets of indices of
+every text.
+
+Results are JSON records with a schema_version, so that the records of two
+runs can be compared automatically:
+
+    $ python bench.py baseline.json current.json
+'''
+import json
+import platform
+import sys
+import timeit
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+#increment when the meaning of a field changes
+SCHEMA_VERSION = 1
+
+try:
+    from time import perf_counter_ns as clock_ns
+except ImportError:
+    def clock_ns():
+        return int(timeit.default_timer() * 1e9)
+
+def environment():
+    """ Describes the machine and the libraries that the records came from """
+    return {'machine': platform.node(), 'platform': platform.platform(),
+            'processor': platform.processor(),
+            'python': platform.python_version(), 'numpy': np.__version__}
+
+def peak_rss_kb():
+    """ Peak resident set size of this process so far, in kilobytes """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #linux reports kilobytes, mac os bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def summarize(times_ns):
+    """ Median, interquartile range and extremes of the times, in ms """
+    times = np.asarray(times_ns, dtype=np.float64) / 1e6
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {'median_ms': median, 'iqr_ms': q3 - q1, 'min_ms': times.min(),
+            'max_ms': times.max(), 'repeats': len(times)}
+
+def match_sets_equal(matches, expected):
+    """
+    Returns the fraction of the texts whose set of match indices is the same as
+    the expected one.
+    """
+    if len(matches) != len(expected):
+        return 0.0
+    equal = [set(np.asarray(a).astype(int).tolist()) ==
+             set(np.asarray(b).astype(int).tolist())
+             for a, b in zip(matches, expected)]
+    return sum(equal) / float(len(equal)) if equal else 1.0
+
+def benchmark(name, func, expected=None, repeats=5, warmup=1):
+    """
+    Benchmarks func, which takes no arguments and returns the matches of every
+    text.
+
+    Arguments
+    ---------
+    name : str
+        the name of the algorithm in the record
+    func : callable
+    expected : list of arrays or None
+        the matches of every text, as found by Boyer-Moore
+    repeats : int
+        number of timed runs
+    warmup : int
+        number of untimed runs before them
+
+    Returns
+    -------
+    record : dict
+        'name', 'time' (the median in ms, which graph.py plots), the summary
+        of summarize(), 'warmup', 'peak_rss_kb', 'traced_peak_bytes' and, if
+        expected is given, 'accuracy': the fraction of texts whose matches are
+        correct, and 'correct'
+    matches :
+        what func returned
+    """
+    for _ in range(warmup):
+        matches = func()
+
+    times = []
+    for _ in range(repeats):
+        start = clock_ns()
+        matches = func()
+        times.append(clock_ns() - start)
+
+    #one more run under tracemalloc, which would distort the timed ones
+    traced_peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func()
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    record = {'name': name, 'warmup': warmup, 'peak_rss_kb': peak_rss_kb(),
+              'traced_peak_bytes': traced_peak}
+    record.update(summarize(times))
+    record['time'] = record['median_ms']
+    if expected is not None:
+        record['accuracy'] = match_sets_equal(matches, expected)
+        record['correct'] = record['accuracy'] == 1.0
+    return record, matches
+
+def run_record(**fields):
+    """ The record of one benchmark run, which holds the algorithms' records """
+    record = {'schema_version': SCHEMA_VERSION, 'environment': environment()}
+    record.update(fields)
+    return record
+
+def record_key(record, algorithm):
+    """ Identifies an algorithm's record across runs """
+    return (algorithm['name'], algorithm.get('backend'),
+            algorithm.get('chunk_size'), record.get('substring'),
+            record.get('text_length'), record.get('k'))
+
+def diff_records(baseline, current):
+    """
+    Pairs up the algorithms of two lists of run records.
+
+    Returns
+    -------
+    rows : list of (key, baseline median, current median, ratio)
+        sorted by key, for the algorithms that are in both
+    """
+    for record in baseline + current:
+        if record.get('schema_version') != SCHEMA_VERSION:
+            raise Exception('cannot compare records of schema version {}'
+                            .format(record.get('schema_version')))
+
+    medians = {}
+    for record in baseline:
+        for a in record['algorithms']:
+            medians[record_key(record, a)] = a['median_ms']
+
+    rows = []
+    for record in current:
+        for a in record['algorithms']:
+            key = record_key(record, a)
+            if key in medians:
+                rows.append((key, medians[key], a['median_ms'],
+                             a['median_ms'] / medians[key]))
+    return sorted(rows)
+
+def load_records(path):
+    """ Reads the run records that analysis.py printed, one per line """
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('{'):
+                records.append(json.loads(line))
+    return records
+
+if __name__ == '__main__':
+    for key, before, after, ratio in diff_records(load_records(sys.argv[1]),
+                                                  load_records(sys.argv[2])):
+        key = ' '.join(str(field) for field in key if field is not None)
+        print '%-40s %10.3f ms %10.3f ms %6.2fx' % (key, before, after, ratio)
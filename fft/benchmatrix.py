@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+'''
+Runs every algorithm in fftmatch.py, cvmatch.py and boyermoore.py over a matrix
+of text lengths n, pattern lengths m, numbers of texts k and chunk sizes, on
+synthetic genomes from synth.py.
+
+The results are written in the format of ../results/genes_data, one file for
+every graph.py plot, so that the graphs can be reproduced from scratch:
+
+    $ python benchmatrix.py -o ../results/synthetic_data
+    $ python graph.py -k ../results/synthetic_data/performance_by_k
+
+performance_matrix has the records of every algorithm at every point.
+'''
+import argparse
+import collections
+import json
+import os
+import bench
+import boyermoore as bm
+import fftmatch as fft
+import synth
+
+def per_text(func):
+    return lambda texts, pattern, chunk_size: [func(t, pattern) for t in texts]
+
+#name -> function(texts, pattern, chunk_size) that returns the matches of
+#every text. The names that graph.py plots are kept from analysis.py.
+ALGORITHMS = collections.OrderedDict([
+    ('naive', per_text(fft.naive_string_match_index)),
+    ('nlogn_1d', per_text(fft.fft_match_index_n_log_n)),
+    ('nlogm', lambda texts, pattern, chunk_size:
+        [fft.fft_match_index_n_log_m(t, pattern, chunk_size) for t in texts]),
+    ('nlogn', lambda texts, pattern, chunk_size:
+        fft.fft_match_index_n_sq_log_n(texts, pattern)),
+    ('nlogn_naive', lambda texts, pattern, chunk_size:
+        fft.fft_match_index_n_sq_log_n_naive(texts, pattern)),
+    ('nlogm_naive', lambda texts, pattern, chunk_size:
+        fft.fft_match_index_n_sq_log_m_naive(texts, pattern)),
+    ('n_sq_log_m', lambda texts, pattern, chunk_size:
+        fft.fft_match_index_n_sq_log_m(texts, pattern, chunk_size)),
+    ('nlogm_exact', lambda texts, pattern, chunk_size:
+        [fft.fft_match_index_n_log_m(t, pattern, chunk_size, exact=True)
+         for t in texts]),
+    ('opencv', lambda texts, pattern, chunk_size:
+        cvmatch.cv_match_index(texts, pattern)),
+    ('opencv_chunk', lambda texts, pattern, chunk_size:
+        cvmatch.cv_match_index_chunk(texts, pattern, chunk_size)),
+])
+
+#the algorithms whose running time depends on the chunk size
+CHUNKED = set(['nlogm', 'n_sq_log_m', 'nlogm_exact', 'opencv_chunk'])
+
+try:
+    import cvmatch
+except ImportError:
+    cvmatch = None
+    del ALGORITHMS['opencv'], ALGORITHMS['opencv_chunk']
+
+def run_point(genomes, pattern, names, chunk_sizes, repeats, warmup):
+    """
+    Benchmarks the algorithms on one set of genomes and one pattern.
+
+    Returns
+    -------
+    records : list of list of dict
+        for every usable chunk size, the records of Boyer-Moore and of every
+        algorithm.  The chunk size does not change the algorithms that aren't
+        chunked, so they are only run once.
+    """
+    boyermoore_data, expected = bench.benchmark('boyermoore',
+        lambda: bm.boyer_moore_mult_match_index(genomes, pattern),
+        repeats=repeats, warmup=warmup)
+    boyermoore_data['accuracy'] = 1
+    boyermoore_data['correct'] = True
+
+    unchunked = []
+    for name in names:
+        if name not in CHUNKED:
+            data, _ = bench.benchmark(name,
+                lambda: ALGORITHMS[name](genomes, pattern, 'm'),
+                expected, repeats, warmup)
+            unchunked.append(data)
+
+    records = []
+    for chunk_size in chunk_sizes:
+        #the chunked algorithms miss matches if chunks are shorter than m
+        if chunk_size != 'm' and chunk_size < len(pattern):
+            continue
+        chunked = []
+        for name in names:
+            if name in CHUNKED:
+                data, _ = bench.benchmark(name,
+                    lambda: ALGORITHMS[name](genomes, pattern, chunk_size),
+                    expected, repeats, warmup)
+                data['chunk_size'] = chunk_size
+                chunked.append(data)
+        records.append([boyermoore_data] + unchunked + chunked)
+    return records
+
+def run_matrix(lengths, pattern_lengths, ks, chunk_sizes, names, repeats=3,
+               warmup=1, seed=0, gc_content=0.5, repeat_unit='CAG',
+               repeat_density=0.002):
+    """
+    Benchmarks the algorithms at every combination of text length, pattern
+    length, k and chunk size.  The pattern of length m is the repeat unit
+    repeated to m characters.
+
+    Returns
+    -------
+    records : list of dict
+        one bench.run_record per combination
+    """
+    records = []
+    for n in lengths:
+        for k in ks:
+            genomes = synth.generate_genomes(k, n, gc_content, repeat_unit,
+                                             repeat_density, seed=seed)
+            for m in pattern_lengths:
+                pattern = (repeat_unit * m)[:m]
+                points = run_point(genomes, pattern, names, chunk_sizes,
+                                   repeats, warmup)
+                for chunk_size, algorithms in zip(
+                        [c for c in chunk_sizes if c == 'm' or c >= m],
+                        points):
+                    records.append(bench.run_record(substring=pattern,
+                        substring_length=m, text_length=n, k=k,
+                        chunk_size=chunk_size, seed=seed,
+                        gc_content=gc_content,
+                        repeat_density=repeat_density,
+                        algorithms=algorithms))
+    return records
+
+def select(records, names, rename=None, **fixed):
+    """
+    Returns copies of the records whose fields have the fixed values, with only
+    the algorithms in names, renamed with rename.
+    """
+    rename = rename or {}
+    selected = []
+    for record in records:
+        if any(record[key] != value for key, value in fixed.items()):
+            continue
+        record = dict(record)
+        record['algorithms'] = [dict(a, name=rename.get(a['name'], a['name']))
+                                for a in record['algorithms']
+                                if a['name'] in names]
+        selected.append(record)
+    return selected
+
+def write_records(path, title, command, records):
+    """ Writes records in the format that graph.py reads """
+    with open(path, 'w') as f:
+        f.write(title + '\n')
+        f.write('Run with: ' + command + '\n')
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+def write_graph_files(records, out, command, lengths, pattern_lengths, ks,
+                      chunk_sizes):
+    """
+    Writes the sweeps that graph.py plots.  The axes that a sweep doesn't vary
+    are fixed at the first pattern length and k, at chunk size 'm' and at the
+    longest text length.
+    """
+    m, k, n = pattern_lengths[0], ks[0], lengths[-1]
+
+    write_records(os.path.join(out, 'performance_by_text_length'),
+        'Running analysis of time vs text length.', command,
+        select(records, ['boyermoore', 'nlogn', 'nlogm', 'opencv'],
+               substring_length=m, k=k, chunk_size='m'))
+
+    write_records(os.path.join(out, 'performance_by_k'),
+        'Running algorithm analysis of time vs number of texts, of text '
+        'length {}.'.format(n), command,
+        select(records, ['boyermoore', 'nlogn', 'opencv'],
+               substring_length=m, text_length=n, chunk_size='m'))
+
+    write_records(os.path.join(out, 'nlogm_performance_by_chunk_size'),
+        'Running nklogm analysis of time vs chunk size.', command,
+        [r for r in select(records, ['boyermoore', 'nlogm'],
+                           substring_length=m, text_length=n, k=k)
+         if r['chunk_size'] != 'm'])
+
+    if cvmatch is not None:
+        write_records(os.path.join(out, 'opencv_performance_by_chunk_size'),
+            'Running opencv analysis of time vs chunk size.', command,
+            [r for r in select(records, ['boyermoore', 'opencv_chunk'],
+                               rename={'opencv_chunk': 'opencv'},
+                               substring_length=m, text_length=n, k=k)
+             if r['chunk_size'] != 'm'])
+
+    write_records(os.path.join(out, 'performance_matrix'),
+        'Running every algorithm on the whole matrix.', command, records)
+
+def chunk_size_arg(value):
+    return value if value == 'm' else int(value)
+
+if __name__ == '__main__':
+    import sys
+
+    parser = argparse.ArgumentParser(description='Benchmark every algorithm \
+on synthetic genomes.')
+    parser.add_argument('-n', '--lengths', type=int, nargs='+',
+                        default=[256, 1024, 4096], help='Text lengths')
+    parser.add_argument('-m', '--pattern-lengths', type=int, nargs='+',
+                        default=[3, 12], help='Pattern lengths')
+    parser.add_argument('-k', '--ks', type=int, nargs='+', default=[1, 4, 16],
+                        help='Numbers of texts')
+    parser.add_argument('-c', '--chunk-sizes', type=chunk_size_arg, nargs='+',
+                        default=['m', 6, 24, 96, 300], help="Chunk sizes, \
+'m' for the pattern length")
+    parser.add_argument('-a', '--algorithms', nargs='+',
+                        choices=list(ALGORITHMS), default=list(ALGORITHMS))
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    parser.add_argument('-w', '--warmup', type=int, default=1)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--gc', type=float, default=0.5, help='GC content')
+    parser.add_argument('--repeat-density', type=float, default=0.002,
+                        help='Expected number of CAG tracts per base')
+    parser.add_argument('-o', '--out', default='../results/synthetic_data',
+                        help='Output directory')
+    args = parser.parse_args()
+
+    if 'm' not in args.chunk_sizes:
+        args.chunk_sizes.insert(0, 'm')
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+
+    records = run_matrix(args.lengths, args.pattern_lengths, args.ks,
+                         args.chunk_sizes, args.algorithms, args.repeats,
+                         args.warmup, args.seed, args.gc,
+                         repeat_density=args.repeat_density)
+    write_graph_files(records, args.out, 'python ' + ' '.join(sys.argv),
+                      args.lengths, args.pattern_lengths, args.ks,
+                      args.chunk_sizes)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+'''
+Per-genome Bloom filters of k-mers, to skip the genomes that can't contain a
+pattern.
+
+A rare primer has no match in most genomes, but fft_match_index_n_sq_log_m
+and cv_match_index_chunk still correlate every row of the k X N matrix.  A
+KmerBloom is a bit array with HASHES bits set for every k-mer of A, C, G and T
+of a genome.  A genome that contains the pattern contains every k-mer of the
+pattern, so if one of them is missing from the filter, the genome provably has
+no match; the other way around, a filter can only let through a few genomes
+that don't match.  The searches take one filter per text (or None) and only
+correlate the texts that pass:
+
+    blooms = [bloom.KmerBloom.from_string(t) for t in texts]
+    fftmatch.fft_match_index_n_sq_log_m(texts, primer, blooms=blooms)
+
+The filters are built once and stored next to the FASTA files, which
+cli.py --bloom loads; -V logs how many genomes the filters skipped:
+
+    $ python bloom.py ../genomes/*.fa
+    $ python cli.py --bloom -V -a nlogm ACGTTGCAGCAGCAGTTG ../genomes/*.fa
+'''
+import argparse
+import logging
+import os
+import numpy as np
+from kmerindex import kmer_codes, check_k
+import stages
+
+log = logging.getLogger('bloom')
+
+#the default k-mer length.  The filters only tell genomes apart when they have
+#far fewer than the 4^K possible k-mers.
+K = 16
+
+#bits of the filter per k-mer of the genome, and bits set per k-mer.  A k-mer
+#that isn't in the genome passes with a probability of about 15%, so a
+#pattern with a few more characters than K rarely does.
+BITS_PER_KMER = 4
+HASHES = 2
+
+#odd 64 bit multipliers of the multiply-shift hash functions
+MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F,
+                        0x165667B19E3779F9, 0xD6E8FEB86659FD93],
+                       dtype=np.uint64)
+
+#the filter of genome.fa is saved as genome.fa.bloom.npz
+SUFFIX = '.bloom.npz'
+
+class KmerBloom(object):
+    """
+    A Bloom filter of the k-mers of a genome.
+
+    Arguments
+    ---------
+    bits : uint8 numpy array
+        the bit array, 8 bits per byte as np.packbits packs them, with a power
+        of two length in bits
+    k : int
+    hashes : int
+        the number of bits of every k-mer, at most len(MULTIPLIERS)
+    """
+    def __init__(self, bits, k, hashes=HASHES):
+        check_k(k)
+        if not 0 < hashes <= len(MULTIPLIERS):
+            raise Exception('a filter has 1 to {} hashes'
+                            .format(len(MULTIPLIERS)))
+        self.bits = bits
+        self.k = k
+        self.hashes = hashes
+
+    @classmethod
+    def from_string(cls, text, k=K, bits_per_kmer=BITS_PER_KMER,
+                    hashes=HASHES):
+        with stages.stage('bloom'):
+            _, codes = kmer_codes(text, k)
+            #a power of two number of bits, at least a byte of them
+            size = 1 << max(3, int(np.ceil(np.log2(max(1, bits_per_kmer *
+                                                       len(codes))))))
+            #8 bits per byte, the first one in the highest bit, the way
+            #np.packbits packs them
+            bits = np.zeros(size // 8, dtype=np.uint8)
+            indices = bit_indices(codes, size, hashes).ravel()
+            #one bit position at a time: the copies of a byte in a pass all
+            #set the same bit, so it doesn't matter which one is written last,
+            #and it's faster than np.bitwise_or.at
+            for bit in range(8):
+                selected = indices[(indices & 7) == bit] >> 3
+                bits[selected] |= np.uint8(128 >> bit)
+            stages.allocated(bits.nbytes)
+        return cls(bits, k, hashes)
+
+    def might_contain(self, pattern):
+        """
+        Whether the genome can contain the pattern.  Patterns shorter than k,
+        or without a k-mer of A, C, G and T, always can.
+        """
+        _, codes = kmer_codes(pattern, self.k)
+        indices = bit_indices(codes, 8*len(self.bits), self.hashes)
+        found = (self.bits[indices >> 3] >> (7 - (indices & 7))) & 1
+        return bool(found.all())
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def save(self, path):
+        """ Writes the filter to path, an .npz file """
+        np.savez(path, bits=self.bits, k=self.k, hashes=self.hashes)
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        return cls(arrays['bits'], int(arrays['k']), int(arrays['hashes']))
+
+def bit_indices(codes, size, hashes):
+    """
+    Returns the hashes X len(codes) bits of k-mer codes in a filter of size
+    bits, a power of two: the top bits of the codes times MULTIPLIERS
+    """
+    shift = np.uint64(64 - (size.bit_length() - 1))
+    codes = codes.astype(np.uint64)
+    out = np.empty((hashes, len(codes)), dtype=np.int64)
+    for row, multiplier in zip(out, MULTIPLIERS[:hashes]):
+        row[:] = (codes * multiplier) >> shift
+    return out
+
+def load_beside(path):
+    """ Returns the filter saved next to a genome file, or None """
+    if not os.path.exists(path + SUFFIX):
+        return None
+    return KmerBloom.load(path + SUFFIX)
+
+def prefilter(blooms, pattern):
+    """
+    Returns which texts can contain the pattern, and logs how many were
+    skipped.
+
+    Arguments
+    ---------
+    blooms : list of KmerBloom or None
+        the filter of every text, None for the texts without one
+    pattern : str
+    """
+    with stages.stage('prefilter'):
+        keep = np.array([b is None or b.might_contain(pattern)
+                         for b in blooms], dtype=bool)
+    skipped = len(keep) - keep.sum()
+    log.info('skipped %d of %d texts (%.1f%%) that cannot contain the pattern',
+             skipped, len(keep), 100.0 * skipped / max(1, len(keep)))
+    return keep
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the k-mer Bloom \
+filter of one-record FASTA files, saved next to every file as FILE{}, which \
+cli.py --bloom uses to skip genomes.'.format(SUFFIX))
+    parser.add_argument('genomes', nargs='+', help='FASTA files')
+    parser.add_argument('-k', type=int, default=K, help='Length of the \
+k-mers.  Patterns shorter than k are never skipped. Default={}'.format(K))
+    parser.add_argument('-b', '--bits', type=int, default=BITS_PER_KMER,
+                        help='Bits per k-mer. Default={}'.format(BITS_PER_KMER))
+    args = parser.parse_args()
+
+    for path in args.genomes:
+        with open(path) as f:
+            f.readline()
+            genome = ''.join(line.rstrip() for line in f)
+        genome_bloom = KmerBloom.from_string(genome, args.k, args.bits)
+        genome_bloom.save(path + SUFFIX)
+        print '{}: {} bases, {} byte filter'.format(path + SUFFIX, len(genome),
+                                                    genome_bloom.nbytes)
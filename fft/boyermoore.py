@@ -6,11 +6,13 @@ https://github.com/BenLangmead/comp-genomics-class/blob/master/notebooks/CG_Boye
 Includes a wrapper for boyer_moore() that follows the same function interface
 from fftmatch.py
 
-def boyer_moore_match_index(text, pattern)
+def boyer_moore_match_index(text, pattern, mode='index', limit=None)
 '''
 
+import itertools
 import string
 import numpy as np
+from fftmatch import check_mode, search_unique
 
 
 def z_array(s):
@@ -150,8 +152,10 @@ class BoyerMoore(object):
 
     def bad_character_rule(self, i, c):
         """ Return # skips given by bad character rule at offset i """
-        assert c in self.amap
         assert i < len(self.bad_char)
+        if c not in self.amap:
+            # c isn't in the pattern, so skip past it
+            return i + 1
         ci = self.amap[c]
         return i - (self.bad_char[i][ci]-1)
 
@@ -173,8 +177,14 @@ class BoyerMoore(object):
 
 def boyer_moore(p, p_bm, t):
     """ Do Boyer-Moore matching """
+    return list(boyer_moore_occurrences(p, p_bm, t))
+
+def boyer_moore_occurrences(p, p_bm, t):
+    """
+    Generates the occurrences of p in t in order, so that a search can stop
+    after the first few
+    """
     i = 0
-    occurrences = []
     while i < len(t) - len(p) + 1:
         shift = 1
         mismatched = False
@@ -186,26 +196,37 @@ def boyer_moore(p, p_bm, t):
                 mismatched = True
                 break
         if not mismatched:
-            occurrences.append(i)
+            yield i
             skip_gs = p_bm.match_skip()
             shift = max(shift, skip_gs)
         i += shift
-    return occurrences
 
-def boyer_moore_match_index(text, pattern):
+def boyer_moore_match_index(text, pattern, mode='index', limit=None):
     '''Wrapper for Boyer Moore that uses the same interface as the other
-    functions we developed'''
-    if len(pattern) == 1:
-        return np.array([i for i, x in enumerate(text) if x == pattern])
-    p_bm = BoyerMoore(pattern)#, alphabet='abcdefghijklmnopqrstuvwxyz')
+    functions we developed.
 
-    return np.array(boyer_moore(pattern, p_bm, text))
-
-def boyer_moore_mult_match_index(texts, pattern):
+    mode='count' returns the number of matches instead of their indices, and
+    limit stops the search after that many matches.'''
+    check_mode(mode, limit)
+    if len(pattern) == 1:
+        occurrences = (i for i, x in enumerate(text) if x == pattern)
+    else:
+        # the characters of the pattern, the texts can have any others
+        p_bm = BoyerMoore(pattern, alphabet=sorted(set(pattern)))
+        occurrences = boyer_moore_occurrences(pattern, p_bm, text)
+
+    occurrences = itertools.islice(occurrences, limit)
+    if mode == 'count':
+        return sum(1 for _ in occurrences)
+    return np.array(list(occurrences))
+
+@search_unique
+def boyer_moore_mult_match_index(texts, pattern, mode='index', limit=None):
     '''Wrapper for Boyer Moore on multiple texts that uses the same interface
     as the other functions we developed.'''
 
-    return np.array([boyer_moore_match_index(i, pattern) for i in texts])
+    return np.array([boyer_moore_match_index(i, pattern, mode, limit)
+                     for i in texts])
 
 if __name__ == "__main__":
     t = 'haystack needle haystack' # "text" - thing we search in
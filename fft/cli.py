@@ -4,16 +4,29 @@ import fftmatch as fft
 import boyermoore as bm
 import argparse
 import collections
-import cvmatch
+import logging
+import sys
+import shiftor
+import dispatch
+import stages
+import output
+import packed
+import kmerindex
+import bloom
+import pipeline
+import numpy as np
 
 parser = argparse.ArgumentParser(description='Search for a substring in a \
 genome')
 
-# Algorithm flag: Options= nlogn, nlogm, boyer moore; Default=nlogm
-parser.add_argument('-a','--algorithm', choices=["nlogn", "nlogm", "boyermoore",
-"opencv"],
-                    default='nlogm', nargs='?', help='The algorithm that you \
-want to run the search on. Default=nlogm')
+# Algorithm flag: Options= auto, nlogn, nlogm, boyer moore, opencv, shiftor,
+# kmer; Default=auto, which picks the algorithm with dispatch.py's cost model
+parser.add_argument('-a','--algorithm', choices=["auto", "nlogn", "nlogm",
+"boyermoore", "opencv", "shiftor", "kmer"],
+                    default='auto', nargs='?', help='The algorithm that you \
+want to run the search on. Default=auto, the fastest one according to the \
+cost model from analysis.py --calibrate.  kmer searches the k-mer indexes \
+that kmerindex.py builds, which are given instead of the genomes')
 
 # Pattern arg: substring to search genomes for.
 parser.add_argument('pattern', help='The pattern that you want to search for in\
@@ -21,60 +34,209 @@ parser.add_argument('pattern', help='The pattern that you want to search for in\
 
 # Genome arg: Genomes to search
 parser.add_argument('genomes', nargs='+',
-                    help='1 or more fastq files (.fa). \
-You can also pass in 1 or more genomes, separated by spaces')
+                    help='1 or more one-record FASTA files (.fa), \
+separated by spaces, or with -a kmer the paths of k-mer indexes.  Search \
+FASTQ reads with fastq.py')
 
 parser.add_argument('-b', type=int, nargs='?', help='b for \
 nlogm', default=0)
 
+parser.add_argument('-w', '--workers', type=int, default=1, help='Number of \
+threads that search the chunks for nlogm. Default=1')
+
+parser.add_argument('-d', '--mismatches', type=int, default=0, help='Number \
+of mismatching characters a match may have, for -a shiftor, which -a auto \
+then uses. Default=0')
+
+parser.add_argument('-V', '--verbose', action='store_true', help='Log the \
+algorithm that auto chose, and its estimated and actual time')
+
+parser.add_argument('-f', '--format', choices=output.FORMATS, default='text',
+                    help='How to write the matches: text, tsv or bed lines, \
+one JSON object per genome, or delta encoded npy arrays. Default=text')
+
+parser.add_argument('-c', '--count', action='store_true', help='Only write \
+the number of matches in every genome')
+
+parser.add_argument('-l', '--limit', type=int, help='Stop searching a genome \
+after this many matches')
+
+parser.add_argument('--density', type=int, metavar='BIN_SIZE', help='Write \
+the number of matches in every BIN_SIZE bases of every genome instead of the \
+matches, as npy arrays of the bin size, the titles and the genomes X bins \
+counts, which graph.py -H draws.  Searches with nlogm')
+
+parser.add_argument('-p', '--pipeline', action='store_true', help='Read \
+and encode the next genome while searching the current one, and write the \
+matches on another thread, so that only a few genomes are held at a time. \
+Writes the genomes in the order of the files, and the throughput in bases/s \
+to stderr')
+
+parser.add_argument('--queue-depth', type=int, default=pipeline.QUEUE_DEPTH,
+                    help='Number of genomes that the --pipeline reader can be \
+ahead of the search. Default={}'.format(pipeline.QUEUE_DEPTH))
+
+parser.add_argument('--bloom', action='store_true', help='Skip the genomes \
+whose k-mer Bloom filter, built next to the FASTA file by bloom.py, rules the \
+pattern out.  -V logs how many were skipped.  For nlogm and opencv')
+
+parser.add_argument('--profile', choices=['json', 'folded'], help='Write the \
+time, calls and allocated bytes of every stage of the search, as JSON or in \
+the folded stack format of flamegraph.pl')
+
+parser.add_argument('--profile-out', help='File to write the profile to. \
+Default=stderr')
+
 
 args = parser.parse_args()
 genomes = {}
 
+mode = 'count' if args.count else 'index'
+if args.count and args.format not in output.COUNT_FORMATS:
+    parser.error('--count can only be written in the {} formats'
+                 .format(', '.join(output.COUNT_FORMATS)))
+if args.limit is not None and args.limit <= 0:
+    parser.error('--limit must be positive')
+if args.density is not None and (args.density <= 0 or args.count or
+                                 args.limit is not None):
+    parser.error('--density must be positive, without --count or --limit')
+if args.pipeline and (args.density is not None or args.queue_depth <= 0):
+    parser.error('--pipeline needs a positive --queue-depth, and no --density')
+if args.mismatches > 0 and args.algorithm not in ['shiftor', 'auto']:
+    parser.error('--mismatches only works with -a shiftor or -a auto')
+if (args.mismatches > 0 or args.algorithm == 'shiftor') and \
+   len(args.pattern) > shiftor.MAX_PATTERN_LENGTH:
+    parser.error('-a shiftor and --mismatches need a pattern of at most {} \
+characters'.format(shiftor.MAX_PATTERN_LENGTH))
+if args.algorithm == 'kmer' and (args.pipeline or args.density is not None):
+    parser.error('-a kmer searches prebuilt indexes, without --pipeline or \
+--density')
+if args.bloom and (args.pipeline or args.algorithm not in ['nlogm', 'opencv']):
+    parser.error('--bloom only works with -a nlogm or -a opencv, without \
+--pipeline')
+
 if args.b == 0:
     args.b='m'
 
-count = {}
+if args.verbose:
+    logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+
+if args.algorithm == 'auto' and args.mismatches > 0:
+    #the only algorithm that allows mismatches
+    args.algorithm = 'shiftor'
 
-# Scan files and store the title and genome string in genomes dictionary
-for genome_fn in args.genomes:
-    with open(genome_fn) as gn:
-        title = gn.readline().rstrip()
-        genome = ''
-        for line in gn:
-            genome += line.rstrip()
+if args.profile:
+    profiler = stages.Profiler()
+    profiler.start()
 
-    if title in count:
-        count[title] += 1
-    else:
-        count[title] = 1
-    title = title + str(count[title])
-    genomes[title] = genome
+# Scan files and store the title and genome string in genomes dictionary,
+# unless the pipeline reads them one at a time or they are indexed
+paths = {}
+if not args.pipeline and args.algorithm != 'kmer':
+    for path, (title, genome) in zip(args.genomes,
+                                     pipeline.read_records(args.genomes)):
+        genomes[title] = genome
+        paths[title] = path
 
 sorted_genomes = collections.OrderedDict(sorted(genomes.items(),
                                       key=lambda t: t[0]))
 genome_strings = sorted_genomes.values()
 genome_titles = sorted_genomes.keys()
 
+# The Bloom filters of the genomes, in the order of genome_titles
+blooms = None
+if args.bloom:
+    blooms = [bloom.load_beside(paths[title]) for title in genome_titles]
+
 # Parse args
-if args.algorithm == 'nlogn':
-    for gn in genomes:
-        matches = fft.fft_match_index_n_log_n(genomes[gn], args.pattern)
-        print gn, ': Found matches at indices', matches.tolist()
-elif args.algorithm == 'nlogm':
-    if len(genomes) > 1:
-        matches = fft.fft_match_index_n_sq_log_m(genomes.values(),\
-        args.pattern[0], args.b)
-        print 'found matches at', matches.tolist()
-    else:
+writer = output.MatchWriter(sys.stdout, args.pattern, args.format, mode)
+if args.pipeline:
+    # Read and encode the next genome while searching the current one, and
+    # write the matches on another thread, one genome at a time
+    encode = None
+    if args.algorithm == 'auto':
+        search = lambda genome: fft.reduce_matches(
+            dispatch.match_index([genome], args.pattern)[0], mode, args.limit)
+    elif args.algorithm == 'nlogn':
+        search = lambda genome: fft.fft_match_index_n_log_n(genome,
+            args.pattern, mode=mode, limit=args.limit)
+    elif args.algorithm == 'nlogm':
+        encode = packed.PackedGenome.from_string
+        search = lambda genome: fft.fft_match_index_n_log_m(genome,
+            args.pattern, args.b, workers=args.workers, mode=mode,
+            limit=args.limit)
+    elif args.algorithm == 'boyermoore':
+        search = lambda genome: bm.boyer_moore_match_index(genome,
+            args.pattern, mode=mode, limit=args.limit)
+    elif args.algorithm == 'opencv':
+        import cvmatch
+        search = lambda genome: cvmatch.cv_match_index_chunk([genome],
+            args.pattern, args.b, mode, args.limit)[0]
+    elif args.algorithm == 'shiftor':
+        search = lambda genome: fft.reduce_matches(
+            shiftor.shift_or_mult_match_index([genome], args.pattern,
+                                              args.mismatches)[0],
+            mode, args.limit)
+
+with stages.stage(args.algorithm):
+    if args.pipeline:
+        throughput = pipeline.run(pipeline.read_records(args.genomes), search,
+                                  writer.write, encode, args.queue_depth)
+        sys.stderr.write('{}\n'.format(throughput))
+    elif args.density is not None:
+        density = fft.fft_match_index_n_sq_log_m(genome_strings, args.pattern,
+            args.b, workers=args.workers, density=args.density, blooms=blooms)
+        np.save(sys.stdout, np.array(args.density))
+        np.save(sys.stdout, np.array(genome_titles))
+        np.save(sys.stdout, density)
+    elif args.algorithm == 'auto':
+        matches = dispatch.match_index(genome_strings, args.pattern)
+        for gn, gn_matches in zip(genome_titles, matches):
+            writer.write(gn, fft.reduce_matches(gn_matches, mode, args.limit))
+    elif args.algorithm == 'nlogn':
         for gn in genomes:
-            matches = fft.fft_match_index_n_log_m(genomes[gn], args.pattern[0],args.b)
-            print gn, ': Found matches at indices', matches.tolist()
-elif args.algorithm == 'boyermoore':
-    for gn in genomes:
-        matches = bm.boyer_moore_match_index(genomes[gn], args.pattern)
-        print gn, ': Found matches at indices', matches.tolist()
-elif args.algorithm == 'opencv':
-    matches = cvmatch.cv_match_index_chunk(genomes.values(), args.pattern[0], args.b)
-    print genomes[genomes.keys()[0]]
-    print genomes.keys(), ': Found matches at indices', matches.tolist()
+            writer.write(gn, fft.fft_match_index_n_log_n(genomes[gn],
+                            args.pattern, mode=mode, limit=args.limit))
+    elif args.algorithm == 'nlogm':
+        if len(genomes) > 1 or args.bloom:
+            matches = fft.fft_match_index_n_sq_log_m(genome_strings,
+                args.pattern, args.b, workers=args.workers, mode=mode,
+                limit=args.limit, blooms=blooms)
+            for gn, gn_matches in zip(genome_titles, matches):
+                writer.write(gn, gn_matches)
+        else:
+            for gn in genomes:
+                writer.write(gn, fft.fft_match_index_n_log_m(genomes[gn],
+                    args.pattern, args.b, workers=args.workers, mode=mode,
+                    limit=args.limit))
+    elif args.algorithm == 'boyermoore':
+        for gn in genomes:
+            writer.write(gn, bm.boyer_moore_match_index(genomes[gn],
+                            args.pattern, mode=mode, limit=args.limit))
+    elif args.algorithm == 'opencv':
+        #OpenCV is slow to import, so only import it when it's asked for
+        import cvmatch
+        matches = cvmatch.cv_match_index_chunk(genome_strings, args.pattern,
+                                               args.b, mode, args.limit,
+                                               blooms)
+        for gn, gn_matches in zip(genome_titles, matches):
+            writer.write(gn, gn_matches)
+    elif args.algorithm == 'shiftor':
+        matches = shiftor.shift_or_mult_match_index(genome_strings,
+                    args.pattern, args.mismatches)
+        for gn, gn_matches in zip(genome_titles, matches):
+            writer.write(gn, fft.reduce_matches(gn_matches, mode, args.limit))
+    elif args.algorithm == 'kmer':
+        for path in args.genomes:
+            index = kmerindex.KmerIndex.load(path)
+            matches = index.match_index(args.pattern, mode, args.limit)
+            for gn, gn_matches in zip(index.titles, matches):
+                writer.write(gn, gn_matches)
+
+if args.profile:
+    profiler.stop()
+    out = open(args.profile_out, 'w') if args.profile_out else sys.stderr
+    out.write((profiler.to_json() if args.profile == 'json'
+               else profiler.to_folded()) + '\n')
+    if args.profile_out:
+        out.close()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+'''
+Client for server.py, for scripting searches of the genomes that it keeps in
+memory.
+
+    $ python client.py CAG CTG -g ">chr1 test1"
+
+    import client
+    for genome, pattern, matches in client.search(['CAG', 'CTG']):
+        ...
+'''
+import argparse
+import json
+import urllib2
+import numpy as np
+
+#server.DEFAULT_PORT, which isn't imported so that the client starts quickly
+DEFAULT_PORT = 8642
+
+def url(host, port, path):
+    return 'http://{}:{}{}'.format(host, port, path)
+
+def request(host, port, path, body=None):
+    data = None if body is None else json.dumps(body)
+    req = urllib2.Request(url(host, port, path), data,
+                          {'Content-Type': 'application/json'})
+    try:
+        return urllib2.urlopen(req)
+    except urllib2.HTTPError as e:
+        raise Exception('server error {}: {}'.format(e.code, e.read().strip()))
+
+def genomes(host='127.0.0.1', port=DEFAULT_PORT):
+    """ Returns the (title, length) of the genomes that the server has """
+    response = request(host, port, '/genomes')
+    return [(g['title'], g['length']) for g in json.load(response)]
+
+def search(patterns, titles=None, host='127.0.0.1', port=DEFAULT_PORT):
+    """
+    Searches the server's genomes for the patterns.
+
+    Arguments
+    ---------
+    patterns : list of str
+    titles : list of str or None
+        the titles of the genomes to search, None for all of them
+
+    Returns
+    -------
+    results : generator of (title, pattern, matches)
+        in the order that the server streams them, with the matches as a
+        numpy array of 0-based indices
+
+    Raises an Exception when the request or a search fails, even after
+    some results were generated.
+    """
+    body = {'patterns': list(patterns)}
+    if titles:
+        body['genomes'] = list(titles)
+    response = request(host, port, '/search', body)
+    try:
+        for line in iter(response.readline, ''):
+            result = json.loads(line)
+            if 'error' in result:
+                #a genome failed after the others were streamed
+                raise Exception('server error: {}'.format(result['error']))
+            yield (result['genome'], result['pattern'],
+                   np.array(result['matches'], dtype=int))
+    finally:
+        response.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search the genomes of a \
+running server.py')
+    parser.add_argument('patterns', nargs='*', help='The patterns to search \
+for')
+    parser.add_argument('-g', '--genomes', nargs='+', help='Titles of the \
+genomes to search. Default=all')
+    parser.add_argument('-l', '--list', action='store_true', help='List the \
+genomes of the server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    if args.list:
+        for title, length in genomes(args.host, args.port):
+            print title, length
+    if args.patterns:
+        for title, pattern, matches in search(args.patterns, args.genomes,
+                                              args.host, args.port):
+            print title, pattern, ': Found matches at indices', \
+                matches.tolist()
@@ -1,7 +1,11 @@
 import cv2
-import cv
 import numpy as np
-from fftmatch import string_to_binary_array, texts_to_array
+from fftmatch import string_to_binary_array, texts_to_array, chunk_starts, \
+                     window_width, check_mode, reduce_matches, search_unique, \
+                     fill_skipped, \
+                     MATCH_THRESHOLD
+from packed import decode_rows, is_packed
+import stages
 
 def texts_to_array(texts):
     """
@@ -18,7 +22,7 @@ def texts_to_array(texts):
         k X N array with the float ascii representation of all of the texts
     """
     n = max(map(len, texts))
-    out = np.ndarray((len(texts), n))
+    out = np.zeros((len(texts), n))
     for index, row in enumerate(texts):
         out[index,0:len(row)] = string_to_binary_array(row)
 
@@ -38,33 +42,51 @@ def cv_match(texts_arr, pattern_arr, alg=cv2.TM_SQDIFF):
     Returns
     -------
     """
-    matches = cv2.matchTemplate(texts_arr, pattern_arr, cv2.TM_SQDIFF)
+    with stages.stage('matchTemplate'):
+        matches = cv2.matchTemplate(texts_arr, pattern_arr, cv2.TM_SQDIFF)
+        stages.allocated(matches.nbytes)
     #matches = np.nonzero(abs(matches) < 1.0e-4)
-    matches = np.where(abs(matches) < 1.0e-6)
-    out = []
-    for i in range(texts_arr.shape[0]):
-        out.append(matches[1][np.where(matches[0] ==i)])
+    with stages.stage('threshold'):
+        matches = np.where(abs(matches) < MATCH_THRESHOLD)
+        out = []
+        for i in range(texts_arr.shape[0]):
+            out.append(matches[1][np.where(matches[0] ==i)])
 
     return np.array(out)
 
-def cv_match_index(texts, pattern):
+@search_unique
+def cv_match_index(texts, pattern, mode='index', limit=None):
     """
     This method uses Open CV's template matching algorithm to do substring
     matching inside of len(texts) genome strings for the specified pattern
-    """
-
-    texts = texts_to_array(texts)
-    pattern = np.array([string_to_binary_array(pattern)])\
-        .astype(np.float32)
 
-    return cv_match(texts, pattern)
-
-def cv_match_index_chunk(texts, pattern, chunk_size='m'):
+    With mode='count' it returns the number of matches in every text, and
+    with a limit only the first limit matches of every text are returned (or
+    counted).
+    """
+    check_mode(mode, limit)
+    if max(map(len, texts)) < len(pattern):
+        #matchTemplate would swap the texts and the pattern
+        matches = np.array([np.array([], dtype=int) for _ in texts])
+    else:
+        with stages.stage('encode'):
+            texts = texts_to_array(texts)
+            pattern = np.array([string_to_binary_array(pattern)])\
+                .astype(np.float32)
+
+        matches = cv_match(texts, pattern)
+    if mode == 'index' and limit is None:
+        return matches
+    return np.array([reduce_matches(a, mode, limit) for a in matches])
+
+@search_unique
+def cv_match_index_chunk(texts, pattern, chunk_size='m', mode='index',
+                         limit=None, blooms=None):
     """
     Performs the cv_match_index algorithm on chunks that are 'chunk_size' long.
     If the length of the portion of the text that we're sampling is less than 
-    the length of the pattern, we pad the end with 0s. Change this if 0s are in 
-    the alphabet.
+    the length of the pattern, we pad the end with 0s, the null character,
+    which no character of a text matches.
 
     This is similar to fftmatch.fft_match_index_n_log_m, but it operates on
     multiple texts at the same time.
@@ -72,8 +94,9 @@ def cv_match_index_chunk(texts, pattern, chunk_size='m'):
 
     Arguments
     ---------
-    texts : list of str
-        the genomic strings to search
+    texts : list of str or packed.PackedGenome
+        the genomic strings to search.  Packed genomes are decoded a window at
+        a time.
     pattern : str 
         the pattern that may be contained in multiple locations inside the text
     chunk_size : type str or int
@@ -81,43 +104,93 @@ def cv_match_index_chunk(texts, pattern, chunk_size='m'):
             which breaks the string into 2m size chunks and performs the
             fft match index algorithm on those chunks
         if a positive integer, it will break up the string into size 
-            2*chunk_size chunks
+            2*chunk_size chunks, or chunk_size + m - 1 if the pattern is
+            longer than chunk_size
+    mode : str
+        'index' to return the matches, 'count' to return how many there are
+        in every text, without keeping their indices
+    limit : int or None
+        stop at the first chunk after which every text has this many matches,
+        and only return (or count) the first limit matches of every text
+    blooms : list of bloom.KmerBloom or None
+        the k-mer filter of every text, see
+        fftmatch.fft_match_index_n_sq_log_m
 
     returns: a list containing the 0-based indices of matches of pattern in text
     """
     if not (chunk_size == 'm' or ((type(chunk_size) == int) and chunk_size>0)):
         raise Exception('fft_match_index_n_log_m chunk_size must be str or \
 positive integer')
+    check_mode(mode, limit)
+    if blooms is not None:
+        from bloom import prefilter
+        keep = prefilter(blooms, pattern)
+        if not keep.all():
+            kept = [t for t, passed in zip(texts, keep) if passed]
+            matches = cv_match_index_chunk(kept, pattern, chunk_size, mode,
+                                           limit) if kept else []
+            return fill_skipped(matches, keep, mode)
+    k = len(texts)
     n = max(map(len, texts))
 
     m = len(pattern)
 
-    texts = texts_to_array(texts)
-
-    pattern = np.array([string_to_binary_array(pattern)])\
-        .astype(np.float32)
+    packed = is_packed(texts)
+    with stages.stage('encode'):
+        if not packed:
+            texts = texts_to_array(texts)
 
-    start = 0
+        pattern = np.array([string_to_binary_array(pattern)])\
+            .astype(np.float32)
 
     if chunk_size == 'm':
         chunk_size = m
 
-    indices = [np.array([])] * texts.shape[0]
-    while start < n-chunk_size:
-        index = cv_match(texts[:,start:start+chunk_size*2], pattern)
-        for i in range(len(indices)):
-            if index[i].shape > 0:
-                indices[i] = np.append(indices[i], start+index[i])
-
-        start += chunk_size
-
-    out = [[]]*texts.shape[0]
-    for i in range(len(out)):
-        out[i] = np.unique(indices[i]).astype(int)
+    indices = [[np.array([], dtype=int)] for _ in range(k)]
+    counts = np.zeros(k, dtype=np.int64)
+    width = window_width(chunk_size, m)
+    #texts shorter than a chunk are searched in one window
+    starts = chunk_starts(n, chunk_size) if n >= m else []
+    if len(starts) and not packed:
+        #the last window may run past the end of the texts
+        texts = np.pad(texts, ((0, 0), (0, max(0, starts[-1] + width - n))),
+                       mode='constant')
+    for start in starts:
+        if packed:
+            with stages.stage('decode'):
+                window = decode_rows(texts, start, start + width, np.float32,
+                                     fill=0)
+        else:
+            window = texts[:,start:start+width]
+        index = cv_match(window, pattern)
+        with stages.stage('append'):
+            #every match is kept by the window whose first chunk_size
+            #characters contain it, or by the last window, so that the
+            #overlapping windows don't report it twice
+            last = start == starts[-1]
+            for i in range(k):
+                owned = index[i] if last else index[i][index[i] < chunk_size]
+                counts[i] += len(owned)
+                if mode == 'index':
+                    indices[i].append(start + owned)
+
+        if limit is not None and counts.min() >= limit:
+            break
+
+    if mode == 'count':
+        return counts if limit is None else np.minimum(counts, limit)
+
+    out = [[]]*k
+    with stages.stage('concatenate'):
+        for i in range(len(out)):
+            out[i] = reduce_matches(np.concatenate(indices[i]).astype(int),
+                                    limit=limit)
 
     return np.array(out)
 
 def cv_match_index_gpu(texts, pattern):
+    #the legacy OpenCV module is slow to import and only needed here
+    import cv
     texts = texts_to_array(texts)
     pattern = cv.fromarray(texts_to_array(pattern))
     texts = cv.fromarray(texts)
@@ -0,0 +1,208 @@
+'''
+Chooses the match-index algorithm for a query with a cost model.
+
+Which algorithm is fastest depends on the number of texts k, their length n
+and the length of the pattern m (see results/genes_data).  The cost model
+estimates the running time of every algorithm as
+
+    time = overhead + rate * work(k, n, m)
+
+where work is the algorithm's asymptotic cost, and overhead and rate are fit
+to timings by `python analysis.py --calibrate`.  Until then the DEFAULT_MODEL
+rates are used.
+
+    match_index(texts, pattern)
+'''
+import json
+import logging
+import math
+import os
+import time
+import numpy as np
+from fftbackend import installed
+from fftmatch import search_unique
+
+log = logging.getLogger('dispatch')
+
+#where analysis.py --calibrate saves the fitted model
+COST_MODEL_PATH = os.environ.get('FFTMATCH_COST_MODEL',
+                    os.path.join(os.path.expanduser('~'),
+                                 '.fftmatch_cost_model.json'))
+
+#asymptotic work of every algorithm for k texts of length n, pattern length m
+WORK = {
+    'boyermoore': lambda k, n, m: k*n,
+    'shiftor': lambda k, n, m: k*n,
+    'nlogm': lambda k, n, m: k*n*math.log(2*m, 2),
+    'nlogn': lambda k, n, m: k*n*math.log(max(n, 2), 2),
+    'opencv': lambda k, n, m: k*n*m,
+}
+
+#(overhead in ms, rate in ms per unit of work), from analysis.py --calibrate
+#with CAG on 1 and 4 random texts of 25,000 to 400,000 bases
+DEFAULT_MODEL = {
+    'boyermoore': (0.0, 1.0e-3),
+    'shiftor': (11.0, 1.7e-5),
+    'nlogm': (2.3, 3.5e-5),
+    'nlogn': (0.0, 2.0e-5),
+    'opencv': (170.0, 1.8e-3),
+}
+
+#queries on fewer characters than this are transformed with numpy.fft, which
+#is faster for them than importing pyFFTW and planning the transforms
+NUMPY_FFT_CHARACTERS = 1 << 15
+
+def fft_backend(texts):
+    """ The FFT backend of a query, None for the fastest installed one """
+    return 'numpy' if sum(map(len, texts)) < NUMPY_FFT_CHARACTERS else None
+
+#match_index has already searched every distinct text once, so the algorithms
+#search the texts as they are, with the search of search_unique
+def boyer_moore(texts, pattern):
+    import boyermoore
+    return boyermoore.boyer_moore_mult_match_index.__wrapped__(texts, pattern)
+
+def shift_or(texts, pattern):
+    import shiftor
+    return shiftor.shift_or_mult_match_index.__wrapped__(texts, pattern)
+
+def n_log_m(texts, pattern):
+    import fftmatch
+    return fftmatch.fft_match_index_n_sq_log_m.__wrapped__(texts, pattern,
+        backend=fft_backend(texts))
+
+def n_log_n(texts, pattern):
+    import fftmatch
+    return fftmatch.fft_match_index_n_sq_log_n.__wrapped__(texts, pattern,
+        backend=fft_backend(texts))
+
+def opencv(texts, pattern):
+    import cvmatch
+    return cvmatch.cv_match_index_chunk.__wrapped__(texts, pattern)
+
+#multi-text match-index functions, with the interface of
+#boyermoore.boyer_moore_mult_match_index
+ALGORITHMS = {
+    'boyermoore': boyer_moore,
+    'shiftor': shift_or,
+    'nlogm': n_log_m,
+    'nlogn': n_log_n,
+    'opencv': opencv,
+}
+
+def available_algorithms(pattern_length):
+    """
+    Returns the names of the algorithms that can search for the pattern.
+    OpenCV is slow to import, so it is only looked up, and imported once
+    opencv is chosen.
+    """
+    names = ['boyermoore', 'nlogm', 'nlogn']
+    if pattern_length <= 64:
+        names.append('shiftor')
+    if installed('cv2'):
+        names.append('opencv')
+    return sorted(names)
+
+class CostModel(object):
+    """
+    Estimates the running time of the algorithms, in milliseconds.
+
+    Arguments
+    ---------
+    params : dict
+        algorithm name -> (overhead, rate).  Algorithms that are missing use
+        DEFAULT_MODEL.
+    """
+    def __init__(self, params=None):
+        self.params = dict(DEFAULT_MODEL)
+        if params:
+            self.params.update((name, tuple(p)) for name, p in params.items())
+
+    def estimate(self, algorithm, k, n, m):
+        overhead, rate = self.params[algorithm]
+        return overhead + rate*WORK[algorithm](k, n, m)
+
+    @classmethod
+    def fit(cls, samples):
+        """
+        Fits overhead and rate of every algorithm to timings by least squares.
+
+        Arguments
+        ---------
+        samples : list of dict
+            each with the keys 'name', 'k', 'text_length', 'substring_length'
+            and 'time' (in ms)
+        """
+        params = {}
+        for name in WORK:
+            runs = [s for s in samples if s['name'] == name]
+            if not runs:
+                continue
+            work = np.array([WORK[name](s['k'], s['text_length'],
+                                        s['substring_length']) for s in runs])
+            times = np.array([s['time'] for s in runs])
+            a = np.vstack([np.ones(len(runs)), work]).T
+            overhead, rate = np.linalg.lstsq(a, times, rcond=None)[0]
+            if overhead < 0 or rate <= 0:
+                #not enough spread in the runs to fit both
+                overhead, rate = 0.0, times.sum() / work.sum()
+            params[name] = (float(overhead), float(rate))
+        return cls(params)
+
+    def save(self, path=None):
+        with open(path or COST_MODEL_PATH, 'w') as f:
+            json.dump(self.params, f, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path=None):
+        """ Loads the calibrated model, or the default one if there is none """
+        path = path or COST_MODEL_PATH
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls(json.load(f))
+
+def choose_algorithm(texts, pattern, model=None):
+    """
+    Returns the name of the algorithm with the smallest estimated time, and
+    a dictionary with the estimates of all of the available algorithms.
+    """
+    model = model or CostModel.load()
+    k, n, m = len(texts), max(map(len, texts)), len(pattern)
+    estimates = dict((name, model.estimate(name, k, n, m))
+                     for name in available_algorithms(m))
+    return min(estimates, key=estimates.get), estimates
+
+@search_unique
+def match_index(texts, pattern, algorithm='auto', model=None):
+    '''Solves the match-index problem for multiple texts with the algorithm
+    that the cost model estimates to be the fastest.
+
+    Arguments
+    ---------
+    texts : list of str
+    pattern : str
+    algorithm : str
+        'auto', or the name of an algorithm in ALGORITHMS to force it
+    model : CostModel or None
+        None loads the calibrated model from COST_MODEL_PATH
+
+    Returns
+    -------
+    matches : numpy array
+        k rows, the i'th row has the 0-based indices of matches in texts[i]
+    '''
+    model = model or CostModel.load()
+    if algorithm == 'auto':
+        algorithm, estimates = choose_algorithm(texts, pattern, model)
+        log.debug('estimates in ms: %s', estimates)
+    estimate = model.estimate(algorithm, len(texts), max(map(len, texts)),
+                              len(pattern))
+
+    start = time.time()
+    matches = ALGORITHMS[algorithm](texts, pattern)
+    actual = (time.time() - start) * 1000
+
+    log.info('%s: estimated %.2f ms, took %.2f ms', algorithm, estimate,
+             actual)
+    return matches
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+'''
+Matching millions of short FASTQ reads.
+
+Searching reads one python call at a time costs more than the search itself.
+read_batches groups the reads of a FASTQ file (optionally gzipped) into
+batches of BATCH_READS reads, encoded as one uint8 row per read and padded
+with the null character 0 to the longest read of the batch.  match_reads
+searches every batch with a single batched correlation,
+fftmatch.fft_match_index_batch on all of its rows at once, and streams out the
+(read id, offset) of every hit:
+
+    for read_id, offset in fastq.match_reads('reads.fastq.gz', 'CAGCAGCAG'):
+        ...
+
+    $ python fastq.py CAGCAGCAG reads.fastq.gz > hits.tsv
+'''
+import argparse
+import gzip
+import io
+import itertools
+import sys
+import numpy as np
+import fftmatch
+import stages
+
+#reads per batch
+BATCH_READS = 1 << 14
+
+GZIP_MAGIC = '\x1f\x8b'
+
+def open_reads(path):
+    """ Opens a FASTQ file, gzipped or not, or stdin for '-' """
+    if path == '-':
+        return sys.stdin
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == GZIP_MAGIC:
+        return io.BufferedReader(gzip.open(path, 'rb'))
+    return open(path, 'rb')
+
+def read_batches(f, batch_reads=BATCH_READS):
+    """
+    Generates the reads of a FASTQ file in batches.
+
+    Arguments
+    ---------
+    f : file
+        an open FASTQ file, with 4 lines per read
+    batch_reads : int
+        the number of reads of every batch but the last
+
+    Yields
+    ------
+    ids : list of str
+        the id of every read, the first word of its header
+    codes : len(ids) X L uint8 numpy array
+        the characters of every read, padded with 0 to the longest read L
+    lengths : int64 numpy array
+        the length of every read
+    """
+    while True:
+        with stages.stage('read'):
+            lines = list(itertools.islice(f, 4*batch_reads))
+        if not lines:
+            return
+        if len(lines) % 4 or \
+           not all(header.startswith('@') for header in lines[0::4]) or \
+           not all(separator.startswith('+') for separator in lines[2::4]):
+            raise Exception('not a FASTQ file with 4 lines per read')
+
+        with stages.stage('encode'):
+            ids = [header[1:].split(None, 1)[0] if header[1:].strip() else ''
+                   for header in lines[0::4]]
+            reads = [line.rstrip() for line in lines[1::4]]
+            lengths = np.array(map(len, reads), dtype=np.int64)
+            width = lengths.max()
+            codes = np.frombuffer(''.join(reads), dtype=np.uint8)
+            if lengths.min() < width:
+                #the characters of every read, at the start of its row
+                padded = np.zeros((len(reads), width), dtype=np.uint8)
+                padded[np.arange(width) < lengths[:, np.newaxis]] = codes
+                codes = padded
+            codes = codes.reshape(len(reads), width)
+        yield ids, codes, lengths
+
+def search_batch(codes, lengths, pattern, workspaces, backend=None):
+    """
+    Searches every read of a batch for the pattern, with one batched
+    correlation.
+
+    Arguments
+    ---------
+    codes : r X L uint8 numpy array
+    lengths : int64 numpy array
+    pattern : str
+    workspaces : dict
+        batch width -> fftmatch.Workspace of the pattern, which is filled in
+        for the widths that it doesn't have yet
+    backend : str, backend or None
+
+    Returns
+    -------
+    rows, offsets : numpy arrays
+        the read and the 0-based offset of every hit, in read order
+    """
+    m = len(pattern)
+    width = codes.shape[1]
+    if width < m:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty
+
+    if width not in workspaces:
+        with stages.stage('pattern'):
+            workspaces[width] = fftmatch.Workspace(
+                fftmatch.string_to_binary_array(pattern[::-1], size=width), m,
+                backend)
+    rows, offsets = fftmatch.fft_match_index_batch(codes.astype(np.float64),
+                                                   workspaces[width])
+    keep = offsets + m <= lengths[rows]
+    return rows[keep], offsets[keep]
+
+def match_reads(path, pattern, batch_reads=BATCH_READS, backend=None):
+    """
+    Generates the (read id, offset) of every hit of the pattern in the reads
+    of a FASTQ file, a batch at a time
+    """
+    workspaces = {}
+    f = open_reads(path)
+    try:
+        for ids, codes, lengths in read_batches(f, batch_reads):
+            rows, offsets = search_batch(codes, lengths, pattern, workspaces,
+                                         backend)
+            for row, offset in zip(rows.tolist(), offsets.tolist()):
+                yield ids[row], offset
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search the reads of FASTQ \
+files for a pattern, and write the read id and offset of every hit as tab \
+separated lines.')
+    parser.add_argument('pattern', help='The pattern to search for')
+    parser.add_argument('reads', nargs='+', help='FASTQ files, gzipped or \
+not, or - for stdin')
+    parser.add_argument('-b', '--batch', type=int, default=BATCH_READS,
+                        help='Reads per batch. Default={}'.format(BATCH_READS))
+    parser.add_argument('-c', '--count', action='store_true', help='Only \
+write the number of hits')
+    args = parser.parse_args()
+
+    hits = itertools.chain.from_iterable(match_reads(path, args.pattern,
+                                                     args.batch)
+                                         for path in args.reads)
+    if args.count:
+        print sum(1 for _ in hits)
+    else:
+        for read_id, offset in hits:
+            sys.stdout.write('{}\t{}\n'.format(read_id, offset))
@@ -0,0 +1,232 @@
+'''
+FFT backends for the match-index algorithms in fftmatch.py.
+
+Every backend has the same interface (fft, ifft, fft2, ifft2, rfft, irfft) so
+that the algorithms do not depend on where the transforms come from.
+
+    numpy   numpy.fft, always available
+    scipy   scipy.fft (scipy >= 1.4), which can use several threads
+    fftw    pyFFTW, which keeps FFTW plans and aligned buffers for the
+            transform shapes that each thread used last
+
+get_backend(None) returns the fastest backend that is installed.  scipy and
+pyFFTW are slow to import, so whether they are installed is looked up without
+importing them, and they are only imported when their backend is first used.
+'''
+import collections
+import imp
+import importlib
+import threading
+import numpy as np
+
+#module name -> whether it is installed
+found_modules = {}
+
+def installed(name):
+    """
+    Whether the module name, e.g. 'scipy.fft', can be found on the path,
+    without importing it or its packages
+    """
+    if name not in found_modules:
+        path = None
+        try:
+            for part in name.split('.'):
+                f, pathname, _ = imp.find_module(part, path)
+                if f is not None:
+                    f.close()
+                path = [pathname]
+            found_modules[name] = True
+        except ImportError:
+            found_modules[name] = False
+    return found_modules[name]
+
+class NumpyBackend(object):
+    """ Transforms with numpy.fft.  workers is ignored. """
+    name = 'numpy'
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def fft(self, a, axis=-1, workers=1):
+        return np.fft.fft(a, axis=axis)
+
+    def ifft(self, a, axis=-1, workers=1):
+        return np.fft.ifft(a, axis=axis)
+
+    def fft2(self, a, workers=1):
+        return np.fft.fft2(a)
+
+    def ifft2(self, a, workers=1):
+        return np.fft.ifft2(a)
+
+    def rfft(self, a, axis=-1, workers=1):
+        return np.fft.rfft(a, axis=axis)
+
+    def irfft(self, a, n, axis=-1, workers=1):
+        return np.fft.irfft(a, n, axis=axis)
+
+class ScipyBackend(NumpyBackend):
+    """ Transforms with scipy.fft, which spreads batches over workers threads """
+    name = 'scipy'
+
+    @classmethod
+    def available(cls):
+        return installed('scipy.fft')
+
+    def __init__(self):
+        self.module = importlib.import_module('scipy.fft')
+
+    def fft(self, a, axis=-1, workers=1):
+        return self.module.fft(a, axis=axis, workers=workers)
+
+    def ifft(self, a, axis=-1, workers=1):
+        return self.module.ifft(a, axis=axis, workers=workers)
+
+    def fft2(self, a, workers=1):
+        return self.module.fft2(a, workers=workers)
+
+    def ifft2(self, a, workers=1):
+        return self.module.ifft2(a, workers=workers)
+
+    def rfft(self, a, axis=-1, workers=1):
+        return self.module.rfft(a, axis=axis, workers=workers)
+
+    def irfft(self, a, n, axis=-1, workers=1):
+        return self.module.irfft(a, n, axis=axis, workers=workers)
+
+class FFTWBackend(NumpyBackend):
+    """
+    Transforms with pyFFTW.
+
+    Planning is expensive, so a plan is built once for every transform kind,
+    shape, dtype and thread count, and reused afterwards.  Each plan owns
+    aligned input and output buffers; the input is copied into the input
+    buffer and the output is copied out, since the next call overwrites it.
+    A plan can only run one transform at a time, so every thread has its own
+    plans, and the threads that search the chunks transform in parallel.
+    Each thread keeps its plan_cache_size most recently used plans.
+    """
+    name = 'fftw'
+
+    #FFTW_MEASURE plans run faster, but take much longer to make, which only
+    #pays off for long chunked scans
+    planner_effort = 'FFTW_ESTIMATE'
+
+    #plans (and buffers) that every thread keeps
+    plan_cache_size = 8
+
+    @classmethod
+    def available(cls):
+        return installed('pyfftw.builders')
+
+    def __init__(self):
+        self.pyfftw = importlib.import_module('pyfftw')
+        importlib.import_module('pyfftw.builders')
+        #key -> plan of the calling thread, least recently used first
+        self.local = threading.local()
+        #the FFTW planner isn't thread safe
+        self.lock = threading.Lock()
+
+    def plan(self, kind, a, workers, **kwargs):
+        """ Returns the calling thread's plan of the transform of a """
+        if not hasattr(self.local, 'plans'):
+            self.local.plans = collections.OrderedDict()
+        plans = self.local.plans
+        key = (kind, a.shape, a.dtype.str, workers,
+               tuple(sorted(kwargs.items())))
+        if key in plans:
+            #the most recently used one goes last
+            plans[key] = plans.pop(key)
+            return plans[key]
+
+        with self.lock:
+            buf = self.pyfftw.empty_aligned(a.shape, dtype=a.dtype)
+            build = getattr(self.pyfftw.builders, kind)
+            plans[key] = build(buf, threads=workers,
+                               planner_effort=self.planner_effort, **kwargs)
+        if len(plans) > self.plan_cache_size:
+            plans.popitem(last=False)
+        return plans[key]
+
+    def execute(self, kind, a, workers, **kwargs):
+        #like numpy.fft, always transform in double precision
+        a = np.asarray(a)
+        if a.dtype.kind == 'c':
+            a = a.astype(np.complex128, copy=False)
+        else:
+            a = a.astype(np.float64, copy=False)
+        return self.plan(kind, a, workers, **kwargs)(a).copy()
+
+    def fft(self, a, axis=-1, workers=1):
+        return self.execute('fft', a, workers, axis=axis)
+
+    def ifft(self, a, axis=-1, workers=1):
+        return self.execute('ifft', a, workers, axis=axis)
+
+    def fft2(self, a, workers=1):
+        return self.execute('fft2', a, workers)
+
+    def ifft2(self, a, workers=1):
+        return self.execute('ifft2', a, workers)
+
+    def rfft(self, a, axis=-1, workers=1):
+        return self.execute('rfft', a, workers, axis=axis)
+
+    def irfft(self, a, n, axis=-1, workers=1):
+        return self.execute('irfft', a, workers, n=n, axis=axis)
+
+#registered backends, slowest first
+BACKENDS = collections.OrderedDict()
+
+#backend instances, so that their plans are shared by every caller
+instances = {}
+
+def register_backend(cls):
+    """
+    Registers an FFT backend class under cls.name.  Backends registered later
+    are preferred over the earlier ones by get_backend(None).
+    """
+    BACKENDS[cls.name] = cls
+    return cls
+
+def available_backends():
+    """
+    Returns the names of the installed backends, fastest first.  None of them
+    is imported.
+    """
+    return [name for name, cls in reversed(BACKENDS.items())
+            if cls.available()]
+
+def get_backend(backend=None):
+    """
+    Returns an FFT backend.
+
+    Arguments
+    ---------
+    backend : None, str or backend
+        None returns the fastest installed backend that imports, a str
+        returns the backend registered with that name, and a backend is
+        returned unchanged.
+    """
+    if backend is None:
+        for name in available_backends():
+            try:
+                return get_backend(name)
+            except ImportError:
+                #found on the path, but broken
+                continue
+    if not isinstance(backend, str):
+        return backend
+    if backend not in BACKENDS:
+        raise Exception('unknown FFT backend {}, choose from {}'
+                        .format(backend, ', '.join(BACKENDS)))
+    if not BACKENDS[backend].available():
+        raise Exception('FFT backend {} is not installed'.format(backend))
+    if backend not in instances:
+        instances[backend] = BACKENDS[backend]()
+    return instances[backend]
+
+register_backend(NumpyBackend)
+register_backend(ScipyBackend)
+register_backend(FFTWBackend)
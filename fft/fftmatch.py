@@ -2,9 +2,159 @@
 Implementation of the FFT match-index problem for finding one substring inside
 a source text (genome).
 '''
+from multiprocessing.pool import ThreadPool
+import functools
+import hashlib
+import inspect
+import threading
 import numpy as np
+from fftbackend import get_backend
+from repeats import repeat_runs, RunAccumulator
+from ntt import NTTWorkspace, ntt_match_index_batch, check_exact
+from packed import PackedGenome, decode_rows, is_packed, code_range
+import stages
+
+#the arguments of the searches that have one entry per text
+PER_TEXT_ARGUMENTS = ['blooms']
+
+#the chunked algorithms transform about this many text elements per batch
+BATCH_ELEMENTS = 1 << 16
+
+#the thread pools of map_batches by number of threads.  They are kept for the
+#next scan, because joining a pool takes up to 0.1 s on python 2.
+pools = {}
+pools_lock = threading.Lock()
+
+#what the match-index functions return: the indices of the matches, or how
+#many there are
+MODES = ['index', 'count']
+
+#the correlations are sums of products of character codes, so they are whole
+#numbers: 0 for a match and at least 1 for a mismatch.  Anything closer to 0
+#than this is a match, which leaves room for the rounding errors of long
+#transforms.
+MATCH_THRESHOLD = 0.5
+
+#the chunked algorithms can also return the tandem repeat runs of the pattern,
+#see repeats.py
+CHUNKED_MODES = MODES + ['runs']
+
+def check_mode(mode, limit, modes=MODES):
+    if mode not in modes:
+        raise Exception('mode must be one of {}'.format(', '.join(modes)))
+    if not (limit is None or ((type(limit) == int) and limit > 0)):
+        raise Exception('limit must be None or a positive integer')
+    if mode == 'runs' and limit is not None:
+        raise Exception('the runs cannot be limited')
+
+def check_density(density, mode, limit):
+    if density is None:
+        return
+    if not ((type(density) == int) and density > 0):
+        raise Exception('density must be None or a positive bin size')
+    if mode != 'index' or limit is not None:
+        raise Exception('the density cannot be counted or limited')
+
+def reduce_matches(matches, mode='index', limit=None):
+    """
+    Returns the first limit of the sorted matches of a text, or how many of
+    them there are if mode is 'count'
+    """
+    if limit is not None:
+        matches = matches[:limit]
+    return len(matches) if mode == 'count' else matches
+
+def text_key(text):
+    """
+    Returns a key that is equal for texts with equal contents: the str itself,
+    whose hash python computes from its characters, or a digest of the bases
+    and the mask of a packed genome
+    """
+    if isinstance(text, PackedGenome):
+        return (len(text), hashlib.sha1(np.ascontiguousarray(text.bases))
+                .digest(), text.mask.tostring())
+    return text
 
-def string_to_binary_array(s, size=None, pad=False):
+def unique_texts(texts):
+    """
+    Returns the distinct texts, in the order of their first copy, and the
+    index in them of every text
+    """
+    first = {}
+    unique = []
+    inverse = np.empty(len(texts), dtype=np.int64)
+    with stages.stage('unique'):
+        for index, text in enumerate(texts):
+            key = text_key(text)
+            if key not in first:
+                first[key] = len(unique)
+                unique.append(text)
+            inverse[index] = first[key]
+    return unique, inverse
+
+def search_unique(search):
+    """
+    Wraps search(texts, pattern, ...), a search of many texts that returns one
+    row per text, so that every distinct text is only searched once.  The
+    copies of a text get the same row, in the order of texts.  The
+    PER_TEXT_ARGUMENTS, passed by position or by name, get the entries of the
+    first copy of every text.  wrapper.__wrapped__ is the undeduplicated
+    search.
+    """
+    texts_name = inspect.getargspec(search).args[0]
+
+    @functools.wraps(search)
+    def wrapper(*args, **kwargs):
+        arguments = inspect.getcallargs(search, *args, **kwargs)
+        unique, inverse = unique_texts(arguments[texts_name])
+        if len(unique) == len(inverse):
+            return search(*args, **kwargs)
+        arguments[texts_name] = unique
+        firsts = np.unique(inverse, return_index=True)[1]
+        for name in PER_TEXT_ARGUMENTS:
+            if arguments.get(name) is not None:
+                arguments[name] = [arguments[name][i] for i in firsts]
+        return np.asarray(search(**arguments))[inverse]
+    #the search itself, for callers whose texts are already distinct
+    wrapper.__wrapped__ = search
+    return wrapper
+
+def fill_skipped(matches, keep, mode='index', density=None, n=0):
+    """
+    Returns the rows of every text, from matches for the texts that keep
+    marks and empty rows for the texts that a prefilter skipped.
+
+    Arguments
+    ---------
+    matches : numpy array
+        the result of a search of the kept texts
+    keep : bool numpy array
+    mode : str
+    density : int or None
+        the bin size of a density search
+    n : int
+        the length of the longest text, for the bins of a density search
+    """
+    k = len(keep)
+    if mode == 'count':
+        out = np.zeros(k, dtype=np.int64)
+        out[keep] = matches
+        return out
+    if density is not None:
+        out = np.zeros((k, -(-n // density)), dtype=np.int64)
+        if len(matches):
+            out[keep, :matches.shape[1]] = matches[:, :out.shape[1]]
+        return out
+    if mode == 'runs':
+        empty = np.zeros((0, 2), dtype=np.int64)
+    else:
+        empty = np.array([], dtype=np.int64)
+    out = [empty] * k
+    for i, row in zip(np.flatnonzero(keep), matches):
+        out[i] = row
+    return np.array(out)
+
+def string_to_binary_array(s, size=None):
     """
     Converts a string to a numpy array of the ord values of the characters
 
@@ -13,11 +163,8 @@ def string_to_binary_array(s, size=None, pad=False):
     s : string
         The string that will be converted to a numpy array
     size : int
-        The size of the array that will be created
-    pad : bool
-        if False, characters in indices from len(s) to size will be 0
-        if True, characters in indicesfrom len(s) to size will be '0',
-            which is our null character
+        The size of the array that will be created.  The characters in
+        indices from len(s) to size are 0, which is our null character
 
     Returns
     -------
@@ -27,15 +174,19 @@ def string_to_binary_array(s, size=None, pad=False):
     #TODO: check dtype for the algorithm
     #A,C,G,T = [np.zeros(len(s) if not size else size) for _ in range(4)]
     t = np.zeros(len(s) if not size else size)
-    for index, val in enumerate(s):
-        t[index] = float(ord(val))
-
-    #set the rest to the null character
-    if pad:
-        t[len(s):] = ord('0')
+    t[:len(s)] = np.frombuffer(s, dtype=np.uint8)
 
     return t
 
+def mask_wildcards(arr, wildcard):
+    """
+    Sets the wildcard character of a binary encoded text or pattern to 0, in
+    place.  The three-term kernel matches 0 to any character.
+    """
+    if wildcard is not None:
+        arr[arr == ord(wildcard)] = 0
+    return arr
+
 def texts_to_array(texts):
     """
     Converts texts into an array of floats of their ascii representation
@@ -53,7 +204,7 @@ def texts_to_array(texts):
     n = max(map(len, texts))
     out = np.ndarray((len(texts), n))
     for index, row in enumerate(texts):
-        out[index,:] = string_to_binary_array(row,n, pad=True)
+        out[index,:] = string_to_binary_array(row,n)
 
     return out.astype(np.float32)
 
@@ -79,12 +230,22 @@ def naive_string_match_index(text, pattern):
             matches.append(i)
     return np.array(matches)
 
-def fft_match_index(text, pattern, n, m):
+def fft_match_index(text, pattern, n, m, backend=None, workspace=None,
+                    wildcard=None):
     '''Does the n log n FFT pattern matching algorithm.  This solves the match
     index problem by returning a list of indices where the pattern matches the
     text.
 
-    Does cross-correlation solving the following equation:
+    Computes the sum of squared differences of the pattern and every window of
+    the text:
+    S_{i} = \sum_{j=1}^{m} (p_{j} - t_{i+j-1})^{2}
+          = \sum_{j=1}^{m} p_{j}^{2} - 2\sum_{j=1}^{m} p_{j}t_{i+j-1}
+            + \sum_{j=1}^{m} t_{i+j-1}^{2}
+    The middle term is one cross-correlation, which is solved in Fourier
+    space, and the last one is a sliding window sum of a cumulative sum.
+
+    With a wildcard, which is encoded as 0, the three-term correlation is
+    solved instead:
     S_{i} = \sum_{j=1}^{m} (p_{j}^{3} t_{i+j-1} - 2p_{j}^{2}t_{i+j-1}^{2}
                               + p_{j}t_{i+j-1}^{3})
     This can be solved in Fourier space using FFT's of each of the three terms.
@@ -101,84 +262,69 @@ def fft_match_index(text, pattern, n, m):
       n: the length of the text
       m: the length of the pattern
       indexOffset: offset to start from
+      backend: the fftbackend name or backend to transform with, None for the
+        fastest installed one
+      workspace: a Workspace made for this pattern and n, so that repeated
+        searches for the pattern reuse its buffers and pattern spectra
+      wildcard: None, or a character that matches any character, in the text
+        and in the pattern
     returns: a list containing the 0-based indices of matches of pattern in text
     '''
 
     #Note: len(fft(something)) != len(something) for general case
 
-    pattern = pattern[::-1]
-
-    binary_encoded_text = string_to_binary_array(text)
+    if n < m:
+        return np.array([], dtype=int)
 
-    #TODO: for binary_encoded_text and pattern, if the char is equal to the
-    # don't care character, then set the float value to 0.0
-    text = binary_encoded_text
-    text_sq = text * text
-    text_cube = text_sq * text
-
-    binary_encoded_pattern = string_to_binary_array(pattern,size=n)
+    with stages.stage('encode'):
+        binary_encoded_text = mask_wildcards(string_to_binary_array(text),
+                                             wildcard)
+        binary_encoded_pattern = mask_wildcards(
+            string_to_binary_array(pattern[::-1],size=n), wildcard)
 
     assert len(binary_encoded_text) == len(binary_encoded_pattern)
 
-    pattern = binary_encoded_pattern
-    pattern_sq = pattern * pattern
-    pattern_cube = pattern_sq * pattern
-
-    text_key = np.fft.fft(text)
-    text_sq_key = np.fft.fft(text_sq)
-    text_cube_key = np.fft.fft(text_cube)
-
-    pattern_key = np.fft.fft(pattern)
-    pattern_sq_key = np.fft.fft(pattern_sq)
-    pattern_cube_key = np.fft.fft(pattern_cube)
-
-    #there are three terms.  Since fft(key) is Linear, we will IFT each
-    #individually
-    out_term_1_key = pattern_cube_key * text_key
-    out_term_2_key =  pattern_sq_key * text_sq_key
-    out_term_3_key = pattern_key * text_cube_key
-
-    out_term_1 = np.fft.ifft(out_term_1_key)
-    out_term_2 = -2*np.fft.ifft(out_term_2_key)
-    out_term_3 = np.fft.ifft(out_term_3_key)
-
-    #TODO: may need to rotate this
-    out = out_term_1 + out_term_2 + out_term_3
+    if workspace is None or workspace.width != n or \
+       workspace.wildcard != (wildcard is not None):
+        with stages.stage('pattern'):
+            workspace = Workspace(binary_encoded_pattern, m, backend=backend,
+                                  wildcard=wildcard is not None)
 
-    #this should be 0 if match
-    #TODO: figure out the difference between exact and inexact.
-    #I think true matches where 0 and possible matches below this threshold
-    matches = np.where(abs(out) < 1.0e-6)[0]
-
-    #this is actually rotated based on the end of the string, so we need to
-    #subtract m-i-1
-    matches = np.subtract(matches, m-1)
-
-    #since the FFT works on the unit circle, we can actually get matches that
-    #start at the end of the string and end at the beginning.  This doesn't
-    #make sense for DNA so we are going to remove all matches whose index
-    #is less than 0.  These are the matches that span the end-start boundary
-    return matches[matches >= 0]
+    _, matches = fft_match_index_batch(binary_encoded_text[np.newaxis, :],
+                                       workspace)
+    return matches
 
-def fft_match_index_n_log_n(text, pattern):
+def fft_match_index_n_log_n(text, pattern, backend=None, mode='index',
+                            limit=None, wildcard=None):
     '''Does the n log n FFT pattern matching algorithm.
 
     arguments:
       text: the text that you are interested in searching
       pattern: the pattern that may be contained in multiple locations inside
         the text
+      backend: the fftbackend name or backend to transform with
+      mode: 'index' to return the matches, 'count' to return how many there
+        are
+      limit: None, or the number of matches to stop at
+      wildcard: None, or a character that matches any character
     returns: a list containing the 0-based indices of matches of pattern in text
     '''
-    return fft_match_index(text, pattern, len(text), len(pattern))
-
-def fft_match_index_n_log_m(text, pattern, chunk_size='m'):
+    check_mode(mode, limit)
+    return reduce_matches(fft_match_index(text, pattern, len(text),
+                                          len(pattern), backend,
+                                          wildcard=wildcard), mode, limit)
+
+def fft_match_index_n_log_m(text, pattern, chunk_size='m', workers=None,
+                            backend=None, mode='index', limit=None,
+                            wildcard=None, exact=False, density=None):
     '''Does the n log m FFT pattern matching algorithm. If the length of the
     portion of the text that we're sampling is less than the length of the
-    pattern, we pad the end with 0s. Change this if 0s are in the alphabet.
+    pattern, we pad the end with 0s, and drop the matches that run into them.
 
     Arguments
     ---------
-      text: the text that you are interested in searching
+      text: the text that you are interested in searching, a str or a
+        packed.PackedGenome, which is decoded a batch of chunks at a time
       pattern: the pattern that may be contained in multiple locations inside
         the text
     chunk_size : type str or int
@@ -186,41 +332,61 @@ def fft_match_index_n_log_m(text, pattern, chunk_size='m'):
             which breaks the string into 2m size chunks and performs the
             fft match index algorithm on those chunks
         if a positive integer, it will break up the string into size
-            2*chunk_size chunks
-
-        chunk_size must be >= len(m) for the algorithm to find matches
+            2*chunk_size chunks, or chunk_size + m - 1 if the pattern is
+            longer than chunk_size
+    workers : int or None
+        number of threads that search the chunks.  None or 1 searches them
+        one batch at a time on the calling thread.
+    backend : str, backend or None
+        the fftbackend to transform with, None for the fastest installed one
+    mode : str
+        'index' to return the matches, 'count' to return how many there are,
+        'runs' to return the tandem repeat runs of the pattern as an r X 2
+        array of (start, repeat_count), see repeats.repeat_runs.  Counting
+        and finding runs don't keep the indices of the matches.
+    limit : int or None
+        stop scanning the chunks once this many matches are found, and only
+        return (or count) the first limit matches
+    wildcard : str or None
+        a character that matches any character, in the text and in the
+        pattern.  Searches with a wildcard use the three-term kernel of
+        fft_match_index.
+    exact : bool
+        correlate the chunks with the number-theoretic transform of ntt.py,
+        whose scores are exact integers, instead of the FFT backend
+    density : int or None
+        return the number of matches that start in every density long bin of
+        the text instead of their indices, see fft_match_index_n_sq_log_m
 
     returns: a list containing the 0-based indices of matches of pattern in text
     '''
     if not (chunk_size == 'm' or ((type(chunk_size) == int) and chunk_size>0)):
         raise Exception('fft_match_index_n_log_m chunk_size must be str or \
 positive integer')
+    check_mode(mode, limit, CHUNKED_MODES)
+    check_density(density, mode, limit)
     n = len(text)
     m = len(pattern)
 
-    if n == m:
-       if text == pattern:
-           return np.array([0])
-       else:
-           return np.array([])
-    start = 0
-
-    n_log_m_out = []
-
-    if chunk_size == 'm':
-        chunk_size = m
-
-    while start < n-chunk_size:
-        text_portion = text[:chunk_size*2].ljust(chunk_size*2,'0')
-        index = fft_match_index(text_portion,pattern,chunk_size*2,chunk_size)
-        for i in index:
-            n_log_m_out.append(i+start)
-        text = text[chunk_size:]
-        start += chunk_size
-    n_log_m_out = np.unique(np.asarray(n_log_m_out))
-    return n_log_m_out
-
-def fft_match_index_n_sq_log_n_naive(texts, pattern):
+    if n == m and wildcard is None and density is None and \
+       not isinstance(text, PackedGenome):
+        matches = np.array([0] if text == pattern else [], dtype=int)
+        if mode == 'runs':
+            return repeat_runs(matches, m)
+        return reduce_matches(matches, mode, limit)
+
+    if isinstance(text, PackedGenome):
+        texts = [text]
+    else:
+        with stages.stage('encode'):
+            texts = np.array([string_to_binary_array(text)])
+    matches = chunked_match_index(texts, pattern, chunk_size, workers,
+                                  backend, mode, limit, wildcard, exact,
+                                  density)[0]
+    return int(matches) if mode == 'count' else matches
+
+@search_unique
+def fft_match_index_n_sq_log_n_naive(texts, pattern, backend=None):
     '''Does the n_log_n match fft match index algorithm on k texts.
 
     The running time of this algorithm is k*n\log{n}, where k is the number of
@@ -238,9 +404,11 @@ def fft_match_index_n_sq_log_n_naive(texts, pattern):
         texts[i]
 
     '''
-    return np.array([fft_match_index(i, pattern, len(i), len(pattern)) for i in texts])
+    return np.array([fft_match_index(i, pattern, len(i), len(pattern), backend)
+                     for i in texts])
 
-def fft_match_index_n_sq_log_m_naive(texts, pattern):
+@search_unique
+def fft_match_index_n_sq_log_m_naive(texts, pattern, backend=None):
     '''Does the n log m FFT pattern matching algorithm on an array of text.
 
     arguments:
@@ -250,9 +418,11 @@ def fft_match_index_n_sq_log_m_naive(texts, pattern):
     returns: an array of lists containing the 0-based indices of matches of the
         pattern in each text.
     '''
-    return np.array([fft_match_index_n_log_m(i, pattern) for i in texts])
+    return np.array([fft_match_index_n_log_m(i, pattern, backend=backend)
+                     for i in texts])
 
-def fft_match_index_2d(texts, pattern, pattern_length):
+def fft_match_index_2d(texts, pattern, pattern_length, backend=None,
+                       wildcard=False):
     """ 
     This is the workhorse for the n_sq_log_n and n_sq_log_m algorithms.
 
@@ -260,7 +430,9 @@ def fft_match_index_2d(texts, pattern, pattern_length):
     index problem by returning a list of indices where the pattern matches the
     text.
 
-    Does cross-correlation solving the following equation:
+    Computes the sum of squared differences of fft_match_index with one 2-D
+    cross-correlation and a running sum along the rows.  With wildcards, does
+    cross-correlation solving the following equation instead:
     S_{i} = \sum_{j=1}^{m} (p_{j}^{3} t_{i+j-1} - 2p_{j}^{2}t_{i+j-1}^{2}
                               + p_{j}t_{i+j-1}^{3})
     This can be solved in Fourier space using FFT's of each of the three terms.
@@ -273,7 +445,12 @@ def fft_match_index_2d(texts, pattern, pattern_length):
     Arguments
     ---------
     text : k X n numpy array
-    pattern : 1 X m numpy array
+    pattern : k X n numpy array
+        the reversed pattern in the first row, 0 everywhere else
+    backend : str, backend or None
+        the fftbackend to transform with, None for the fastest installed one
+    wildcard : bool
+        whether the texts and the pattern have wildcards, encoded as 0
 
     Returns
     -------
@@ -284,41 +461,29 @@ def fft_match_index_2d(texts, pattern, pattern_length):
 
     #Note: len(fft(something)) != len(something) for general case
 
-    #TODO: for binary_encoded_text and pattern, if the char is equal to the
-    # don't care character, then set the float value to 0.0
+    backend = get_backend(backend)
     text = texts
-    text_sq = text * text
-    text_cube = text_sq * text
-
-    #m = len(pattern)
     m = pattern_length
-    
-    #pattern = binary_encoded_pattern
-    pattern_sq = pattern * pattern
-    pattern_cube = pattern_sq * pattern
-
-    text_key = np.fft.fft2(text)
-    text_sq_key = np.fft.fft2(text_sq)
-    text_cube_key = np.fft.fft2(text_cube)
-
-    pattern_key = np.fft.fft2(pattern)
-    pattern_sq_key = np.fft.fft2(pattern_sq)
-    pattern_cube_key = np.fft.fft2(pattern_cube)
-
-    #there are three terms.  Since fft(key) is Linear, we will IFT each
-    #individually
-    out_term_1_key = pattern_cube_key * text_key
-    out_term_2_key =  pattern_sq_key * text_sq_key
-    out_term_3_key = pattern_key * text_cube_key
-
-    out_term_1 = np.fft.ifft2(out_term_1_key)
-    out_term_2 = -2*np.fft.ifft2(out_term_2_key)
-    out_term_3 = np.fft.ifft2(out_term_3_key)
-
-    out = out_term_1 + out_term_2 + out_term_3
+    if wildcard:
+        out = three_term_correlation_2d(text, pattern, backend)
+    else:
+        with stages.stage('fft2'):
+            text_key = backend.fft2(text)
+            pattern_key = backend.fft2(pattern)
+            stages.allocated(text_key.nbytes + pattern_key.nbytes)
+        with stages.stage('products'):
+            text_key *= pattern_key
+        with stages.stage('ifft2'):
+            out = -2*backend.ifft2(text_key).real
+            stages.allocated(out.nbytes)
+        with stages.stage('powers'):
+            sums = window_sums(text, m)
+            sums += np.sum(pattern * pattern)
+            add_window_sums(out, sums, m)
 
     #this should be 0 if match
-    matches = np.where(abs(out) < 1.0e-6)
+    with stages.stage('threshold'):
+        matches = np.where(abs(out) < MATCH_THRESHOLD)
 
     out = []
     #If our array is:
@@ -336,35 +501,636 @@ def fft_match_index_2d(texts, pattern, pattern_length):
 
     return matches
 
-def fft_match_index_n_sq_log_n(texts, pattern):
+def three_term_correlation_2d(text, pattern, backend):
+    """
+    Returns the three-term correlation of fft_match_index_2d at the index of
+    the last character of every window
+    """
+    with stages.stage('powers'):
+        text_sq = text * text
+        text_cube = text_sq * text
+        stages.allocated(2 * text.nbytes)
+
+    #pattern = binary_encoded_pattern
+    with stages.stage('powers'):
+        pattern_sq = pattern * pattern
+        pattern_cube = pattern_sq * pattern
+        stages.allocated(2 * pattern.nbytes)
+
+    with stages.stage('fft2'):
+        text_key = backend.fft2(text)
+        text_sq_key = backend.fft2(text_sq)
+        text_cube_key = backend.fft2(text_cube)
+
+        pattern_key = backend.fft2(pattern)
+        pattern_sq_key = backend.fft2(pattern_sq)
+        pattern_cube_key = backend.fft2(pattern_cube)
+        stages.allocated(3 * (text_key.nbytes + pattern_key.nbytes))
+
+    #there are three terms.  Since fft(key) is Linear, we will IFT each
+    #individually
+    with stages.stage('products'):
+        out_term_1_key = pattern_cube_key * text_key
+        out_term_2_key =  pattern_sq_key * text_sq_key
+        out_term_3_key = pattern_key * text_cube_key
+        stages.allocated(3 * text_key.nbytes)
+
+    with stages.stage('ifft2'):
+        out_term_1 = backend.ifft2(out_term_1_key)
+        out_term_2 = -2*backend.ifft2(out_term_2_key)
+        out_term_3 = backend.ifft2(out_term_3_key)
+
+        out = out_term_1 + out_term_2 + out_term_3
+        stages.allocated(4 * out.nbytes)
+    return out
+
+class Workspace(object):
+    """
+    Reusable buffers for fft_match_index_batch.
+
+    A workspace holds the spectra of one pattern, and scratch buffers for the
+    powers and the products of the windows that are searched for it.  The
+    buffers grow to the largest batch they have seen, so a chunked scan that
+    searches thousands of batches computes the pattern spectra once and does
+    not allocate the powers and products again for every batch.
+
+    A workspace must only be used by one thread at a time; copy() makes another
+    one that shares the pattern spectra.
+
+    Arguments
+    ---------
+    pattern : numpy array of length w
+        the reversed, binary encoded pattern, padded with 0s to length w
+    pattern_length : int
+        length of the pattern before padding
+    backend : str, backend or None
+        the fftbackend to transform with, None for the fastest installed one
+    wildcard : bool
+        whether the pattern and the texts have wildcards, which need the
+        three-term kernel instead of the sum of squared differences
+    """
+    def __init__(self, pattern, pattern_length, backend=None, wildcard=False):
+        self.backend = get_backend(backend)
+        self.pattern_length = pattern_length
+        self.width = len(pattern)
+        self.wildcard = wildcard
+
+        if wildcard:
+            pattern_sq = pattern * pattern
+            pattern_cube = pattern_sq * pattern
+
+            #the three terms are summed in Fourier space, so the -2 of the
+            #middle term is folded into its pattern spectrum
+            self.pattern_keys = (self.backend.rfft(pattern_cube),
+                                 -2*self.backend.rfft(pattern_sq),
+                                 self.backend.rfft(pattern))
+        else:
+            #the -2 of the correlation term is folded into the spectrum
+            self.pattern_keys = (-2*self.backend.rfft(pattern),)
+            self.pattern_power = np.dot(pattern, pattern)
+        self.allocate(0)
+
+    def allocate(self, rows):
+        self.rows = rows
+        self.power = np.empty((rows, self.width))
+        self.key = np.empty((rows, self.width//2 + 1), dtype=np.complex128)
+        self.windows = None
+        stages.allocated(self.power.nbytes + self.key.nbytes)
+
+    def buffers(self, rows):
+        """ Returns the power and key buffers for a batch of rows """
+        if rows > self.rows:
+            self.allocate(rows)
+        return self.power[:rows], self.key[:rows]
+
+    def window_buffer(self, rows):
+        """ Returns a buffer that chunk_windows can copy a batch of rows into """
+        if rows > self.rows:
+            self.allocate(rows)
+        if self.windows is None:
+            self.windows = np.empty((self.rows, self.width))
+            stages.allocated(self.windows.nbytes)
+        return self.windows[:rows]
+
+    def copy(self):
+        other = Workspace.__new__(Workspace)
+        other.__dict__.update(self.__dict__)
+        other.allocate(0)
+        return other
+
+def fft_match_index_batch(windows, workspace, workers=1, sums=None):
+    """
+    This is the workhorse for fft_match_index and the chunked n log m and
+    n_sq_log_m algorithms.
+
+    Does the sum of squared differences of fft_match_index on every row of
+    windows at once, using 1-D transforms along the rows: one forward and one
+    inverse transform.  With wildcards, it does the three-term
+    cross-correlation instead; since every term is linear, the three products
+    are summed in Fourier space and only one inverse transform is needed.  The
+    powers of the text and the products are computed in place in the
+    workspace's buffers.
+
+    Arguments
+    ---------
+    windows : r X w numpy array
+        binary encoded text windows, one per row
+    workspace : Workspace
+        the workspace of the pattern, with w == workspace.width
+    workers : int
+        number of threads the backend may use for the transforms
+    sums : numpy array or None
+        the window sums of the windows plus the sum of the squares of the
+        pattern (see window_sums), e.g. a window_view of the sums of the
+        text that the windows were copied from.  None computes them from
+        windows.  Wildcard searches don't use them.
+
+    Returns
+    -------
+    rows, cols : numpy arrays
+        the window and the 0-based index inside that window of every match, in
+        row-major order
+    """
+    if workspace.wildcard:
+        out = three_term_correlation(windows, workspace, workers)
+    else:
+        out = squared_differences(windows, workspace, workers, sums)
+
+    #this should be 0 if match
+    with stages.stage('threshold'):
+        np.absolute(out, out=out)
+        rows, cols = np.where(out < MATCH_THRESHOLD)
+
+        #this is actually rotated based on the end of the pattern, so we need
+        #to subtract m-1.  The negative matches span the end-start boundary of
+        #the window, which doesn't make sense for DNA
+        cols = cols - (workspace.pattern_length - 1)
+        keep = cols >= 0
+        return rows[keep], cols[keep]
+
+def squared_differences(windows, workspace, workers=1, sums=None):
+    """
+    Returns the sum of squared differences of the pattern and every window of
+    windows, at the index of the window's last character.  sums are the
+    window sums of the windows, see fft_match_index_batch.
+    """
+    backend = workspace.backend
+    pattern_key, = workspace.pattern_keys
+    m = workspace.pattern_length
+    _, key = workspace.buffers(windows.shape[0])
+
+    with stages.stage('rfft'):
+        term = backend.rfft(windows, workers=workers)
+        stages.allocated(term.nbytes)
+    with stages.stage('products'):
+        np.multiply(pattern_key, term, out=key)
+    with stages.stage('irfft'):
+        out = backend.irfft(key, workspace.width, workers=workers)
+        stages.allocated(out.nbytes)
+    with stages.stage('powers'):
+        if sums is None:
+            sums = window_sums(windows, m)
+            sums += workspace.pattern_power
+        return add_window_sums(out, sums, m)
+
+def window_sums(texts, m):
+    """
+    Returns the sums of the squares of the m long windows of every row of the
+    k X N array texts, at the index where each window starts.  The last m-1
+    columns, where no whole window starts, are inf.
+    """
+    #float64 holds the running sums of the squares exactly
+    power = np.square(texts, dtype=np.float64)
+    np.cumsum(power, axis=1, out=power)
+    n = power.shape[1]
+    sums = np.empty_like(power)
+    sums[:, 0] = power[:, m-1]
+    np.subtract(power[:, m:], power[:, :n-m], out=sums[:, 1:n-m+1])
+    sums[:, n-m+1:] = np.inf
+    return sums
+
+def add_window_sums(out, sums, m):
+    """
+    Turns out, -2 times the correlation of the pattern and every window at the
+    index of the window's last character, into the sum of squared differences.
+
+    Arguments
+    ---------
+    out : r X w float64 numpy array
+    sums : numpy array of r*w elements
+        the window sums of the texts plus the sum of the squares of the
+        pattern: r X w, or count X k X w for the windows of k texts
+    m : int
+
+    Returns
+    -------
+    out : with inf before the first whole window
+    """
+    w = out.shape[-1]
+    out.reshape(sums.shape)[..., m-1:] += sums[..., :w-m+1]
+    out[..., :m-1] = np.inf
+    return out
+
+def three_term_correlation(windows, workspace, workers=1):
+    """
+    Returns the three-term correlation of the pattern and every window of
+    windows, at the index of the window's last character
+    """
+    backend = workspace.backend
+    pattern_cube_key, pattern_sq_key, pattern_key = workspace.pattern_keys
+    power, key = workspace.buffers(windows.shape[0])
+
+    with stages.stage('rfft'):
+        term = backend.rfft(windows, workers=workers)
+        stages.allocated(term.nbytes)
+    with stages.stage('products'):
+        np.multiply(pattern_cube_key, term, out=key)
+
+    with stages.stage('powers'):
+        np.multiply(windows, windows, out=power)
+    with stages.stage('rfft'):
+        term = backend.rfft(power, workers=workers)
+        stages.allocated(term.nbytes)
+    with stages.stage('products'):
+        term *= pattern_sq_key
+        key += term
+
+    with stages.stage('powers'):
+        np.multiply(power, windows, out=power)
+    with stages.stage('rfft'):
+        term = backend.rfft(power, workers=workers)
+        stages.allocated(term.nbytes)
+    with stages.stage('products'):
+        term *= pattern_key
+        key += term
+
+    with stages.stage('irfft'):
+        out = backend.irfft(key, workspace.width, workers=workers)
+        stages.allocated(out.nbytes)
+    return out
+
+def chunk_starts(n, chunk_size):
+    """
+    Returns the start offsets of the windows that cover a text of length n,
+    one every chunk_size characters.  There is always at least one window,
+    even if the text is shorter than a chunk.
+    """
+    return np.arange(0, max(n - chunk_size, 1), chunk_size)
+
+def window_width(chunk_size, m):
+    """
+    Returns the width of the windows of a chunked search: 2*chunk_size, or
+    wide enough for a match that starts in the last character of the chunk
+    if the pattern is longer than the chunk.
+    """
+    return chunk_size + max(chunk_size, m - 1)
+
+def window_view(texts, first, count, chunk_size, width):
+    """
+    Returns the count X k X width view of the width wide windows of chunks
+    first, ..., first+count-1 of the k X N array texts
+    """
+    k = texts.shape[0]
+    texts = texts[:, first*chunk_size:]
+    step = texts.strides[1]
+    return np.lib.stride_tricks.as_strided(texts,
+                shape=(count, k, width),
+                strides=(chunk_size*step, texts.strides[0], step))
+
+def chunk_windows(texts, first, count, chunk_size, width, out=None):
+    """
+    Copies the width wide windows of chunks first, ..., first+count-1 out of
+    the k X N array texts, into out if it is given.
+
+    Returns
+    -------
+    windows : (count*k) X width float64 numpy array
+        the windows of every text for the first chunk, then for the second
+        chunk, etc.
+    """
+    k = texts.shape[0]
+    windows = window_view(texts, first, count, chunk_size, width)
+    if out is None:
+        return windows.reshape(count*k, width).astype(np.float64)
+    out.reshape(count, k, width)[...] = windows
+    return out
+
+def chunk_batches(num_chunks, width, workers):
+    """
+    Splits the chunks into (first, last) batches of about BATCH_ELEMENTS text
+    elements, with at least one batch per worker.
+    """
+    per_batch = max(1, BATCH_ELEMENTS // width)
+    per_batch = min(per_batch, max(1, -(-num_chunks // workers)))
+    return [(i, min(i + per_batch, num_chunks))
+            for i in range(0, num_chunks, per_batch)]
+
+def map_batches(search, batches, workers):
+    """
+    Calls search(batch, fft_workers) for every batch and returns the results in
+    batch order.
+
+    With more than one worker, the batches are spread over a thread pool.  The
+    transforms and the array arithmetic release the GIL, so the threads run
+    concurrently.  Workers that are left over when there are fewer batches than
+    workers are handed to the FFT backend.
+    """
+    if workers == 1 or len(batches) == 1:
+        return [search(batch, workers) for batch in batches]
+
+    threads = min(workers, len(batches))
+    fft_workers = max(1, workers // threads)
+    parent = stages.current()
+
+    def run(batch):
+        with stages.within(parent):
+            return search(batch, fft_workers)
+
+    return thread_pool(threads).map(run, batches)
+
+def thread_pool(threads):
+    """ Returns the shared pool of this many threads, starting it if needed """
+    with pools_lock:
+        if threads not in pools:
+            pools[threads] = ThreadPool(threads)
+        return pools[threads]
+
+def chunked_match_index(texts, pattern, chunk_size='m', workers=None,
+                        backend=None, mode='index', limit=None,
+                        wildcard=None, exact=False, density=None,
+                        lengths=None):
+    """
+    Performs the fft match index algorithm on every text in texts, in
+    overlapping windows that start every chunk_size characters and are
+    window_width(chunk_size, m) long.
+
+    Every match is reported by exactly one window: the one whose first
+    chunk_size characters contain its start, or the last window.  The windows
+    are searched in batches, optionally on several threads, and their matches
+    are merged back in order.  Each thread reuses one Workspace for the whole
+    scan.  The matches that run past the end of their text, into the null
+    characters, are dropped.
+
+    In 'count' mode, every batch is reduced to the number of matches of each
+    text, so the indices are never kept.  With a limit, the batches are
+    searched in rounds of `workers`, and the scan stops after the round in
+    which every text has reached the limit.  In 'runs' mode, the matches of
+    every round are handed to a repeats.RunAccumulator per text, and only the
+    runs are kept.  With a density, every batch counts its matches in the
+    bins of the stretch of text that it covers, and only the counts are kept.
+
+    Arguments
+    ---------
+    texts : k X N numpy array, or list of packed.PackedGenome or str
+        the binary encoded texts, padded with the null character 0, or texts
+        that are decoded a batch at a time with packed.decode_rows
+    pattern : str
+        the pattern that may be contained in multiple locations inside the text
+    chunk_size : str or int
+        'm' or the positive integer chunk size
+    workers : int or None
+        number of threads to search with. None is the same as 1.
+    backend : str, backend or None
+        the fftbackend to transform with, None for the fastest installed one
+    mode : str
+        'index', 'count' or 'runs'
+    limit : int or None
+        the number of matches per text to stop at
+    wildcard : str or None
+        a character that matches any character
+    exact : bool
+        search the batches with ntt.ntt_match_index_batch instead of
+        fft_match_index_batch.  Exact searches can't have wildcards.
+    density : int or None
+        the bin size of the match density, see fft_match_index_n_sq_log_m
+    lengths : list of int or None
+        the length of every text, which encoded texts don't keep.  None is
+        the length of the rows of encoded texts, and len(text) otherwise.
+
+    Returns
+    -------
+    matches : list of k numpy arrays
+        the sorted 0-based indices of the matches in each text, in 'count'
+        mode a numpy array of the number of matches in each text, and in
+        'runs' mode the r X 2 array of (start, repeat_count) of each text.
+        With a density, the k X ceil(N / density) int64 numpy array of the
+        number of matches that start in every bin of every text.
+    """
+    if workers is None:
+        workers = 1
+    if not ((type(workers) == int) and workers > 0):
+        raise Exception('workers must be None or a positive integer')
+    if exact and wildcard is not None:
+        raise Exception('exact searches cannot have wildcards')
+
+    encoded = isinstance(texts, np.ndarray)
+    k, n = texts.shape if encoded else (len(texts), max(map(len, texts)))
+    m = len(pattern)
+    if lengths is None:
+        lengths = [n]*k if encoded else map(len, texts)
+    lengths = np.asarray(lengths, dtype=np.int64)
+
+    if chunk_size == 'm':
+        chunk_size = m
+    width = window_width(chunk_size, m)
+
+    starts = chunk_starts(n, chunk_size)
+    if encoded:
+        texts = mask_wildcards(np.pad(texts,
+                                      ((0, 0), (0, starts[-1] + width - n)),
+                                      mode='constant'), wildcard)
+
+    def segment(start, stop):
+        """ The codes of the texts from start up to stop """
+        if encoded:
+            return texts[:, start:stop]
+        with stages.stage('decode'):
+            return mask_wildcards(decode_rows(texts, start, stop), wildcard)
+
+    with stages.stage('pattern'):
+        encoded_pattern = mask_wildcards(string_to_binary_array(pattern[::-1],
+                                             size=width), wildcard)
+        if exact:
+            check_exact(texts if encoded else np.array(code_range(texts)),
+                        encoded_pattern[:m], m)
+            workspace = NTTWorkspace(encoded_pattern, m)
+        else:
+            workspace = Workspace(encoded_pattern, m, backend,
+                                  wildcard is not None)
+    match_batch = ntt_match_index_batch if exact else fft_match_index_batch
+    thread_workspaces = threading.local()
+    last = len(starts) - 1
+
+    def search(batch, fft_workers):
+        if not hasattr(thread_workspaces, 'workspace'):
+            thread_workspaces.workspace = workspace.copy()
+        ws = thread_workspaces.workspace
+
+        first, stop = batch
+        #the text that the batch covers
+        start = first*chunk_size
+        text = segment(start, start + width + (stop - first - 1)*chunk_size)
+        with stages.stage('windows'):
+            windows = ws.window_buffer((stop - first) * k)
+            chunk_windows(text, 0, stop - first, chunk_size, width,
+                          out=windows)
+        with stages.stage('correlate'):
+            sums = None
+            if wildcard is None:
+                with stages.stage('powers'):
+                    #the window sums of the text, which the overlapping
+                    #windows share
+                    sums = window_sums(text, m)
+                    sums += ws.pattern_power
+                    sums = window_view(sums, 0, stop - first, chunk_size,
+                                       width)
+            rows, cols = match_batch(windows, ws, fft_workers, sums)
+
+        chunk = rows // k + first
+        indices = starts[chunk] + cols
+        keep = ((cols < chunk_size) | (chunk == last)) & \
+               (indices + m <= lengths[rows % k])
+        if mode == 'count':
+            return np.bincount(rows[keep] % k, minlength=k), None
+        if density is not None:
+            with stages.stage('density'):
+                #the bins of the text that the batch covers
+                low = start // density
+                bins = (start + text.shape[1] - 1) // density - low + 1
+                index = (rows[keep] % k)*bins + indices[keep] // density - low
+                return low, np.bincount(index, minlength=k*bins)\
+                    .reshape(k, bins)
+        return rows[keep] % k, indices[keep]
+
+    batches = chunk_batches(len(starts), width, workers)
+
+    def rounds():
+        for i in range(0, len(batches), workers):
+            yield zip(batches[i:i + workers],
+                      map_batches(search, batches[i:i + workers], workers))
+
+    if mode == 'runs':
+        accumulators = [RunAccumulator(m) for _ in range(k)]
+        runs = [[] for _ in range(k)]
+        for results in rounds():
+            for (_, stop), (rows, indices) in results:
+                with stages.stage('runs'):
+                    for text in range(k):
+                        runs[text].append(accumulators[text].add(
+                            indices[rows == text], stop*chunk_size))
+        return [np.concatenate(r + [a.finish()])
+                for r, a in zip(runs, accumulators)]
+
+    if density is not None:
+        out = np.zeros((k, -(-n // density)), dtype=np.int64)
+        for low, counts in map_batches(search, batches, workers):
+            with stages.stage('merge'):
+                #the bins past the end of the texts have no matches
+                span = min(counts.shape[1], out.shape[1] - low)
+                out[:, low:low + span] += counts[:, :span]
+        return out
+
+    if limit is None:
+        found = map_batches(search, batches, workers)
+    else:
+        found = []
+        counts = np.zeros(k, dtype=np.int64)
+        for results in rounds():
+            for _, (first, second) in results:
+                found.append((first, second))
+                #the counts in 'count' mode, the text of every match otherwise
+                counts += first if mode == 'count' else \
+                          np.bincount(first, minlength=k)
+            if counts.min() >= limit:
+                break
+
+    with stages.stage('merge'):
+        if mode == 'count':
+            counts = np.sum([c for c, _ in found], axis=0, dtype=np.int64)
+            return counts if limit is None else np.minimum(counts, limit)
+
+        rows = np.concatenate([r for r, _ in found])
+        indices = np.concatenate([i for _, i in found])
+
+        #stable sort by text, which keeps each text's matches in order
+        order = np.argsort(rows, kind='mergesort')
+        counts = np.bincount(rows, minlength=k)
+        matches = np.split(indices[order], np.cumsum(counts)[:-1])
+        return [reduce_matches(a, limit=limit) for a in matches]
+
+@search_unique
+def fft_match_index_n_sq_log_n(texts, pattern, backend=None, mode='index',
+                               limit=None, wildcard=None):
+    '''Does the n log n FFT pattern matching algorithm on k texts at once,
+    with a 2-D FFT.
+
+    Arguments
+    ---------
+    texts : list of str
+    pattern : str
+    backend : str, backend or None
+        the fftbackend to transform with, None for the fastest installed one
+    mode : str
+        'index' to return the matches, 'count' to return how many there are
+    limit : int or None
+        only return (or count) the first limit matches of every text
+    wildcard : str or None
+        a character that matches any character, in the texts and in the
+        pattern
+
+    Returns
+    -------
+    matches : numpy array
+        k rows, the i'th row has the 0-based indices of matches in texts[i],
+        or in 'count' mode the number of matches in every text
+    '''
+    check_mode(mode, limit)
     pattern = pattern[::-1]
 
-    binary_encoded_text = texts_to_array(texts)
+    with stages.stage('encode'):
+        binary_encoded_text = texts_to_array(texts)
+        #room for the pattern, if it is longer than every text
+        binary_encoded_text = np.pad(binary_encoded_text,
+            ((0, 0), (0, max(0, len(pattern) - binary_encoded_text.shape[1]))),
+            mode='constant')
 
-    binary_encoded_pattern = np.zeros(binary_encoded_text.shape)
-    binary_encoded_pattern[0,:] = string_to_binary_array(pattern,
-                                        size=binary_encoded_text.shape[1])
+        binary_encoded_pattern = np.zeros(binary_encoded_text.shape)
+        binary_encoded_pattern[0,:] = string_to_binary_array(pattern,
+                                            size=binary_encoded_text.shape[1])
+        mask_wildcards(binary_encoded_text, wildcard)
+        mask_wildcards(binary_encoded_pattern, wildcard)
 
     assert len(binary_encoded_text) == len(binary_encoded_pattern)
 
 
-    return fft_match_index_2d(binary_encoded_text, binary_encoded_pattern,
-                              len(pattern))
-
-def fft_match_index_n_sq_log_m(texts, pattern, chunk_size='m'):
+    matches = fft_match_index_2d(binary_encoded_text, binary_encoded_pattern,
+                                 len(pattern), backend, wildcard is not None)
+    #the matches that run into the padding past the end of their text
+    matches = np.array([a[a + len(pattern) <= len(t)]
+                        for a, t in zip(matches, texts)])
+    if mode == 'index' and limit is None:
+        return matches
+    return np.array([reduce_matches(a, mode, limit) for a in matches])
+
+@search_unique
+def fft_match_index_n_sq_log_m(texts, pattern, chunk_size='m', workers=None,
+                               backend=None, mode='index', limit=None,
+                               wildcard=None, exact=False, density=None,
+                               blooms=None):
     """
     Performs the fft_match_index algorithm on chunks that are 'chunk_size' long.
     If the length of the portion of the text that we're sampling is less than 
-    the length of the pattern, we pad the end with 0s. Change this if 0s are in 
-    the alphabet.
+    the length of the pattern, we pad the end with 0s, and drop the matches
+    that run into them.
 
     This is similar to fftmatch.fft_match_index_n_log_m, but it operates on
     multiple texts at the same time.
 
     Arguments
     ---------
-    texts : list of str
-        the genomic strings to search
+    texts : list of str or packed.PackedGenome
+        the genomic strings to search.  Packed genomes are decoded a batch of
+        chunks at a time, so they are never unpacked whole.
     pattern : str 
         the pattern that may be contained in multiple locations inside the text
     chunk_size : type str or int
@@ -372,60 +1138,148 @@ def fft_match_index_n_sq_log_m(texts, pattern, chunk_size='m'):
             which breaks the string into 2m size chunks and performs the
             fft match index algorithm on those chunks
         if a positive integer, it will break up the string into size 
-            2*chunk_size chunks
+            2*chunk_size chunks, or chunk_size + m - 1 if the pattern is
+            longer than chunk_size
+    workers : int or None
+        number of threads that search the chunks.  None or 1 searches them
+        one batch at a time on the calling thread.
+    backend : str, backend or None
+        the fftbackend to transform with, None for the fastest installed one
+    mode : str
+        'index' to return the matches, 'count' to return how many there are
+        in every text, 'runs' to return the tandem repeat runs of the pattern
+        in every text (see fft_match_index_n_log_m).  Counting and finding
+        runs don't keep the indices of the matches.
+    limit : int or None
+        stop scanning the chunks once every text has this many matches, and
+        only return (or count) the first limit matches of every text
+    wildcard : str or None
+        a character that matches any character, see fft_match_index_n_log_m
+    exact : bool
+        correlate with the number-theoretic transform, see
+        fft_match_index_n_log_m
+    density : int or None
+        a bin size.  Instead of the matches, returns the k X ceil(n / density)
+        int64 matrix of the number of matches that start in every bin of
+        every text, which the chunks add to as they are searched, so the
+        indices are never kept.  graph.plot_density draws it as a heat map.
+    blooms : list of bloom.KmerBloom or None
+        the k-mer filter of every text (None for the texts without one).  The
+        texts whose filter rules the pattern out aren't searched, and get
+        empty rows.  Ignored with a wildcard, which the filters don't know.
 
     returns: a list containing the 0-based indices of matches of pattern in text
     """
     if not (chunk_size == 'm' or ((type(chunk_size) == int) and chunk_size>0)):
         raise Exception('fft_match_index_n_log_m chunk_size must be str or \
 positive integer')
-    n = max(map(len, texts))
-
-    m = len(pattern)
-
-    if chunk_size == 'm':
-        chunk_size = m
-
-    texts = texts_to_array(texts)
-
-    #the pattern has as many rows as genomic texts, and is as wide as the chunk
-    binary_encoded_pattern = np.zeros((texts.shape[0],2*chunk_size))
-    binary_encoded_pattern[0,:] = string_to_binary_array(pattern,
-                                        size=2*chunk_size)
-
-    pattern = binary_encoded_pattern
-
-    start = 0
-
-    indices = [np.array([])] * texts.shape[0]
-    while start < n-chunk_size:
-        
-        if start + chunk_size*2 >= n:
-            #if we are at the end, we may need to pad with the null char
-            #we need start:start+chunk_size*2 chars
-            #
-            num_chars = texts[:,start:start+chunk_size*2].shape[1]
-            pad_chars = chunk_size*2 - num_chars
+    check_mode(mode, limit, CHUNKED_MODES)
+    check_density(density, mode, limit)
+
+    if blooms is not None and wildcard is None:
+        from bloom import prefilter
+        keep = prefilter(blooms, pattern)
+        if not keep.all():
+            kept = [t for t, passed in zip(texts, keep) if passed]
+            matches = fft_match_index_n_sq_log_m(kept, pattern, chunk_size,
+                workers, backend, mode, limit, wildcard, exact, density) \
+                if kept else []
+            return fill_skipped(matches, keep, mode, density,
+                                max(len(t) for t in texts))
+
+    lengths = [len(t) for t in texts]
+    if is_packed(texts):
+        texts = list(texts)
+    else:
+        with stages.stage('encode'):
+            texts = texts_to_array(texts)
+    return np.array(chunked_match_index(texts, pattern, chunk_size, workers,
+                                        backend, mode, limit, wildcard, exact,
+                                        density, lengths))
+
+def spectrum_size(n, m):
+    """
+    The power of two that a text of length n and patterns of length up to m
+    are padded to, so that their correlation doesn't wrap around
+    """
+    return 1 << int(np.ceil(np.log2(max(n + m - 1, 2))))
 
-            text_chunk = np.pad(texts[:,start:start+chunk_size*2], 
-                                ((0,0), (0,pad_chars)),
-                                mode='constant', constant_values=(ord('0')))
-        else:
-            text_chunk = texts[:,start:start+chunk_size*2]
+class TextSpectra(object):
+    """
+    The spectrum of a text, zero padded to size, and the running sums of the
+    squares of its characters.
 
-        index = fft_match_index_2d(text_chunk, pattern, m)
+    They only depend on the text, so they can be kept and correlated with any
+    number of patterns of length up to size - len(text) + 1 by
+    fft_match_index_patterns.
 
-        for i in range(len(indices)):
-            if index[i].shape > 0:
-                indices[i] = np.append(indices[i], start+index[i])
+    Arguments
+    ---------
+    text : str
+    size : int
+        the transform size, see spectrum_size
+    backend : str, backend or None
+        the fftbackend to transform with, None for the fastest installed one
+    """
+    def __init__(self, text, size, backend=None):
+        self.backend = get_backend(backend)
+        self.length = len(text)
+        self.size = size
+
+        with stages.stage('encode'):
+            t = string_to_binary_array(text, size=size)
+        with stages.stage('rfft'):
+            self.key = self.backend.rfft(t)
+            stages.allocated(self.key.nbytes)
+        with stages.stage('powers'):
+            #powers[i] is the sum of the squares of the first i characters
+            self.powers = np.concatenate([[0], np.cumsum(t[:self.length]**2)])
+
+def fft_match_index_patterns(spectra, patterns):
+    """
+    Searches a text for several patterns with one batch of correlations.
 
-        start += chunk_size
+    The sum of squared differences of fft_match_index is computed for every
+    pattern at once, with the text's spectrum and running sums computed ahead
+    of time.  The sum is an integer that is at least 1 for every mismatching
+    character, so anything under 0.5 is a match.
 
-    out = [[]]*texts.shape[0]
-    for i in range(len(out)):
-        out[i] = np.unique(indices[i]).astype(int)
+    Arguments
+    ---------
+    spectra : TextSpectra
+    patterns : list of str
+        no longer than spectra.size - spectra.length + 1
 
-    return np.array(out)
+    Returns
+    -------
+    matches : list of numpy arrays
+        the sorted 0-based indices of the matches of every pattern
+    """
+    backend = spectra.backend
+    n, size = spectra.length, spectra.size
+
+    with stages.stage('encode'):
+        p = np.zeros((len(patterns), size))
+        for row, pattern in enumerate(patterns):
+            if not 0 < len(pattern) <= size - n + 1:
+                raise Exception('patterns must have 1 to {} characters'
+                                .format(size - n + 1))
+            p[row, :len(pattern)] = np.frombuffer(pattern[::-1],
+                                                  dtype=np.uint8)
+    with stages.stage('rfft'):
+        key = backend.rfft(p) * spectra.key
+    with stages.stage('irfft'):
+        out = backend.irfft(key, size)
+
+    with stages.stage('threshold'):
+        matches = []
+        for row, pattern in enumerate(patterns):
+            m = len(pattern)
+            #the correlation at index j is for the match that ends at j
+            ssd = np.dot(p[row], p[row]) - 2*out[row, m-1:n] + \
+                  spectra.powers[m:] - spectra.powers[:n-m+1]
+            matches.append(np.nonzero(np.abs(ssd) < MATCH_THRESHOLD)[0])
+        return matches
 
 if __name__ == '__main__':
     #f = open('1d.txt')
@@ -1,8 +1,26 @@
-import matplotlib.pyplot as pyplot
-import yaml
+'''
+Plots the results of analysis.py and benchmatrix.py.
+
+matplotlib and yaml are slow to import, so they are only imported by the
+functions that use them.  The plots are shown, or saved to a file with -o.
+'''
 import argparse
 
-def plot_chunk_time(data, alg_name):
+def save_to_files():
+    """ Plots without a display.  Call it before the first plot. """
+    import matplotlib
+    matplotlib.use('Agg')
+
+def finish(pyplot, out):
+    """ Shows the plot, or saves it to the file out """
+    if out is None:
+        pyplot.show()
+    else:
+        pyplot.savefig(out)
+        pyplot.close()
+
+def plot_chunk_time(data, alg_name, out=None):
+    import matplotlib.pyplot as pyplot
     boyer_moore = []
     alg = {}
     for d in data:
@@ -34,9 +52,10 @@ def plot_chunk_time(data, alg_name):
         title = 'Performance time of OpenCV vs Length of \'chunks\' on text of length ' + str(text_length*10)
     pyplot.legend(loc='upper right')
     pyplot.title(title)
-    pyplot.show()
+    finish(pyplot, out)
 
-def plot_alg_time(data):
+def plot_alg_time(data, out=None):
+    import matplotlib.pyplot as pyplot
     text_length = []
     accuracy = {}
     time = {}
@@ -54,16 +73,20 @@ def plot_alg_time(data):
 
     pyplot.xlabel('Text Length')
     pyplot.ylabel('Time/msecs')
-    pyplot.plot(text_length, time['boyermoore'], label='boyer moore')
-    pyplot.plot(text_length, time['opencv'], label='opencv')
-    pyplot.plot(text_length, time['nlogn'], label='nk lognk')
-    pyplot.plot(text_length, time['nlogm'],  label='nk logm',)
+    #opencv is missing from the results of machines without it, and
+    #rabinkarp from the older results
+    for name, label in [('boyermoore', 'boyer moore'), ('opencv', 'opencv'),
+                        ('nlogn', 'nk lognk'), ('nlogm', 'nk logm'),
+                        ('rabinkarp', 'rabin karp')]:
+        if name in time:
+            pyplot.plot(text_length, time[name], label=label)
     pyplot.title('Time Performance of Algorithms vs Text Length')
 
     pyplot.legend(loc='upper left')
-    pyplot.show()
+    finish(pyplot, out)
 
-def plot_k_time(data):
+def plot_k_time(data, out=None):
+    import matplotlib.pyplot as pyplot
     k_length = []
     time = {}
 
@@ -77,36 +100,127 @@ def plot_k_time(data):
 
     pyplot.xlabel('k')
     pyplot.ylabel('Time/msecs')
-    pyplot.plot(k_length, time['boyermoore'], label='boyer moore')
-    pyplot.plot(k_length, time['opencv'], label='opencv')
-    pyplot.plot(k_length, time['nlogn'], label='nk lognk')
+    for name, label in [('boyermoore', 'boyer moore'), ('opencv', 'opencv'),
+                        ('nlogn', 'nk lognk'), ('rabinkarp', 'rabin karp')]:
+        if name in time:
+            pyplot.plot(k_length, time[name], label=label)
     title = 'Time Performance of Algorithms vs Number of Texts on text length, 1024'
     pyplot.title(title)
 
     pyplot.legend(loc='upper left')
-    pyplot.show()
-
-parser = argparse.ArgumentParser(description='Graph values from analysis.')
-parser.add_argument('-c','--chunk', nargs=1, choices=['nlogm', 'opencv'],
-                    help='Graph by chunk size on an algorithm.')
-# Pattern arg: substring to search genomes for.
-parser.add_argument('-k','--genenum', action="store_true",
-                    help='Analyze by number of texts the algorithms.')
-parser.add_argument('data', help='The file to load data from.')
-
-
-args = parser.parse_args()
-
-data = []
-with open(args.data) as dn:
-    title = dn.readline()
-    execution = dn.readline()
-    for line in dn:
-        data.append(yaml.load(line.rstrip()))
-
-if args.genenum:
-    plot_k_time(data)
-elif args.chunk:
-    plot_chunk_time(data, args.chunk[0])
-else:
-    plot_alg_time(data)
+    finish(pyplot, out)
+
+def plot_history(runs, out=None):
+    """
+    Plots the median time of every algorithm in a series of benchmark runs,
+    e.g. the history of regression.py.
+
+    Arguments
+    ---------
+    runs : list of (label, record)
+        the label of every run on the x axis, and the record of the same
+        benchmark point in every run
+    """
+    import matplotlib.pyplot as pyplot
+    time = {}
+    for i, (_, record) in enumerate(runs):
+        for alg in record['algorithms']:
+            time.setdefault(alg['name'], []).append((i, alg['time']))
+
+    pyplot.xlabel('Run')
+    pyplot.ylabel('Time/msecs')
+    for name in sorted(time):
+        x, y = zip(*time[name])
+        pyplot.plot(x, y, marker='o', label=name)
+    pyplot.xticks(range(len(runs)), [label for label, _ in runs],
+                  rotation=30, fontsize='small')
+    pyplot.title('Time Performance of Algorithms by Run')
+
+    pyplot.legend(loc='upper left', fontsize='small')
+    pyplot.tight_layout()
+    finish(pyplot, out)
+
+def plot_density(density, bin_size, titles=None, out=None):
+    """
+    Draws the match density of fftmatch.fft_match_index_n_sq_log_m(density=)
+    as a heat map, one row per genome.
+
+    Arguments
+    ---------
+    density : k X bins numpy array
+        the number of matches in every bin of every genome
+    bin_size : int
+    titles : list of str or None
+        the name of every genome
+    """
+    import matplotlib.pyplot as pyplot
+    k, bins = density.shape
+    pyplot.imshow(density, aspect='auto', interpolation='nearest',
+                  cmap='hot', extent=(0, bins*bin_size, k, 0))
+    pyplot.colorbar(label='Matches per {} bases'.format(bin_size))
+    pyplot.xlabel('Position')
+    pyplot.ylabel('Genome')
+    pyplot.yticks([i + 0.5 for i in range(k)],
+                  titles if titles is not None else range(k),
+                  fontsize='small')
+    pyplot.title('Match Density')
+
+    pyplot.tight_layout()
+    finish(pyplot, out)
+
+def load_density(path):
+    """
+    Reads what cli.py --density wrote: the bin size, the titles and the
+    density matrix, as three npy arrays
+    """
+    import numpy as np
+    with open(path, 'rb') as f:
+        bin_size = int(np.load(f))
+        titles = list(np.load(f))
+        density = np.load(f)
+    return density, bin_size, titles
+
+def load_data(path):
+    """
+    Reads the records of a results file, after its title and the line with
+    the command that it was made with
+    """
+    import yaml
+    data = []
+    with open(path) as dn:
+        title = dn.readline()
+        execution = dn.readline()
+        for line in dn:
+            data.append(yaml.safe_load(line.rstrip()))
+    return data
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Graph values from analysis.')
+    parser.add_argument('-c','--chunk', nargs=1, choices=['nlogm', 'opencv'],
+                        help='Graph by chunk size on an algorithm.')
+    # Pattern arg: substring to search genomes for.
+    parser.add_argument('-k','--genenum', action="store_true",
+                        help='Analyze by number of texts the algorithms.')
+    parser.add_argument('-H', '--heatmap', action='store_true', help='Draw \
+the match density that cli.py --density wrote as a heat map.')
+    parser.add_argument('data', help='The file to load data from.')
+    parser.add_argument('-o', '--output', help='Save the graph to this file \
+instead of showing it.')
+
+
+    args = parser.parse_args()
+    if args.output:
+        save_to_files()
+
+    if args.heatmap:
+        density, bin_size, titles = load_density(args.data)
+        plot_density(density, bin_size, titles, args.output)
+        parser.exit()
+
+    data = load_data(args.data)
+    if args.genenum:
+        plot_k_time(data, args.output)
+    elif args.chunk:
+        plot_chunk_time(data, args.chunk[0], args.output)
+    else:
+        plot_alg_time(data, args.output)
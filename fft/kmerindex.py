@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+'''
+A k-mer index of a fixed set of genomes, for seed-and-verify searches.
+
+fft_match_index_n_log_m transforms every chunk of every genome for every
+pattern.  When the genomes don't change, a KmerIndex of the positions of every
+k-mer (k bases of A, C, G and T) lets a search jump straight to the few
+offsets where the pattern can start: every occurrence of the pattern has the
+pattern's k-mers at fixed offsets from its start, so the candidates are the
+intersection of the positions of a few of the pattern's k-mers, shifted back
+by their offsets.  The candidates are verified with a direct comparison with
+the text, so the matches are exact.
+
+The index is in CSR form: the sorted distinct k-mer codes, the offsets of the
+positions of every k-mer, and the positions themselves, sorted by k-mer with
+numpy and in increasing order for every k-mer.  It is saved as .npy files that
+load() memory-maps, so a search only reads the pages of the k-mers and of the
+text that it looks at:
+
+    $ python kmerindex.py ../genomes/*.fa -o ../genomes/index -k 12
+    $ python cli.py -a kmer ACGTTGCAGCAGCAGTTG ../genomes/index
+
+    index = kmerindex.KmerIndex.load('../genomes/index')
+    matches = index.match_index('ACGTTGCAGCAGCAGTTG')
+
+Patterns need at least k characters, so smaller k serve shorter patterns at
+the cost of longer position lists.
+'''
+import argparse
+import numpy as np
+from fftmatch import check_mode, reduce_matches
+from packed import CODES, MASKED
+import pipeline
+import stages
+
+#the default k-mer length, and the longest one whose 2 bit codes fit in an
+#int64
+K = 10
+MAX_K = 31
+
+#the k-mers of a text are coded this many positions at a time
+BLOCK_LENGTH = 1 << 22
+
+#the candidates are verified in batches of about this many characters
+BATCH_ELEMENTS = 1 << 20
+
+#the number of the pattern's rarest k-mers whose positions are intersected
+SEEDS = 4
+
+#the arrays of a saved index, in path.<name>.npy
+FILES = ['k', 'kmers', 'offsets', 'positions', 'text', 'starts', 'titles']
+
+def check_k(k):
+    if not ((type(k) == int) and 0 < k <= MAX_K):
+        raise Exception('k must be an integer from 1 to {}'.format(MAX_K))
+
+def kmer_codes(text, k):
+    """
+    Returns the k-mers of text that only have A, C, G and T.
+
+    Arguments
+    ---------
+    text : str
+    k : int
+
+    Returns
+    -------
+    starts : int64 numpy array
+        the start of every k-mer, in increasing order
+    codes : int64 numpy array
+        the 2k bit code of every k-mer, its first base in the highest bits
+    """
+    values = CODES[np.frombuffer(text, dtype=np.uint8)]
+    n = len(values) - k + 1
+    if n <= 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty
+
+    #the number of masked characters before every position
+    masked = np.concatenate([[0], np.cumsum(values == MASKED)])
+    valid = masked[k:] == masked[:-k]
+    values = np.where(values == MASKED, 0, values).astype(np.int64)
+
+    codes = np.empty(n, dtype=np.int64)
+    for first in range(0, n, BLOCK_LENGTH):
+        block = codes[first:first + BLOCK_LENGTH]
+        block[:] = 0
+        for j in range(k):
+            block <<= 2
+            block |= values[first + j:first + j + len(block)]
+    starts = np.flatnonzero(valid)
+    return starts, codes[starts]
+
+class KmerIndex(object):
+    """
+    The positions of every k-mer of a set of texts.
+
+    Arguments
+    ---------
+    k : int
+    kmers : int64 numpy array
+        the sorted distinct codes of the k-mers, see kmer_codes
+    offsets : int64 numpy array of length len(kmers) + 1
+        the positions of kmers[i] are positions[offsets[i]:offsets[i + 1]]
+    positions : numpy array
+        the start of every k-mer in text, grouped by k-mer
+    text : uint8 numpy array
+        the characters of the texts, one after the other
+    starts : int64 numpy array
+        the start of every text in text, and the length of text
+    titles : list of str or None
+    """
+    def __init__(self, k, kmers, offsets, positions, text, starts,
+                 titles=None):
+        check_k(k)
+        self.k = k
+        self.kmers = kmers
+        self.offsets = offsets
+        self.positions = positions
+        self.text = text
+        self.starts = starts
+        self.titles = titles
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    @classmethod
+    def build(cls, texts, k=K, titles=None):
+        """ Indexes the k-mers of texts, a list of str """
+        check_k(k)
+        lengths = np.array([len(t) for t in texts], dtype=np.int64)
+        starts = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        #the smallest dtype that holds every position
+        dtype = np.uint32 if starts[-1] < 1 << 32 else np.int64
+
+        with stages.stage('encode'):
+            #an empty k-mer list for when there are no texts
+            found = [kmer_codes(t, k) for t in texts] + [kmer_codes('', k)]
+            positions = np.concatenate([s + start for (s, _), start
+                                        in zip(found, starts)]).astype(dtype)
+            codes = np.concatenate([c for _, c in found])
+            text = np.frombuffer(''.join(texts), dtype=np.uint8)
+
+        with stages.stage('sort'):
+            #the positions of every k-mer have to stay in order.  Sorting
+            #(code, position) keys that fit in an int64 is several times
+            #faster than a stable argsort of the codes.
+            shift = int(starts[-1]).bit_length()
+            if 2*k + shift <= 63:
+                keys = np.sort((codes << shift) | positions)
+                codes = keys >> shift
+                positions = (keys & ((1 << shift) - 1)).astype(dtype)
+            else:
+                order = np.argsort(codes, kind='mergesort')
+                codes = codes[order]
+                positions = positions[order]
+            #the first position of every k-mer
+            first = np.ones(len(codes), dtype=bool)
+            first[1:] = codes[1:] != codes[:-1]
+            heads = np.flatnonzero(first)
+            kmers = codes[heads]
+            offsets = np.append(heads, len(codes)).astype(np.int64)
+            stages.allocated(positions.nbytes + offsets.nbytes + kmers.nbytes)
+        return cls(k, kmers, offsets, positions, text, starts, titles)
+
+    @property
+    def nbytes(self):
+        return self.kmers.nbytes + self.offsets.nbytes + \
+               self.positions.nbytes + self.text.nbytes
+
+    def save(self, path):
+        """ Writes every array of the index to path.<name>.npy """
+        titles = self.titles
+        if titles is None:
+            titles = [str(i) for i in range(len(self))]
+        arrays = {'k': np.array(self.k), 'kmers': self.kmers,
+                  'offsets': self.offsets, 'positions': self.positions,
+                  'text': self.text, 'starts': self.starts,
+                  'titles': np.array(titles)}
+        for name in FILES:
+            np.save('{}.{}.npy'.format(path, name), arrays[name])
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a saved index, with the k-mers, the positions and the text
+        memory-mapped if mmap
+        """
+        def load_array(name, mode=None):
+            return np.load('{}.{}.npy'.format(path, name),
+                           mmap_mode=mode if mmap else None)
+
+        return cls(int(load_array('k')), load_array('kmers', 'r'),
+                   load_array('offsets', 'r'), load_array('positions', 'r'),
+                   load_array('text', 'r'), load_array('starts'),
+                   load_array('titles').tolist())
+
+    def lookup(self, code):
+        """ Returns the positions of the k-mer with this code, in order """
+        i = np.searchsorted(self.kmers, code)
+        if i == len(self.kmers) or self.kmers[i] != code:
+            return self.positions[:0]
+        return self.positions[self.offsets[i]:self.offsets[i + 1]]
+
+    def candidates(self, pattern):
+        """
+        Returns the sorted starts in text where the pattern's SEEDS rarest
+        k-mers are all at their offsets in the pattern, or every start if the
+        pattern has no k-mer of A, C, G and T
+        """
+        m = len(pattern)
+        if m < self.k:
+            raise Exception('the pattern is shorter than the k={} of the \
+index'.format(self.k))
+        with stages.stage('seed'):
+            seeds = [(self.lookup(code), j)
+                     for j, code in zip(*kmer_codes(pattern, self.k))]
+            if not seeds:
+                return np.arange(max(0, self.starts[-1] - m + 1))
+            seeds.sort(key=lambda seed: len(seed[0]))
+
+            found, j = seeds[0]
+            found = found.astype(np.int64) - j
+            found = found[found >= 0]
+            for positions, j in seeds[1:SEEDS]:
+                if not len(found):
+                    break
+                shifted = found + j
+                i = np.minimum(np.searchsorted(positions, shifted),
+                               len(positions) - 1)
+                found = found[positions[i] == shifted]
+            return found
+
+    def verify(self, found, pattern):
+        """ Returns which of the candidates really are occurrences """
+        m = len(pattern)
+        expected = np.frombuffer(pattern, dtype=np.uint8)
+        offsets = np.arange(m)
+        keep = np.empty(len(found), dtype=bool)
+        step = max(1, BATCH_ELEMENTS // m)
+        for i in range(0, len(found), step):
+            windows = self.text[found[i:i + step, np.newaxis] + offsets]
+            keep[i:i + step] = (windows == expected).all(axis=1)
+        return keep
+
+    def match_index(self, pattern, mode='index', limit=None):
+        '''Finds the pattern in every text of the index, with the same
+        interface as boyermoore.boyer_moore_mult_match_index.
+
+        Arguments
+        ---------
+        pattern : str
+            at least k characters long
+        mode : str
+            'index' to return the matches, 'count' to return how many there
+            are in every text
+        limit : int or None
+            only return (or count) the first limit matches of every text
+
+        Returns
+        -------
+        matches : numpy array
+            one row per text, the i'th row has the 0-based indices of matches
+            in the i'th text, or in 'count' mode the number of matches in
+            every text
+        '''
+        check_mode(mode, limit)
+        m = len(pattern)
+        found = self.candidates(pattern)
+
+        with stages.stage('verify'):
+            text_index = np.searchsorted(self.starts, found, 'right') - 1
+            #occurrences that would run into the next text
+            inside = found + m <= self.starts[text_index + 1]
+            found, text_index = found[inside], text_index[inside]
+            keep = self.verify(found, pattern)
+            found, text_index = found[keep], text_index[keep]
+
+        counts = np.bincount(text_index, minlength=len(self))
+        if mode == 'count':
+            return counts if limit is None else np.minimum(counts, limit)
+        matches = np.split(found - self.starts[text_index],
+                           np.cumsum(counts)[:-1])
+        return np.array([reduce_matches(a, limit=limit) for a in matches])
+
+def kmer_match_index(texts, pattern, mode='index', limit=None, k=K):
+    '''Indexes texts and searches them, with the same interface as
+    boyermoore.boyer_moore_mult_match_index.  Patterns shorter than k are
+    searched with an index of k-mers as long as the pattern.  Searching a
+    saved index with KmerIndex.match_index saves the indexing.
+    '''
+    check_mode(mode, limit)
+    if len(pattern) == 0:
+        raise Exception('kmer patterns must have at least 1 character')
+    if len(texts) == 0:
+        return np.array([], dtype=np.int64)
+    index = KmerIndex.build(texts, min(k, len(pattern)))
+    return index.match_index(pattern, mode, limit)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the k-mer index of \
+one-record FASTA files, which cli.py -a kmer searches.')
+    parser.add_argument('genomes', nargs='+', help='FASTA files')
+    parser.add_argument('-o', '--out', required=True, help='Path of the \
+index, which is saved as OUT.<array>.npy files')
+    parser.add_argument('-k', type=int, default=K, help='Length of the \
+k-mers, the shortest pattern the index can search. Default={}'.format(K))
+    args = parser.parse_args()
+
+    titles, genomes = zip(*pipeline.read_records(args.genomes))
+    index = KmerIndex.build(list(genomes), args.k, list(titles))
+    index.save(args.out)
+    print '{}: {} genomes, {} bases, {} distinct {}-mers in {} bytes'.format(
+        args.out, len(index), index.starts[-1], len(index.kmers), index.k,
+        index.nbytes)
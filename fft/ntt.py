@@ -0,0 +1,239 @@
+'''
+Exact correlations with a number-theoretic transform.
+
+The FFT algorithms call a window a match when its floating point score is
+closer to 0 than fftmatch.MATCH_THRESHOLD, so they depend on the rounding
+errors of the transforms staying small.  The number-theoretic transform (NTT)
+is the FFT over the integers modulo the prime MODULUS = 119*2^23 + 1, which
+has roots of unity for every power of two length up to 2^23.  Its correlations
+are exact integers modulo MODULUS, so the sum of squared differences of a
+window is exactly 0 when the window matches, and at least 1 otherwise, as long
+as it can't reach MODULUS (see check_exact).
+
+The transforms are radix-2, vectorized over the rows of a batch with uint64
+arithmetic: every operand is below MODULUS < 2^30, so the products fit.
+
+NTTWorkspace and ntt_match_index_batch stand in for fftmatch.Workspace and
+fftmatch.fft_match_index_batch, which is how the chunked searches of fftmatch
+run with exact=True:
+
+    fftmatch.fft_match_index_n_log_m(text, pattern, exact=True)
+'''
+import numpy as np
+import stages
+
+MODULUS = 998244353
+#a generator of the integers modulo MODULUS under multiplication
+GENERATOR = 3
+#the longest transform, the largest power of two that divides MODULUS - 1
+MAX_LENGTH = 1 << 23
+
+P = np.uint64(MODULUS)
+
+#(length, inverse) -> the twiddle factors of every stage of a transform
+twiddle_cache = {}
+#length -> the bit reversal permutation of a transform
+permutation_cache = {}
+
+def transform_length(width):
+    """ The power of two that windows of this width are padded to """
+    length = 1 << int(np.ceil(np.log2(max(width, 2))))
+    if length > MAX_LENGTH:
+        raise Exception('windows of width {} are too wide for the NTT, which \
+is at most {} long'.format(width, MAX_LENGTH))
+    return length
+
+def bit_reversal(length):
+    if length not in permutation_cache:
+        bits = length.bit_length() - 1
+        indices = np.arange(length)
+        permutation = np.zeros(length, dtype=np.int64)
+        for bit in range(bits):
+            permutation |= ((indices >> bit) & 1) << (bits - 1 - bit)
+        permutation_cache[length] = permutation
+    return permutation_cache[length]
+
+def twiddles(length, inverse=False):
+    """
+    Returns the twiddle factors of every stage of a transform: the stage that
+    combines blocks of half elements gets the powers 0, ..., half-1 of a
+    primitive 2*half'th root of unity, or of its inverse.
+    """
+    key = (length, inverse)
+    if key not in twiddle_cache:
+        factors = []
+        half = 1
+        while half < length:
+            root = pow(GENERATOR, (MODULUS - 1) // (2*half), MODULUS)
+            if inverse:
+                root = pow(root, MODULUS - 2, MODULUS)
+            powers = np.ones(half, dtype=np.uint64)
+            step = 1
+            while step < half:
+                powers[step:2*step] = powers[:step] * \
+                    np.uint64(pow(root, step, MODULUS)) % P
+                step *= 2
+            factors.append(powers)
+            half *= 2
+        twiddle_cache[key] = factors
+    return twiddle_cache[key]
+
+def ntt(a, inverse=False, scale=True):
+    """
+    Transforms every row of a.
+
+    Arguments
+    ---------
+    a : r X L uint64 numpy array
+        entries below MODULUS, with L a power of two
+    inverse : bool
+        the inverse transform
+    scale : bool
+        whether the inverse transform is scaled by 1/L.  Callers that scale
+        one of the factors of a product instead save a pass over the result.
+
+    Returns
+    -------
+    key : r X L uint64 numpy array
+    """
+    rows, length = a.shape
+    a = a[:, bit_reversal(length)]
+    half = 1
+    for factors in twiddles(length, inverse):
+        blocks = a.reshape(rows, length // (2*half), 2, half)
+        even, odd = blocks[:, :, 0], blocks[:, :, 1]
+        #the first stage only has the factor 1
+        if half > 1:
+            odd *= factors
+            odd %= P
+        #even - odd and even + odd, without going below 0
+        difference = even + P
+        difference -= odd
+        even += odd
+        reduce_sum(even, odd)
+        reduce_sum(difference, odd)
+        odd[...] = difference
+        half *= 2
+    if inverse and scale:
+        a *= inverse_length(length)
+        a %= P
+    return a
+
+def inverse_length(length):
+    """ 1/length modulo MODULUS """
+    return np.uint64(pow(length, MODULUS - 2, MODULUS))
+
+def reduce_sum(a, scratch):
+    """
+    Reduces a, whose entries are below 2*MODULUS, modulo MODULUS in place.
+    a - MODULUS wraps around to a huge number when a is already reduced, so
+    the smaller of the two is the remainder; that is much cheaper than the
+    uint64 division of np.remainder.
+    """
+    np.subtract(a, P, out=scratch)
+    np.minimum(a, scratch, out=a)
+
+def check_exact(texts, pattern, m):
+    """
+    Raises if the sum of squared differences of a window of texts and the
+    pattern could reach MODULUS, where a mismatch would score 0
+    """
+    low = min(texts.min(), pattern.min())
+    high = max(texts.max(), pattern.max())
+    if m * (high - low)**2 >= MODULUS:
+        raise Exception('the pattern is too long to match exactly modulo {}'
+                        .format(MODULUS))
+
+class NTTWorkspace(object):
+    """
+    The pattern transform and the window buffer of ntt_match_index_batch,
+    which has the interface of fftmatch.Workspace that the chunked searches
+    use.
+
+    Arguments
+    ---------
+    pattern : numpy array of length w
+        the reversed, binary encoded pattern, padded with 0s to length w
+    pattern_length : int
+        length of the pattern before padding
+    """
+    def __init__(self, pattern, pattern_length):
+        self.pattern_length = pattern_length
+        self.width = len(pattern)
+        self.length = transform_length(self.width)
+        self.wildcard = False
+
+        codes = np.zeros((1, self.length), dtype=np.uint64)
+        codes[0, :self.width] = pattern
+        #the 1/L of the inverse transforms is folded into the pattern
+        self.pattern_key = ntt(codes)[0] * inverse_length(self.length) % P
+        self.pattern_power = np.dot(pattern, pattern)
+        self.rows = 0
+        self.windows = None
+
+    def window_buffer(self, rows):
+        """ Returns a buffer that chunk_windows can copy a batch of rows into """
+        if rows > self.rows:
+            self.rows = rows
+            self.windows = np.empty((rows, self.width))
+            stages.allocated(self.windows.nbytes)
+        return self.windows[:rows]
+
+    def copy(self):
+        other = NTTWorkspace.__new__(NTTWorkspace)
+        other.__dict__.update(self.__dict__)
+        other.rows = 0
+        other.windows = None
+        return other
+
+def ntt_match_index_batch(windows, workspace, workers=1, sums=None):
+    """
+    The exact counterpart of fftmatch.fft_match_index_batch: the sum of
+    squared differences of the pattern and every window of windows, with the
+    correlation term from the NTT of the windows zero-padded to a power of two.
+
+    Arguments
+    ---------
+    windows : r X w numpy array
+        binary encoded text windows, one per row
+    workspace : NTTWorkspace
+        the workspace of the pattern, with w == workspace.width
+    workers : int
+        unused, the transforms run on the calling thread
+    sums : numpy array or None
+        the window sums of the windows plus the sum of the squares of the
+        pattern, see fftmatch.fft_match_index_batch
+
+    Returns
+    -------
+    rows, cols : numpy arrays
+        the window and the 0-based index inside that window of every match, in
+        row-major order
+    """
+    from fftmatch import window_sums
+
+    r, w = windows.shape
+    m = workspace.pattern_length
+    with stages.stage('ntt'):
+        codes = np.zeros((r, workspace.length), dtype=np.uint64)
+        codes[:, :w] = windows
+        key = ntt(codes)
+        stages.allocated(codes.nbytes + key.nbytes)
+    with stages.stage('products'):
+        key *= workspace.pattern_key
+        key %= P
+    with stages.stage('intt'):
+        correlation = ntt(key, inverse=True, scale=False)
+        stages.allocated(correlation.nbytes)
+
+    with stages.stage('powers'):
+        if sums is None:
+            sums = window_sums(windows, m)
+            sums += workspace.pattern_power
+        #the sums are whole numbers, which float64 holds exactly
+        sums = np.reshape(sums, (r, w))[:, :w-m+1].astype(np.int64)
+        scores = sums - 2*correlation[:, m-1:w].astype(np.int64)
+        scores %= MODULUS
+
+    with stages.stage('threshold'):
+        return np.nonzero(scores == 0)
@@ -0,0 +1,159 @@
+'''
+Writers for the matches that cli.py finds, one genome at a time.
+
+    text    the title and the python list of the indices, like cli.py always
+            printed
+    tsv     one "title<TAB>index" line per match
+    bed     one "chrom<TAB>start<TAB>end" line per match, where chrom is the
+            first word of the title
+    jsonl   one {"genome", "pattern", "matches"} JSON object per genome
+    npy     for every genome, an npy array with the title and an npy array
+            with the delta encoded indices: the first index, then the
+            differences between consecutive indices, as int32 if they fit and
+            int64 otherwise.  read_npy decodes them.
+
+In 'count' mode only the number of matches of every genome is written, as
+"title : Found N matches", a "title<TAB>N" line or a {"genome", "pattern",
+"count"} JSON object.
+
+The line formats, and the lists of the text and jsonl formats, are written in
+blocks of BLOCK_SIZE matches, so a genome with millions of matches is never
+turned into one big string.
+'''
+import json
+import numpy as np
+
+FORMATS = ['text', 'tsv', 'npy', 'bed', 'jsonl']
+
+#the formats that can hold the number of matches instead of the matches
+COUNT_FORMATS = ['text', 'tsv', 'jsonl']
+
+#number of matches that are formatted at a time
+BLOCK_SIZE = 1 << 16
+
+def delta_encode(indices):
+    """
+    Returns the sorted indices as the first index followed by the differences
+    between consecutive indices, in the smallest of int32 and int64 that
+    holds them
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    deltas = np.diff(indices)
+    first = indices[:1]
+    largest = max(np.abs(first).max() if len(first) else 0,
+                  np.abs(deltas).max() if len(deltas) else 0)
+    dtype = np.int32 if largest <= np.iinfo(np.int32).max else np.int64
+    return np.concatenate([first, deltas]).astype(dtype)
+
+def delta_decode(deltas):
+    return np.cumsum(deltas, dtype=np.int64)
+
+def write_lines(stream, prefix, values, suffix=None):
+    """
+    Writes a prefix + value (+ suffix) line for every value, BLOCK_SIZE lines
+    at a time
+    """
+    for start in range(0, len(values), BLOCK_SIZE):
+        block = values[start:start + BLOCK_SIZE].astype(str)
+        if suffix is None:
+            lines = [prefix + v for v in block]
+        else:
+            ends = suffix[start:start + BLOCK_SIZE].astype(str)
+            lines = [prefix + v + '\t' + e for v, e in zip(block, ends)]
+        stream.write('\n'.join(lines) + '\n')
+
+def write_list(stream, values):
+    """
+    Writes the values like the python or JSON list of them, BLOCK_SIZE values
+    at a time
+    """
+    stream.write('[')
+    for start in range(0, len(values), BLOCK_SIZE):
+        if start:
+            stream.write(', ')
+        stream.write(', '.join(values[start:start + BLOCK_SIZE].astype(str)))
+    stream.write(']')
+
+class MatchWriter(object):
+    """
+    Writes the matches of pattern in every genome to stream in one of FORMATS.
+
+    Arguments
+    ---------
+    stream : file
+    pattern : str
+    format : str
+    mode : str
+        'index' to write the matches, 'count' to write the number of matches
+    """
+    def __init__(self, stream, pattern, format='text', mode='index'):
+        if format not in FORMATS:
+            raise Exception('unknown format {}, choose from {}'
+                            .format(format, ', '.join(FORMATS)))
+        if mode == 'count' and format not in COUNT_FORMATS:
+            raise Exception('only the {} formats can hold counts'
+                            .format(', '.join(COUNT_FORMATS)))
+        self.stream = stream
+        self.pattern = pattern
+        self.format = format
+        self.mode = mode
+
+    def write(self, title, matches):
+        """ Writes the matches of a genome, or their number in 'count' mode """
+        if self.mode == 'count':
+            self.write_count(title, int(matches))
+        else:
+            matches = np.asarray(matches).astype(np.int64)
+            getattr(self, 'write_' + self.format)(title, matches)
+        self.stream.flush()
+
+    def write_count(self, title, count):
+        if self.format == 'text':
+            self.stream.write('{} : Found {} matches\n'.format(title, count))
+        elif self.format == 'tsv':
+            self.stream.write('{}\t{}\n'.format(title, count))
+        else:
+            self.stream.write(json.dumps({'genome': title,
+                                          'pattern': self.pattern,
+                                          'count': count}) + '\n')
+
+    def write_text(self, title, matches):
+        self.stream.write('{} : Found matches at indices '.format(title))
+        write_list(self.stream, matches)
+        self.stream.write('\n')
+
+    def write_tsv(self, title, matches):
+        write_lines(self.stream, title + '\t', matches)
+
+    def write_bed(self, title, matches):
+        words = title.lstrip('>').split()
+        chrom = words[0] if words else title
+        write_lines(self.stream, chrom + '\t', matches,
+                    matches + len(self.pattern))
+
+    def write_jsonl(self, title, matches):
+        self.stream.write('{"matches": ')
+        write_list(self.stream, matches)
+        self.stream.write(', "pattern": {}, "genome": {}}}\n'.format(
+            json.dumps(self.pattern), json.dumps(title)))
+
+    def write_npy(self, title, matches):
+        np.save(self.stream, np.array(title))
+        np.save(self.stream, delta_encode(matches))
+
+def read_npy(stream):
+    """
+    Reads what the npy format wrote.
+
+    Returns
+    -------
+    results : generator of (title, indices)
+        indices is an int64 numpy array
+    """
+    while True:
+        try:
+            title = np.load(stream)
+        except (IOError, ValueError):
+            #the end of the stream
+            return
+        yield str(title), delta_decode(np.load(stream))
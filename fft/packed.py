@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+'''
+Genomes packed into 2 bits per base.
+
+texts_to_array keeps every base as a float32 and string_to_binary_array as a
+float64, 32 to 64 times more than the 2 bits that A, C, G and T need, which
+limits how many genomes the algorithms can hold at once.  A PackedGenome
+keeps 4 bases per byte, and the runs of every other character (N, IUPAC codes,
+lower case bases, ...) in a side mask, which is small because they come in a
+few long runs.  decode() unpacks just the bases of one window, in the dtype
+the kernel wants, so the chunked algorithms accept packed genomes directly:
+
+    genome = packed.PackedGenome.from_string(text)
+    fftmatch.fft_match_index_n_log_m(genome, pattern)
+    fftmatch.fft_match_index_n_sq_log_m([genome, other], pattern)
+    cvmatch.cv_match_index_chunk([genome, other], pattern)
+
+Packed genomes are saved as two .npy files, which load() memory-maps, so a
+search only reads the pages of the genome that it decodes:
+
+    $ python packed.py ../genomes/*.fa -o ../genomes/packed
+'''
+import argparse
+import os
+import numpy as np
+
+BASES = 'ACGT'
+
+#character code -> 2 bit code, or MASKED for the characters in the mask
+MASKED = 255
+CODES = np.full(256, MASKED, dtype=np.uint8)
+CODES[np.frombuffer(BASES, dtype=np.uint8)] = np.arange(len(BASES))
+
+#2 bit code -> character code
+CHARACTERS = np.frombuffer(BASES, dtype=np.uint8).copy()
+
+#the shifts of the 4 bases of a byte, the first base in the low bits
+SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)
+
+class PackedGenome(object):
+    """
+    A genome with 4 bases per byte.
+
+    Arguments
+    ---------
+    bases : uint8 numpy array of length ceil(length / 4)
+        the 2 bit codes of the bases, 0 where the mask is
+    length : int
+        the number of bases
+    mask : r X 3 int64 numpy array
+        the (start, stop, character code) of every run of characters that
+        aren't A, C, G or T, sorted by start
+    """
+    def __init__(self, bases, length, mask):
+        self.bases = bases
+        self.length = length
+        self.mask = mask
+
+    def __len__(self):
+        return self.length
+
+    @classmethod
+    def from_string(cls, text):
+        codes = np.frombuffer(text, dtype=np.uint8)
+        values = CODES[codes]
+
+        masked = np.flatnonzero(values == MASKED)
+        characters = codes[masked].astype(np.int64)
+        #a run ends where the next masked character isn't the next base, or
+        #isn't the same character
+        ends = np.flatnonzero((np.diff(masked) != 1) |
+                              (np.diff(characters) != 0)) + 1
+        firsts = np.concatenate([[0], ends]).astype(np.int64)
+        lasts = np.concatenate([ends, [len(masked)]]).astype(np.int64) - 1
+        if len(masked):
+            mask = np.column_stack([masked[firsts], masked[lasts] + 1,
+                                    characters[firsts]])
+        else:
+            mask = np.zeros((0, 3), dtype=np.int64)
+        values[masked] = 0
+
+        padded = np.zeros(-(-len(values) // 4) * 4, dtype=np.uint8)
+        padded[:len(values)] = values
+        quads = padded.reshape(-1, 4) << SHIFTS
+        bases = np.bitwise_or.reduce(quads, axis=1).astype(np.uint8)
+        return cls(bases, len(text), mask.astype(np.int64))
+
+    def decode(self, start, stop, dtype=np.uint8, out=None, fill=0):
+        """
+        Unpacks the character codes of the bases from start up to stop.
+
+        Arguments
+        ---------
+        start, stop : int
+            stop may be past the end of the genome
+        dtype : numpy dtype
+            the dtype of the codes, e.g. float64 for the FFT kernels
+        out : numpy array of length stop - start, or None
+        fill : int
+            the code of the positions past the end of the genome, the null
+            character 0 of the algorithms
+
+        Returns
+        -------
+        codes : numpy array of length stop - start
+        """
+        if out is None:
+            out = np.empty(stop - start, dtype=dtype)
+        end = max(start, min(stop, self.length))
+        out[end - start:] = fill
+        if end == start:
+            return out
+
+        first = start // 4
+        quads = self.bases[first:-(-end // 4)]
+        values = (quads[:, np.newaxis] >> SHIFTS) & 3
+        offset = start - 4*first
+        out[:end - start] = CHARACTERS[values.ravel()[offset:offset +
+                                                      end - start]]
+
+        #the runs of masked characters that overlap the window
+        runs = self.mask[np.searchsorted(self.mask[:, 1], start, 'right'):
+                         np.searchsorted(self.mask[:, 0], end, 'left')]
+        for run_start, run_stop, character in runs:
+            out[max(run_start, start) - start:
+                min(run_stop, end) - start] = character
+        return out
+
+    def to_string(self):
+        return self.decode(0, self.length).tostring()
+
+    @property
+    def nbytes(self):
+        return self.bases.nbytes + self.mask.nbytes
+
+    def save(self, path):
+        """
+        Writes path.bases.npy, the packed bases, and path.mask.npy, whose
+        first row is (length, 0, 0) and whose other rows are the mask
+        """
+        np.save(path + '.bases.npy', self.bases)
+        np.save(path + '.mask.npy', np.vstack([[self.length, 0, 0],
+                                               self.mask]))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """ Loads a saved genome, with the bases memory-mapped if mmap """
+        bases = np.load(path + '.bases.npy', mmap_mode='r' if mmap else None)
+        mask = np.load(path + '.mask.npy')
+        return cls(bases, int(mask[0, 0]), mask[1:])
+
+def decode_rows(texts, start, stop, dtype=np.float64, fill=0):
+    """
+    Returns the codes of the characters from start up to stop of every text,
+    as a k X (stop - start) array
+
+    Arguments
+    ---------
+    texts : list of PackedGenome or str
+    """
+    out = np.empty((len(texts), stop - start), dtype=dtype)
+    for row, text in zip(out, texts):
+        if isinstance(text, PackedGenome):
+            text.decode(start, stop, out=row, fill=fill)
+        else:
+            part = np.frombuffer(text[start:stop], dtype=np.uint8)
+            row[:len(part)] = part
+            row[len(part):] = fill
+    return out
+
+def code_range(texts, fill=0):
+    """
+    Returns the smallest and the largest code that decode_rows can return for
+    texts
+    """
+    low = high = fill
+    for text in texts:
+        if isinstance(text, PackedGenome):
+            codes = np.concatenate([CHARACTERS, text.mask[:, 2]])
+        else:
+            codes = np.frombuffer(text, dtype=np.uint8)
+        if len(codes):
+            low, high = min(low, codes.min()), max(high, codes.max())
+    return low, high
+
+def is_packed(texts):
+    """ Whether any of the texts is a PackedGenome """
+    return any(isinstance(text, PackedGenome) for text in texts)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack one-record FASTA files \
+into 2 bits per base.')
+    parser.add_argument('genomes', nargs='+', help='FASTA files')
+    parser.add_argument('-o', '--out', default='.', help='Directory of the \
+packed genomes, which are named after the FASTA files. Default=.')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    for path in args.genomes:
+        with open(path) as f:
+            f.readline()
+            genome = PackedGenome.from_string(''.join(line.rstrip()
+                                                      for line in f))
+        name = os.path.join(args.out,
+                            os.path.splitext(os.path.basename(path))[0])
+        genome.save(name)
+        print '{}: {} bases in {} bytes, {} masked runs'.format(name,
+            len(genome), genome.nbytes, len(genome.mask))
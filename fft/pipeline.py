@@ -0,0 +1,181 @@
+'''
+Reading, searching and writing many genomes at the same time.
+
+cli.py normally reads every genome before it searches any of them, so the CPU
+waits for the disk and then the disk waits for the CPU.  run() overlaps the
+three: a reader thread parses and encodes the next FASTA record while the
+calling thread searches the current one, and a writer thread writes the
+matches of the previous one.  The threads hand records over through queues of
+at most depth records, so the memory stays flat however many genomes there
+are, and the reader can be at most depth records ahead of the search.
+
+    throughput = pipeline.run(pipeline.read_records(paths),
+                              lambda genome: bm.boyer_moore_match_index(
+                                  genome, 'CAG'),
+                              writer.write)
+    print throughput
+
+    $ python cli.py --pipeline -a nlogm CAG ../genomes/*.fa
+'''
+import collections
+import Queue
+import sys
+import threading
+import timeit
+import stages
+
+#records that can wait between two threads
+QUEUE_DEPTH = 2
+
+#how often, in seconds, a blocked thread checks whether another one failed
+POLL_SECONDS = 0.1
+
+#put on a queue after its last record
+DONE = object()
+
+def read_records(paths):
+    """
+    Generates the (title, genome) of one-record FASTA files one file at a
+    time, with the titles numbered like cli.py's
+    """
+    count = collections.defaultdict(int)
+    for path in paths:
+        with stages.stage('read'), open(path) as gn:
+            title = gn.readline().rstrip()
+            genome = ''.join(line.rstrip() for line in gn)
+        count[title] += 1
+        yield title + str(count[title]), genome
+
+class Throughput(object):
+    """ The number of records and bases that run() searched, and how long it
+    took """
+    def __init__(self, records=0, bases=0, seconds=0.0):
+        self.records = records
+        self.bases = bases
+        self.seconds = seconds
+
+    @property
+    def bases_per_second(self):
+        return self.bases / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return '{} genomes, {} bases in {:.3f} s: {:.0f} bases/s'.format(
+            self.records, self.bases, self.seconds, self.bases_per_second)
+
+def put(queue, entry, stop):
+    """ Puts entry on queue unless stop is set first, returns whether it did """
+    while not stop.is_set():
+        try:
+            queue.put(entry, timeout=POLL_SECONDS)
+            return True
+        except Queue.Full:
+            pass
+    return False
+
+def get(queue, stop):
+    """ Gets the next entry of queue, or DONE once stop is set """
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=POLL_SECONDS)
+        except Queue.Empty:
+            pass
+    return DONE
+
+def start(target, failures, stop):
+    """
+    Runs target on a daemon thread.  If it raises, the exception is added to
+    failures and stop is set, which unblocks the other threads.
+    """
+    parent = stages.current()
+
+    def run():
+        try:
+            with stages.within(parent):
+                target()
+        except Exception:
+            failures.append(sys.exc_info())
+            stop.set()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def run(records, search, write, encode=None, depth=QUEUE_DEPTH):
+    """
+    Searches every record on the calling thread, while the next records are
+    read on a reader thread and the results are written on a writer thread.
+
+    Arguments
+    ---------
+    records : iterable of (title, genome)
+        iterated on the reader thread, e.g. read_records(paths)
+    search : function
+        search(item) -> result, called in record order
+    write : function
+        write(title, result), called on the writer thread in record order
+    encode : function or None
+        encode(genome) -> item, called on the reader thread, e.g.
+        packed.PackedGenome.from_string.  None searches the genomes as they
+        are.
+    depth : int
+        the number of records that can wait for the search, and of results
+        that can wait for the writer
+
+    Returns
+    -------
+    throughput : Throughput
+
+    An exception in any of the threads stops all of them, and is raised again
+    here.
+    """
+    if depth <= 0:
+        raise Exception('the queue depth must be positive')
+    encoded = Queue.Queue(depth)
+    found = Queue.Queue(depth)
+    failures = []
+    stop = threading.Event()
+
+    def reader():
+        for title, genome in records:
+            with stages.stage('encode'):
+                item = genome if encode is None else encode(genome)
+            if not put(encoded, (title, len(genome), item), stop):
+                return
+        put(encoded, DONE, stop)
+
+    def writer():
+        while True:
+            entry = get(found, stop)
+            if entry is DONE:
+                return
+            with stages.stage('write'):
+                write(*entry)
+
+    throughput = Throughput()
+    begin = timeit.default_timer()
+    threads = [start(reader, failures, stop), start(writer, failures, stop)]
+    try:
+        while True:
+            entry = get(encoded, stop)
+            if entry is DONE:
+                break
+            title, length, item = entry
+            result = search(item)
+            throughput.records += 1
+            throughput.bases += length
+            if not put(found, (title, result), stop):
+                break
+        put(found, DONE, stop)
+    except Exception:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if failures:
+        error_type, error, traceback = failures[0]
+        raise error_type, error, traceback
+    throughput.seconds = timeit.default_timer() - begin
+    return throughput
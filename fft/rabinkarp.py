@@ -0,0 +1,178 @@
+'''
+Rabin-Karp rolling hash matching, vectorized over many texts.
+
+The hash of every window of every text comes from one cumulative sum per
+modulus: with S[j] = sum_{x<j} t[x] B^x mod q, the window that starts at i has
+S[i+m] - S[i] = B^i sum_j t[i+j] B^j, which is B^i times the hash of the
+pattern when the window matches.  So candidate detection is a few passes over
+a texts_to_array-style matrix, whatever the pattern length.  Windows are
+candidates when they agree with the pattern under two independent moduli, and
+every candidate is verified against the pattern, so the matches are exact.
+
+The texts are cut into segments that overlap by len(pattern)-1 characters,
+like in shiftor.py, so that the powers of B are shared by all of the rows and
+the cumulative sums can't overflow.
+
+Includes wrappers that follow the same function interface as boyermoore.py
+
+def rabin_karp_match_index(texts, pattern, mode='index', limit=None)
+'''
+import numpy as np
+from fftmatch import check_mode, reduce_matches, search_unique
+import stages
+
+#two primes below 2^31, so that a product of two residues fits in an int64,
+#and the base of the hash of each of them
+MODULI = (2147483647, 1000000007)
+HASH_BASES = (131, 137)
+
+#number of characters in each segment of a text
+SEGMENT_LENGTH = 1 << 14
+
+#the segments are hashed in batches of about this many characters
+BATCH_ELEMENTS = 1 << 20
+
+def powers(base, modulus, n):
+    """ Returns base^0, ..., base^(n-1) modulo modulus """
+    out = np.ones(n, dtype=np.int64)
+    step = 1
+    while step < n:
+        count = min(step, n - step)
+        out[step:step + count] = out[:count] * pow(base, step, modulus) % \
+                                 modulus
+        step *= 2
+    return out
+
+def pattern_hash(pattern, base, modulus):
+    return sum(ord(c) * pow(base, j, modulus)
+               for j, c in enumerate(pattern)) % modulus
+
+def candidates(rows, pattern, factors):
+    """
+    Finds the windows of rows that hash like the pattern under every modulus.
+
+    Arguments
+    ---------
+    rows : r X w uint8 numpy array
+    pattern : str
+    factors : list of (base, modulus, powers)
+        the powers are base^0, ..., base^(w-1) modulo modulus
+
+    Returns
+    -------
+    rows, starts : numpy arrays
+        the row and the start of every candidate, in row-major order
+    """
+    r, w = rows.shape
+    m = len(pattern)
+    agree = np.ones((r, w - m + 1), dtype=bool)
+    prefix = np.zeros((r, w + 1), dtype=np.int64)
+    for base, modulus, weights in factors:
+        with stages.stage('hash'):
+            np.multiply(rows, weights, out=prefix[:, 1:])
+            prefix[:, 1:] %= modulus
+            #the sums stay below w * modulus, far from overflowing
+            np.cumsum(prefix[:, 1:], axis=1, out=prefix[:, 1:])
+            hashes = prefix[:, m:] - prefix[:, :-m]
+            hashes %= modulus
+        with stages.stage('compare'):
+            target = pattern_hash(pattern, base, modulus) * \
+                     weights[:w - m + 1] % modulus
+            agree &= hashes == target
+    return np.nonzero(agree)
+
+def verify(arr, texts, starts, pattern):
+    """ Returns which of the candidates really are occurrences of pattern """
+    m = len(pattern)
+    expected = np.frombuffer(pattern, dtype=np.uint8)
+    offsets = np.arange(m)
+    keep = np.empty(len(starts), dtype=bool)
+    step = max(1, BATCH_ELEMENTS // m)
+    for i in range(0, len(starts), step):
+        windows = arr[texts[i:i + step, np.newaxis],
+                      starts[i:i + step, np.newaxis] + offsets]
+        keep[i:i + step] = (windows == expected).all(axis=1)
+    return keep
+
+@search_unique
+def rabin_karp_match_index(texts, pattern, mode='index', limit=None):
+    '''Rabin-Karp matching on multiple texts that uses the same interface as
+    boyermoore.boyer_moore_mult_match_index.
+
+    Arguments
+    ---------
+    texts : list of str
+    pattern : str
+    mode : str
+        'index' to return the matches, 'count' to return how many there are
+        in every text
+    limit : int or None
+        stop at the first batch of segments after which every text has this
+        many matches, and only return (or count) the first limit matches of
+        every text
+
+    Returns
+    -------
+    matches : numpy array
+        k rows, the i'th row has the 0-based indices of matches in texts[i],
+        or in 'count' mode the number of matches in every text
+    '''
+    check_mode(mode, limit)
+    k = len(texts)
+    m = len(pattern)
+    if m == 0:
+        raise Exception('rabin_karp patterns must have at least 1 character')
+    if k == 0:
+        return np.array([], dtype=np.int64)
+    lengths = np.array([len(t) for t in texts], dtype=np.int64)
+    n = max(lengths.max(), m)
+
+    seg = max(1, min(max(SEGMENT_LENGTH, 4*m), n))
+    segments = -(-n // seg)
+    width = seg + m - 1
+    with stages.stage('encode'):
+        arr = np.zeros((k, segments*seg + m - 1), dtype=np.uint8)
+        for index, text in enumerate(texts):
+            arr[index, :len(text)] = np.frombuffer(text, dtype=np.uint8)
+        view = np.lib.stride_tricks.as_strided(arr,
+                    shape=(k, segments, width),
+                    strides=(arr.strides[0], seg, 1))
+        factors = [(base, modulus, powers(base, modulus, width))
+                   for base, modulus in zip(HASH_BASES, MODULI)]
+
+    found_texts, found_starts = [], []
+    counts = np.zeros(k, dtype=np.int64)
+    per_batch = max(1, BATCH_ELEMENTS // max(1, k*width))
+    for first in range(0, segments, per_batch):
+        batch = view[:, first:first + per_batch]
+        b = batch.shape[1]
+        rows, starts = candidates(batch.reshape(k*b, width), pattern, factors)
+
+        with stages.stage('verify'):
+            text_index = rows // b
+            starts = (first + rows % b)*seg + starts
+            keep = verify(arr, text_index, starts, pattern)
+            #occurrences that run into the padding
+            keep &= starts + m <= lengths[text_index]
+            text_index, starts = text_index[keep], starts[keep]
+        found_texts.append(text_index)
+        found_starts.append(starts)
+
+        counts += np.bincount(text_index, minlength=k)
+        if limit is not None and counts.min() >= limit:
+            break
+
+    if mode == 'count':
+        return counts if limit is None else np.minimum(counts, limit)
+
+    with stages.stage('merge'):
+        text_index = np.concatenate(found_texts)
+        starts = np.concatenate(found_starts)
+        #stable sort by text, which keeps each text's matches in order
+        order = np.argsort(text_index, kind='mergesort')
+        matches = np.split(starts[order], np.cumsum(counts)[:-1])
+        return np.array([reduce_matches(a, limit=limit) for a in matches])
+
+if __name__ == "__main__":
+    t = 'haystack needle haystack'
+    print rabin_karp_match_index([t, t + ' needle'], 'needle')
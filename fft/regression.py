@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+'''
+Performance regression checks against a stored baseline.
+
+Runs a fixed subset of benchmatrix.py (SUBSET, on the same seeded synthetic
+genomes every time), compares the median time of every algorithm with the
+baseline of this machine, and fails with a table of the slower medians if any
+of them got slower than the tolerance allows:
+
+    $ python regression.py --save-baseline   # once, on a known good commit
+    $ python regression.py                   # after a change
+    $ python regression.py --plot-only       # redraw the graphs
+
+The baselines and the history of every run are kept per machine, because
+times of different machines can't be compared:
+
+    ../results/baselines/<machine>/baseline.json
+    ../results/baselines/<machine>/history.json
+    ../results/graphs/<machine>/*.png
+
+Both files have one bench.py run record per line, with the 'run' label (the
+time and the git commit) of the run they came from.
+'''
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import bench
+import benchmatrix
+
+#the fixed benchmark points, every combination of which is run
+SUBSET = {'lengths': [4096, 65536], 'pattern_lengths': [3, 12], 'ks': [1, 4],
+          'chunk_sizes': ['m', 96]}
+
+#every algorithm but the quadratic naive one
+ALGORITHMS = [name for name in benchmatrix.ALGORITHMS if name != 'naive']
+
+def machine_tag():
+    """ Names the baselines of this machine: its host name and architecture """
+    tag = '{}-{}'.format(platform.node() or 'unknown', platform.machine())
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', tag)
+
+def run_label():
+    """ The time and, in a git checkout, the commit of a run """
+    label = time.strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(['git', 'rev-parse', '--short',
+                                              'HEAD'], stderr=devnull)
+        label += ' ' + commit.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return label
+
+def run_subset(names=None, repeats=5, warmup=1, subset=None):
+    """
+    Benchmarks the algorithms on the subset.
+
+    Returns
+    -------
+    records : list of dict
+        the bench.run_record of every point, labelled with run_label()
+    """
+    subset = subset or SUBSET
+    records = benchmatrix.run_matrix(subset['lengths'],
+                                     subset['pattern_lengths'], subset['ks'],
+                                     subset['chunk_sizes'], names or ALGORITHMS,
+                                     repeats, warmup)
+    label = run_label()
+    for record in records:
+        record['run'] = label
+    return records
+
+def compare(baseline, current, tolerance=0.2, min_ms=0.5):
+    """
+    Compares the medians of two runs.
+
+    A median regressed if it grew by more than the tolerance, by more than
+    min_ms and by more than the interquartile ranges of both runs, so that
+    the fastest algorithms and noisy machines don't fail on timer noise.
+
+    Arguments
+    ---------
+    baseline, current : list of dict
+        run records
+    tolerance : float
+        the fraction by which a median may grow
+    min_ms : float
+
+    Returns
+    -------
+    rows : list of (key, baseline median, current median, ratio, regressed)
+        the rows of bench.diff_records, once for every algorithm
+    failures : list of str
+        the regressions and the algorithms that returned wrong matches
+    """
+    noise = {}
+    for record in baseline + current:
+        for a in record['algorithms']:
+            key = bench.record_key(record, a)
+            noise[key] = noise.get(key, 0) + a.get('iqr_ms', 0)
+
+    rows = []
+    for key, before, after, ratio in bench.diff_records(baseline, current):
+        #the algorithms that aren't chunked are in the records of every chunk
+        #size
+        if rows and rows[-1][0] == key:
+            continue
+        regressed = (ratio > 1 + tolerance and
+                     after - before > max(min_ms, noise[key]))
+        rows.append((key, before, after, ratio, regressed))
+
+    failures = ['{} got {:.0%} slower'.format(describe(key), ratio - 1)
+                for key, _, _, ratio, regressed in rows if regressed]
+
+    wrong = set()
+    for record in current:
+        for a in record['algorithms']:
+            if not a.get('correct', True):
+                wrong.add(describe(bench.record_key(record, a)))
+    failures += ['{} returned wrong matches'.format(key)
+                 for key in sorted(wrong)]
+    return rows, failures
+
+def describe(key):
+    """ Readable name of a bench.record_key """
+    name, backend, chunk_size, substring, text_length, k = key
+    fields = [name]
+    if backend is not None:
+        fields.append(backend)
+    if chunk_size is not None:
+        fields.append('chunk={}'.format(chunk_size))
+    fields += ['m={}'.format(len(substring)), 'n={}'.format(text_length),
+               'k={}'.format(k)]
+    return ' '.join(fields)
+
+def format_diff(rows):
+    """ The table of the rows of compare, with the regressions marked """
+    lines = ['%-40s %12s %12s %8s' % ('algorithm', 'baseline', 'current',
+                                      'ratio')]
+    for key, before, after, ratio, regressed in rows:
+        lines.append('%-40s %9.3f ms %9.3f ms %7.2fx%s' % (describe(key),
+                     before, after, ratio, '  REGRESSED' if regressed else ''))
+    return '\n'.join(lines)
+
+def write_records(path, records, append=False):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'a' if append else 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+def plot_history(history, out, subset=None):
+    """
+    Redraws the graphs of graph.py into the directory out: the sweeps of the
+    latest run, and history.png, the medians at the largest point of the
+    subset over every run.
+    """
+    import graph
+    graph.save_to_files()
+    subset = subset or SUBSET
+    if not os.path.isdir(out):
+        os.makedirs(out)
+
+    runs = []
+    for record in history:
+        if not runs or runs[-1][0] != record['run']:
+            runs.append((record['run'], []))
+        runs[-1][1].append(record)
+    if not runs:
+        raise Exception('there is no history to plot')
+
+    data = os.path.join(out, 'data')
+    if not os.path.isdir(data):
+        os.makedirs(data)
+    benchmatrix.write_graph_files(runs[-1][1], data, 'python regression.py',
+                                  subset['lengths'], subset['pattern_lengths'],
+                                  subset['ks'], subset['chunk_sizes'])
+
+    def load(name):
+        return graph.load_data(os.path.join(data, name))
+
+    graph.plot_alg_time(load('performance_by_text_length'),
+        os.path.join(out, 'algorithm performance vs text length.png'))
+    graph.plot_k_time(load('performance_by_k'),
+        os.path.join(out, 'algorithm performance vs num texts.png'))
+    graph.plot_chunk_time(load('nlogm_performance_by_chunk_size'), 'nlogm',
+        os.path.join(out, 'nlogm performance by chunk size.png'))
+    if os.path.exists(os.path.join(data, 'opencv_performance_by_chunk_size')):
+        graph.plot_chunk_time(load('opencv_performance_by_chunk_size'),
+            'opencv', os.path.join(out, 'opencv performance by chunk size.png'))
+
+    largest = dict(substring_length=subset['pattern_lengths'][0],
+                   text_length=subset['lengths'][-1], k=subset['ks'][0],
+                   chunk_size='m')
+    graph.plot_history([(label, benchmatrix.select(records, ALGORITHMS,
+                                                   **largest)[0])
+                        for label, records in runs],
+                       os.path.join(out, 'history.png'))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the algorithms for \
+performance regressions against the baseline of this machine.')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Make this run the baseline')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='Fraction by which a median may grow. \
+Default=0.2')
+    parser.add_argument('--min-ms', type=float, default=0.5, help='Medians \
+that grow by less than this, or by less than their interquartile ranges, are \
+never regressions. Default=0.5')
+    parser.add_argument('-a', '--algorithms', nargs='+', choices=ALGORITHMS,
+                        default=ALGORITHMS)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    parser.add_argument('-w', '--warmup', type=int, default=1)
+    parser.add_argument('--machine', default=machine_tag(), help='Tag of the \
+baselines. Default=host name and architecture')
+    parser.add_argument('-d', '--dir', default='../results/baselines',
+                        help='Directory of the baselines')
+    parser.add_argument('-g', '--graphs', default='../results/graphs',
+                        help='Directory of the graphs')
+    parser.add_argument('-p', '--plot', action='store_true',
+                        help='Redraw the graphs after the run')
+    parser.add_argument('--plot-only', action='store_true',
+                        help='Only redraw the graphs from the history')
+    args = parser.parse_args()
+
+    directory = os.path.join(args.dir, args.machine)
+    baseline_path = os.path.join(directory, 'baseline.json')
+    history_path = os.path.join(directory, 'history.json')
+    graphs = os.path.join(args.graphs, args.machine)
+
+    if args.plot_only:
+        plot_history(bench.load_records(history_path), graphs)
+        sys.exit(0)
+
+    current = run_subset(args.algorithms, args.repeats, args.warmup)
+    write_records(history_path, current, append=True)
+
+    failures = []
+    if args.save_baseline or not os.path.exists(baseline_path):
+        write_records(baseline_path, current)
+        print 'saved the baseline of {} to {}'.format(args.machine,
+                                                      baseline_path)
+    else:
+        rows, failures = compare(bench.load_records(baseline_path), current,
+                                 args.tolerance, args.min_ms)
+        print format_diff(rows)
+        for failure in failures:
+            print 'FAIL:', failure
+
+    if args.plot:
+        plot_history(bench.load_records(history_path), graphs)
+    sys.exit(1 if failures else 0)
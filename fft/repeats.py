@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+'''
+Tandem repeat runs from match indices.
+
+A run of a pattern of length m is a chain of matches that are exactly m apart,
+e.g. the CAG repeat in CAGCAGCAG is the run (0, 3) of CAG: it starts at 0 and
+has 3 copies.  repeat_runs finds the runs in the indices of any of the
+match-index algorithms.  RunAccumulator finds them from indices that arrive a
+chunk at a time, which is how fftmatch.fft_match_index_n_log_m(mode='runs')
+finds them without keeping every index.
+
+Runs of the results that cli.py wrote:
+
+    $ python repeats.py ../results/huntingtin_CAGs_nlogm.txt -p 3 --min-count 10
+'''
+import argparse
+import numpy as np
+
+def repeat_runs(indices, period, min_count=1):
+    """
+    Finds the runs of matches that are period apart.
+
+    Patterns that overlap themselves, like AA, have matches that are closer
+    than period, so the chains are followed separately for every remainder of
+    the indices modulo period.
+
+    Arguments
+    ---------
+    indices : numpy array
+        the sorted 0-based indices of the matches
+    period : int
+        the length of the pattern
+    min_count : int
+        the number of copies of the shortest run to return
+
+    Returns
+    -------
+    runs : r X 2 int64 numpy array
+        the (start, repeat_count) of every run, sorted by start
+    """
+    starts, counts, _ = chains(np.asarray(indices, dtype=np.int64), period)
+    keep = counts >= min_count
+    return np.column_stack([starts[keep], counts[keep]])
+
+def chains(indices, period):
+    """
+    Returns the first index, the number of copies and the last index of every
+    chain of indices that are period apart, sorted by first index
+    """
+    if len(indices) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+
+    #chains only link indices with the same remainder, which are adjacent
+    #once the indices are sorted by remainder
+    order = np.lexsort((indices, indices % period))
+    ordered = indices[order]
+    breaks = np.flatnonzero(np.diff(ordered) != period) + 1
+    firsts = np.concatenate([[0], breaks])
+    lasts = np.concatenate([breaks, [len(ordered)]]) - 1
+
+    starts = ordered[firsts]
+    by_start = np.argsort(starts, kind='mergesort')
+    return (starts[by_start], (lasts - firsts + 1)[by_start],
+            ordered[lasts][by_start])
+
+class RunAccumulator(object):
+    """
+    Finds the runs of matches that are found a chunk at a time.
+
+    The runs that may still be extended by the matches of later chunks are
+    kept open; the others are returned as soon as they are finished, so only
+    the open runs are kept between chunks.
+
+    Arguments
+    ---------
+    period : int
+        the length of the pattern
+    min_count : int
+        the number of copies of the shortest run to return
+    """
+    def __init__(self, period, min_count=1):
+        self.period = period
+        self.min_count = min_count
+        empty = np.array([], dtype=np.int64)
+        self.starts, self.counts, self.lasts = empty, empty, empty
+
+    def add(self, indices, covered):
+        """
+        Adds the sorted indices of the next matches.
+
+        Arguments
+        ---------
+        indices : numpy array
+            larger than every index that was added before
+        covered : int
+            every match before this index has now been added
+
+        Returns
+        -------
+        runs : r X 2 int64 numpy array
+            the runs that are finished, see repeat_runs
+        """
+        starts, counts, lasts = chains(np.asarray(indices, dtype=np.int64),
+                                       self.period)
+
+        #new chains that continue an open run
+        if len(self.lasts) and len(starts):
+            order = np.argsort(self.lasts)
+            position = np.searchsorted(self.lasts[order], starts - self.period)
+            position = np.minimum(position, len(order) - 1)
+            extends = self.lasts[order][position] == starts - self.period
+            opened = order[position[extends]]
+
+            starts[extends] = self.starts[opened]
+            counts[extends] += self.counts[opened]
+            extended = np.zeros(len(self.lasts), dtype=bool)
+            extended[opened] = True
+        else:
+            extended = np.zeros(len(self.lasts), dtype=bool)
+
+        #the open runs that weren't extended by these matches can't be anymore
+        starts = np.concatenate([self.starts[~extended], starts])
+        counts = np.concatenate([self.counts[~extended], counts])
+        lasts = np.concatenate([self.lasts[~extended], lasts])
+
+        still_open = lasts + self.period >= covered
+        self.starts, self.counts, self.lasts = \
+            starts[still_open], counts[still_open], lasts[still_open]
+
+        starts, counts = starts[~still_open], counts[~still_open]
+        order = np.argsort(starts, kind='mergesort')
+        return self.filter(starts[order], counts[order])
+
+    def finish(self):
+        """ Returns the runs that are still open, once there are no more """
+        order = np.argsort(self.starts, kind='mergesort')
+        runs = self.filter(self.starts[order], self.counts[order])
+        empty = np.array([], dtype=np.int64)
+        self.starts, self.counts, self.lasts = empty, empty, empty
+        return runs
+
+    def filter(self, starts, counts):
+        keep = counts >= self.min_count
+        return np.column_stack([starts[keep], counts[keep]])
+
+def read_results(path):
+    """
+    Reads the 'title : Found matches at indices [...]' lines that cli.py
+    writes, and returns a list of (title, indices)
+    """
+    results = []
+    with open(path) as f:
+        for line in f:
+            title, _, matches = line.rpartition(' : Found matches at indices ')
+            if not title:
+                continue
+            results.append((title, np.fromstring(matches.strip()[1:-1],
+                                                 dtype=np.int64, sep=',')))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find tandem repeat runs in \
+the matches that cli.py found.')
+    parser.add_argument('results', help='A file with the output of cli.py')
+    parser.add_argument('-p', '--period', type=int, default=3,
+                        help='The length of the pattern. Default=3')
+    parser.add_argument('--min-count', type=int, default=2,
+                        help='The number of copies of the shortest run to \
+print. Default=2')
+    args = parser.parse_args()
+
+    for title, indices in read_results(args.results):
+        print title
+        for start, count in repeat_runs(indices, args.period, args.min_count):
+            print '{}\t{}'.format(start, count)
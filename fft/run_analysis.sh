@@ -46,3 +46,7 @@ echo 'Run with: python analysis.py -k CAG ../Genes/Genes\ by\ Size/pow_10/* ../G
 python analysis.py -k CAG ../Genes/Genes\ by\ Size/pow_10/* ../Genes/Genes\ by\ Size/pow_10/* ../Genes/Genes\ by\ Size/pow_10/* ../Genes/Genes\ by\ Size/pow_10/* > ../results/genes_data/performance_by_k
 
 python graph.py -k ../results/genes_data/performance_by_k
+
+echo 'Running pipelined throughput of nlogm on genes of size 2^16.' > ../results/genes_data/pipeline_throughput
+echo 'Run with: python cli.py --pipeline -a nlogm -c CAG ../Genes/Genes\ by\ Size/pow_16/*' >> ../results/genes_data/pipeline_throughput
+python cli.py --pipeline -a nlogm -c CAG ../Genes/Genes\ by\ Size/pow_16/* 2>> ../results/genes_data/pipeline_throughput > /dev/null
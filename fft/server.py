@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+'''
+Long-running match-index server that keeps the genomes and their spectra in
+memory, so that a query doesn't pay for starting python, importing numpy,
+parsing the FASTA files and transforming the texts.
+
+    $ python server.py genome1.fa genome2.fa
+    $ python client.py CAG CTG
+
+The server listens on localhost over HTTP:
+
+    GET /genomes
+        a JSON list of {"title", "length"} of the loaded genomes
+    POST /search {"patterns": [...], "genomes": [...]}
+        searches the genomes (all of them if "genomes" is left out) for every
+        pattern, and streams back one JSON line
+        {"genome", "pattern", "matches"} per genome and pattern as soon as the
+        genome has been searched
+
+A bad request gets a 400 and a {"error"} JSON body, and a search that fails
+before anything was streamed a 500.  If a later genome fails, the status has
+already been sent, so the stream ends with an {"error"} line instead, which
+client.py raises.
+
+Every genome keeps its spectrum and the running sums of its squares
+(fftmatch.TextSpectra), so a query only transforms its patterns.  Queries that
+arrive for a genome while it is being searched are coalesced: the next search
+correlates the patterns of all of them at once with
+fftmatch.fft_match_index_patterns.
+
+The spectrum takes 8 bytes per base of the genome, padded to a power of two,
+and the running sums another 8 bytes per base.
+'''
+import argparse
+import BaseHTTPServer
+import collections
+import json
+import logging
+import SocketServer
+import threading
+import numpy as np
+import fftmatch
+
+log = logging.getLogger('server')
+
+DEFAULT_PORT = 8642
+
+def read_genomes(paths):
+    """
+    Reads one-record FASTA files into an OrderedDict of title -> genome, with
+    the titles numbered like cli.py's
+    """
+    count = collections.defaultdict(int)
+    genomes = collections.OrderedDict()
+    for path in paths:
+        with open(path) as gn:
+            title = gn.readline().rstrip()
+            genome = ''.join(line.rstrip() for line in gn)
+        count[title] += 1
+        genomes[title + str(count[title])] = genome
+    return genomes
+
+class Query(object):
+    """ Patterns that are waiting for a search of a genome """
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.done = threading.Event()
+        self.matches = None
+        self.error = None
+
+class ResidentGenome(object):
+    """
+    A genome with the spectra that it has been searched with.
+
+    Arguments
+    ---------
+    title : str
+    text : str
+    backend : str, backend or None
+        the fftbackend to transform with, None for the fastest installed one
+    """
+    def __init__(self, title, text, backend=None):
+        self.title = title
+        self.text = text
+        self.backend = backend
+        #transform size -> fftmatch.TextSpectra
+        self.spectra = {}
+        self.lock = threading.Lock()
+        self.pending = []
+        self.searching = False
+
+    def get_spectra(self, pattern_length):
+        """ Only called by the thread that is searching the genome """
+        size = fftmatch.spectrum_size(len(self.text), pattern_length)
+        if size not in self.spectra:
+            self.spectra[size] = fftmatch.TextSpectra(self.text, size,
+                                                      self.backend)
+        return self.spectra[size]
+
+    def correlate(self, patterns):
+        """ Returns a dict of pattern -> matches for the distinct patterns """
+        matches = dict((p, np.array([], dtype=int)) for p in patterns)
+        searchable = [p for p in patterns if len(p) <= len(self.text)]
+        if searchable:
+            spectra = self.get_spectra(max(map(len, searchable)))
+            matches.update(zip(searchable,
+                fftmatch.fft_match_index_patterns(spectra, searchable)))
+        return matches
+
+    def search(self, patterns):
+        """
+        Returns the matches of every pattern, in order.
+
+        The first thread to ask searches for its patterns together with the
+        patterns of every thread that asked in the meantime, until no one is
+        waiting.  The other threads wait for their results.
+        """
+        query = Query(patterns)
+        with self.lock:
+            self.pending.append(query)
+            leader = not self.searching
+            self.searching = True
+
+        if leader:
+            self.drain()
+        query.done.wait()
+        if query.error is not None:
+            raise query.error
+        return query.matches
+
+    def drain(self):
+        while True:
+            with self.lock:
+                queries, self.pending = self.pending, []
+                if not queries:
+                    self.searching = False
+                    return
+
+            patterns = sorted(set(p for q in queries for p in q.patterns))
+            log.debug('%s: %d queries, %d patterns', self.title,
+                      len(queries), len(patterns))
+            try:
+                matches = self.correlate(patterns)
+            except Exception as e:
+                matches = None
+                for q in queries:
+                    q.error = e
+            for q in queries:
+                if matches is not None:
+                    q.matches = [matches[p] for p in q.patterns]
+                q.done.set()
+
+class SearchHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body) + '\n')
+
+    def do_GET(self):
+        if self.path != '/genomes':
+            return self.send_json(404, {'error': 'unknown path ' + self.path})
+        self.send_json(200, [{'title': g.title, 'length': len(g.text)}
+                             for g in self.server.genomes.values()])
+
+    def do_POST(self):
+        if self.path != '/search':
+            return self.send_json(404, {'error': 'unknown path ' + self.path})
+        try:
+            length = int(self.headers.getheader('Content-Length', 0))
+            query = json.loads(self.rfile.read(length))
+            patterns = [str(p) for p in query['patterns']]
+            titles = query.get('genomes') or list(self.server.genomes)
+            if not patterns or not all(patterns):
+                raise ValueError('patterns must be non-empty strings')
+            unknown = [t for t in titles if t not in self.server.genomes]
+            if unknown:
+                raise ValueError('unknown genomes {}'.format(unknown))
+        except (ValueError, KeyError, TypeError, UnicodeError) as e:
+            return self.send_json(400, {'error': str(e)})
+
+        streaming = False
+        for title in titles:
+            try:
+                matches = self.server.genomes[title].search(patterns)
+            except Exception as e:
+                log.exception('search of %s failed', title)
+                if not streaming:
+                    return self.send_json(500, {'error': str(e)})
+                self.wfile.write(json.dumps({'error': str(e)}) + '\n')
+                return
+            if not streaming:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                streaming = True
+            for pattern, found in zip(patterns, matches):
+                self.wfile.write(json.dumps({'genome': title,
+                    'pattern': pattern, 'matches': found.tolist()}) + '\n')
+            self.wfile.flush()
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+class MatchServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves searches of genomes, a dict of title -> genome, on address, a
+    (host, port) tuple.  Every request is handled on its own thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, genomes, backend=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, SearchHandler)
+        self.genomes = collections.OrderedDict(
+            (title, ResidentGenome(title, text, backend))
+            for title, text in genomes.items())
+
+    def warm(self, pattern_length):
+        """ Computes the spectra for patterns up to pattern_length long """
+        for genome in self.genomes.values():
+            genome.get_spectra(pattern_length)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve searches of genomes \
+that are kept in memory.')
+    parser.add_argument('genomes', nargs='+', help='1 or more fasta files')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-m', '--max-pattern-length', type=int, default=64,
+                        help='Compute the spectra for patterns up to this \
+long before serving. Default=64')
+    parser.add_argument('-V', '--verbose', action='store_true',
+                        help='Log every request and search')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(name)s: %(message)s')
+
+    server = MatchServer((args.host, args.port), read_genomes(args.genomes))
+    server.warm(args.max_pattern_length)
+    log.info('serving %d genomes on http://%s:%d', len(server.genomes),
+             *server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
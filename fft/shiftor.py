@@ -0,0 +1,170 @@
+'''
+Bit-parallel (Shift-Or / Shift-And) string matching for patterns of at most 64
+characters, vectorized over numpy uint64 words.
+
+The state of the pattern fits in one uint64 per text position, so instead of
+FFTs every character costs a shift, an or and a table lookup.  Each text is
+cut into segments that overlap by len(pattern)-1 characters, and the segments
+of all of the texts are advanced together one character at a time.  A scan
+therefore takes about SEGMENT_LENGTH numpy operations, no matter how long the
+texts are or how many of them there are.
+
+Includes wrappers that follow the same function interface as boyermoore.py
+
+def shift_or_match_index(text, pattern, mismatches=0)
+def shift_or_mult_match_index(texts, pattern, mismatches=0)
+'''
+import numpy as np
+from fftmatch import search_unique
+
+#the state of the pattern is kept in one uint64 word
+MAX_PATTERN_LENGTH = 64
+
+#number of characters in each segment of a text
+SEGMENT_LENGTH = 1024
+
+ONE = np.uint64(1)
+
+def pattern_masks(pattern):
+    """
+    Returns the 256 Shift-And masks of pattern: bit j of masks[c] is set when
+    pattern[j] is the character with ord c.
+    """
+    masks = np.zeros(256, dtype=np.uint64)
+    for j, c in enumerate(pattern):
+        masks[ord(c)] |= ONE << np.uint64(j)
+    return masks
+
+def texts_to_segments(texts, m):
+    """
+    Cuts the texts into overlapping segments.
+
+    Arguments
+    ---------
+    texts : list of str
+    m : int
+        the length of the pattern
+
+    Returns
+    -------
+    columns : (seg + m - 1) X (k*segments) uint8 numpy array
+        column r holds segment r % segments of text r // segments, padded with
+        the 0 byte.  Consecutive segments of a text start seg characters apart.
+    segments : int
+        number of segments per text
+    seg : int
+        number of characters between the starts of consecutive segments
+    """
+    n = max(map(len, texts))
+    seg = max(1, min(max(SEGMENT_LENGTH, 4*m), n))
+    segments = max(1, -(-n // seg))
+
+    arr = np.zeros((len(texts), segments*seg + m - 1), dtype=np.uint8)
+    for index, text in enumerate(texts):
+        arr[index, :len(text)] = np.frombuffer(text, dtype=np.uint8)
+
+    view = np.lib.stride_tricks.as_strided(arr,
+                shape=(len(texts), segments, seg + m - 1),
+                strides=(arr.strides[0], seg, 1))
+    columns = view.reshape(len(texts)*segments, seg + m - 1).T
+    return np.ascontiguousarray(columns), segments, seg
+
+def shift_or(columns, masks, m):
+    """
+    Exact Shift-Or matching.  A 0 bit j in the state means the last j+1
+    characters match the first j+1 characters of the pattern.
+
+    Returns
+    -------
+    hits : boolean numpy array with the shape of columns
+        True where an occurrence of the pattern ends
+    """
+    not_masks = ~masks
+    high = ONE << np.uint64(m - 1)
+
+    state = np.empty(columns.shape[1], dtype=np.uint64)
+    state.fill(~np.uint64(0))
+    hits = np.empty(columns.shape, dtype=bool)
+    for c in range(columns.shape[0]):
+        np.left_shift(state, ONE, out=state)
+        state |= not_masks[columns[c]]
+        np.equal(state & high, 0, out=hits[c])
+    return hits
+
+def shift_and_mismatches(columns, masks, m, mismatches):
+    """
+    Shift-And matching with at most `mismatches` substitutions.  Bit j of
+    states[d] is set when the last j+1 characters match the first j+1
+    characters of the pattern with at most d mismatches.
+
+    Returns
+    -------
+    hits : boolean numpy array with the shape of columns
+        True where an occurrence of the pattern ends
+    """
+    high = ONE << np.uint64(m - 1)
+
+    states = [np.zeros(columns.shape[1], dtype=np.uint64)
+              for _ in range(mismatches + 1)]
+    hits = np.empty(columns.shape, dtype=bool)
+    for c in range(columns.shape[0]):
+        mask = masks[columns[c]]
+        shifted = [(state << ONE) | ONE for state in states]
+        states = [shifted[0] & mask] + \
+                 [(shifted[d] & mask) | shifted[d-1]
+                  for d in range(1, mismatches + 1)]
+        np.not_equal(states[-1] & high, 0, out=hits[c])
+    return hits
+
+@search_unique
+def shift_or_mult_match_index(texts, pattern, mismatches=0):
+    '''Bit-parallel matching on multiple texts that uses the same interface as
+    boyermoore.boyer_moore_mult_match_index.
+
+    Arguments
+    ---------
+    texts : list of str
+    pattern : str
+        at most MAX_PATTERN_LENGTH characters long
+    mismatches : int
+        the number of mismatching characters that an occurrence may have
+
+    Returns
+    -------
+    matches : numpy array
+        k rows, the i'th row has the 0-based indices of matches in texts[i]
+    '''
+    m = len(pattern)
+    if not 0 < m <= MAX_PATTERN_LENGTH:
+        raise Exception('shift_or patterns must have 1 to {} characters'
+                        .format(MAX_PATTERN_LENGTH))
+
+    columns, segments, seg = texts_to_segments(texts, m)
+    masks = pattern_masks(pattern)
+    if mismatches == 0:
+        hits = shift_or(columns, masks, m)
+    else:
+        hits = shift_and_mismatches(columns, masks, m, mismatches)
+
+    #ordered by text, then segment, then position inside the segment
+    rows, ends = np.nonzero(hits.T)
+    text_index = rows // segments
+    starts = (rows % segments)*seg + ends - (m - 1)
+
+    #occurrences that run into the padding
+    lengths = np.array(list(map(len, texts)))
+    keep = starts + m <= lengths[text_index]
+    text_index, starts = text_index[keep], starts[keep]
+
+    counts = np.bincount(text_index, minlength=len(texts))
+    return np.array(np.split(starts, np.cumsum(counts)[:-1]))
+
+def shift_or_match_index(text, pattern, mismatches=0):
+    '''Wrapper for bit-parallel matching that uses the same interface as the
+    other functions we developed'''
+    return shift_or_mult_match_index([text], pattern, mismatches)[0]
+
+if __name__ == "__main__":
+    t = 'haystack needle haystack'
+    print shift_or_match_index(t, 'needle')
+    print shift_or_match_index(t, 'noodle', mismatches=2)
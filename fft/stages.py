@@ -0,0 +1,172 @@
+'''
+Opt-in per-stage profiling of the match-index algorithms.
+
+The algorithms mark their stages (encoding the text, forward FFTs, inverse
+FFTs, thresholding, ...) with
+
+    with stages.stage('rfft'):
+        ...
+
+and report the arrays they allocate with stages.allocated(nbytes).  Nothing is
+recorded unless a Profiler is active, in which case every stage's wall time,
+number of calls and allocated bytes are accumulated under its stack of
+enclosing stages:
+
+    with stages.profiling() as profiler:
+        fftmatch.fft_match_index_n_log_m(text, 'CAG')
+    print profiler.to_json()
+
+When no profiler is active, stage() returns a shared object that does nothing,
+so the cost of a stage is one function call.
+
+Worker threads start with empty stacks; fftmatch.map_batches runs its workers
+within(current()) so that their stages are reported under the stage that
+started them.  The workers then share that stage, so the bytes they allocate in
+it, like the stats, are added under the profiler's lock.
+'''
+import contextlib
+import json
+import threading
+import timeit
+from collections import OrderedDict
+
+#the profiler that stages are recorded in, None when profiling is off
+active = None
+
+class NullStage(object):
+    """ The stage that is returned when profiling is off """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = NullStage()
+
+class Stage(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = 0
+
+    def __enter__(self):
+        stack = self.profiler.stack()
+        self.path = (stack[-1].path if stack else ()) + (self.name,)
+        stack.append(self)
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = timeit.default_timer() - self.start
+        self.profiler.stack().pop()
+        self.profiler.record(self.path, seconds, self.nbytes)
+        return False
+
+class Profiler(object):
+    """
+    Accumulates the wall time, calls and allocated bytes of every stack of
+    stages.
+
+    Attributes
+    ----------
+    stats : OrderedDict
+        tuple of stage names -> {'calls', 'seconds', 'bytes'}, in the order
+        the stacks were first seen.  'seconds' includes the nested stages.
+    """
+    def __init__(self):
+        self.stats = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.previous = None
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def record(self, path, seconds, nbytes):
+        with self.lock:
+            stat = self.stats.get(path)
+            if stat is None:
+                stat = self.stats[path] = {'calls': 0, 'seconds': 0.0,
+                                           'bytes': 0}
+            stat['calls'] += 1
+            stat['seconds'] += seconds
+            stat['bytes'] += nbytes
+
+    def start(self):
+        global active
+        self.previous, active = active, self
+
+    def stop(self):
+        global active
+        active, self.previous = self.previous, None
+
+    def self_seconds(self, path):
+        """ Time spent in the stage path outside of its nested stages """
+        children = sum(stat['seconds'] for p, stat in self.stats.items()
+                       if len(p) == len(path) + 1 and p[:-1] == path)
+        return max(0.0, self.stats[path]['seconds'] - children)
+
+    def to_json(self):
+        """ The stats as a JSON list, one object per stack of stages """
+        return json.dumps([OrderedDict([('stage', ';'.join(path)),
+                                        ('calls', stat['calls']),
+                                        ('seconds', stat['seconds']),
+                                        ('bytes', stat['bytes'])])
+                           for path, stat in self.stats.items()], indent=2)
+
+    def to_folded(self):
+        """
+        The stats in the folded format of flamegraph.pl, with the time of every
+        stack outside of its nested stages in microseconds.
+        """
+        return '\n'.join('{} {}'.format(';'.join(path),
+                                        int(round(self.self_seconds(path)*1e6)))
+                         for path in self.stats)
+
+@contextlib.contextmanager
+def profiling(profiler=None):
+    """ Records the stages in profiler, or a new Profiler, while active """
+    profiler = profiler or Profiler()
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+
+def stage(name):
+    """ Returns a context manager that times the stage name """
+    if active is None:
+        return NULL_STAGE
+    return Stage(active, name)
+
+def allocated(nbytes):
+    """ Adds nbytes to the allocations of the innermost running stage """
+    if active is None:
+        return
+    stack = active.stack()
+    if stack:
+        #the stage may be the parent of several threads, see within
+        with active.lock:
+            stack[-1].nbytes += nbytes
+
+def current():
+    """ The innermost running stage of this thread, or None """
+    if active is None:
+        return None
+    stack = active.stack()
+    return stack[-1] if stack else None
+
+@contextlib.contextmanager
+def within(parent):
+    """ Nests the stages of this thread in parent, a stage of another thread """
+    if active is None or parent is None:
+        yield
+        return
+    stack = active.stack()
+    stack.append(parent)
+    try:
+        yield
+    finally:
+        stack.pop()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+'''
+Deterministic synthetic DNA for benchmarking, so that the results can be
+reproduced without the Genes corpus.
+
+A genome is random bases with a given GC content, into which tandem repeats of
+a unit (CAG expansions like in the huntingtin gene, by default) are written at
+random positions.  The same seed always gives the same genomes.
+
+    $ python synth.py -k 8 -n 1024 --repeat-density 0.002 -o ../Genes/synthetic
+'''
+import argparse
+import os
+import numpy as np
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+def random_genome(length, gc_content=0.5, rng=None):
+    """
+    Returns a random string of length bases, a fraction gc_content of which
+    are C or G.
+    """
+    rng = rng or np.random.RandomState()
+    at, gc = (1 - gc_content) / 2.0, gc_content / 2.0
+    codes = rng.choice(4, size=length, p=[at, gc, gc, at])
+    return BASES[codes].tostring()
+
+def add_repeats(genome, unit='CAG', density=0.0, copies=(10, 40), rng=None):
+    """
+    Overwrites random stretches of genome with tandem repeats of unit.  The
+    length of the genome does not change.
+
+    Arguments
+    ---------
+    genome : str
+    unit : str
+        the repeated unit
+    density : float
+        expected number of repeat tracts per base
+    copies : int or (int, int)
+        number of copies of the unit in a tract, or the range that it is drawn
+        from uniformly (inclusive)
+    rng : numpy RandomState
+
+    Returns
+    -------
+    genome : str
+    tracts : list of (start, copies)
+        the tracts that were written, sorted by start.  Later tracts may
+        overwrite part of earlier ones.
+    """
+    rng = rng or np.random.RandomState()
+    if isinstance(copies, int):
+        copies = (copies, copies)
+
+    arr = np.frombuffer(genome, dtype=np.uint8).copy()
+    tracts = []
+    for _ in range(rng.poisson(density * len(genome))):
+        count = rng.randint(copies[0], copies[1] + 1)
+        tract = np.frombuffer(unit * count, dtype=np.uint8)[:len(arr)]
+        start = rng.randint(0, len(arr) - len(tract) + 1)
+        arr[start:start + len(tract)] = tract
+        tracts.append((start, count))
+    return arr.tostring(), sorted(tracts)
+
+def generate_genomes(k, length, gc_content=0.5, repeat_unit='CAG',
+                     repeat_density=0.0, repeat_copies=(10, 40), seed=0):
+    """
+    Returns k synthetic genomes of the given length.  The i'th genome only
+    depends on seed and i, so generating more genomes keeps the first ones.
+    """
+    genomes = []
+    for i in range(k):
+        rng = np.random.RandomState([seed, i])
+        genome = random_genome(length, gc_content, rng)
+        genome, _ = add_repeats(genome, repeat_unit, repeat_density,
+                                repeat_copies, rng)
+        genomes.append(genome)
+    return genomes
+
+def write_fasta(path, title, genome, width=70):
+    """ Writes a one-record FASTA file like the ones cli.py reads """
+    with open(path, 'w') as f:
+        f.write('>' + title + '\n')
+        for i in range(0, len(genome), width):
+            f.write(genome[i:i + width] + '\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic genomes as \
+FASTA files.')
+    parser.add_argument('-k', type=int, default=1, help='Number of genomes')
+    parser.add_argument('-n', '--length', type=int, default=1024,
+                        help='Length of every genome')
+    parser.add_argument('--gc', type=float, default=0.5, help='GC content')
+    parser.add_argument('--repeat-unit', default='CAG')
+    parser.add_argument('--repeat-density', type=float, default=0.0,
+                        help='Expected number of repeat tracts per base')
+    parser.add_argument('--repeat-copies', type=int, nargs=2, default=[10, 40],
+                        help='Range of the number of units in a tract')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--out', default='.', help='Output directory')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    genomes = generate_genomes(args.k, args.length, args.gc, args.repeat_unit,
+                               args.repeat_density, tuple(args.repeat_copies),
+                               args.seed)
+    for i, genome in enumerate(genomes):
+        title = 'synthetic_{} seed={} n={} gc={}'.format(i, args.seed,
+                                                         args.length, args.gc)
+        write_fasta(os.path.join(args.out, 'synthetic_{}.fa'.format(i)),
+                    title, genome)
@@ -5,8 +5,37 @@ import unittest
 import fftmatch
 import numpy as np
 import functools
+import json
 import boyermoore
 import cvmatch
+import fftbackend
+import shiftor
+import dispatch
+import bench
+import synth
+import benchmatrix
+import stages
+import server
+import client
+import threading
+import time
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+import io
+import output
+import repeats
+import regression
+import ntt
+import packed
+import rabinkarp
+import fastq
+import gzip
+import pipeline
+import kmerindex
+import bloom
 
 def format_error_message(function_name):
     return "failed on function {}".format(function_name)
@@ -32,15 +61,18 @@ def string_match_decorator(string_matching_algorithms):
 oned_string_matching_algorithms = [fftmatch.naive_string_match_index,
                               fftmatch.fft_match_index_n_log_n,
                               fftmatch.fft_match_index_n_log_m,
-                              boyermoore.boyer_moore_match_index]
+                              boyermoore.boyer_moore_match_index,
+                              shiftor.shift_or_match_index]
 
 #algorithms that match multiple genomes to a single substring
 twod_string_matching_algorithms = [fftmatch.fft_match_index_n_sq_log_n,
                                    fftmatch.fft_match_index_n_sq_log_n_naive,
                                    fftmatch.fft_match_index_n_sq_log_m_naive,
-                                   #fftmatch.fft_match_index_n_sq_log_m,
+                                   fftmatch.fft_match_index_n_sq_log_m,
                                    cvmatch.cv_match_index,
-                                   cvmatch.cv_match_index_chunk]
+                                   cvmatch.cv_match_index_chunk,
+                                   shiftor.shift_or_mult_match_index,
+                                   rabinkarp.rabin_karp_match_index]
 
 def ndarrays_equal(arr1, arr2):
     """
@@ -60,6 +92,110 @@ def ndarrays_equal(arr1, arr2):
 
     return True
 
+#'fast' runs the small differential cases, 'slow' also runs the large ones,
+#which time every algorithm and double as performance regression checks
+#(see DifferentialTestRig)
+TEST_TIER = os.environ.get('TEST_TIER', 'fast')
+
+def find_all(text, pattern):
+    """ The reference matches: every index where str.find finds pattern """
+    matches = []
+    index = text.find(pattern)
+    while index != -1:
+        matches.append(index)
+        index = text.find(pattern, index + 1)
+    return matches
+
+def differential_case(random, max_n, max_m, k=4):
+    """
+    Returns random (texts, pattern, chunk_size) for a differential test.
+
+    The alphabets are small, so that matches overlap, and copies of the
+    pattern are planted across the chunk boundaries and at the ends of the
+    texts, where the windows and the padding are.  Most alphabets have a '0',
+    which the padding must not match.  The chunk size may be shorter than the
+    pattern.
+    """
+    m = random.randint(1, max_m + 1)
+    alphabet = list('A0CGT'[:random.randint(1, 6)])
+    pattern = ''.join(random.choice(alphabet, m))
+    chunk_size = int(random.choice([1, 2, max(1, m - 1), m, m + 1,
+                                    random.randint(1, 3*m + 2)]))
+
+    texts = []
+    for _ in range(random.randint(1, k + 1)):
+        n = random.randint(0, max_n + 1)
+        text = list(random.choice(alphabet, n)) if n else []
+        if n >= m:
+            for _ in range(random.randint(0, 5)):
+                boundary = chunk_size * random.randint(1, n // chunk_size + 2)
+                start = min(n - m, max(0, boundary - random.randint(0, m)))
+                text[start:start + m] = pattern
+            if random.rand() < 0.5:
+                text[n - m:] = pattern
+        texts.append(''.join(text))
+    return texts, pattern, chunk_size
+
+def differential_entry_points(pattern, chunk_size):
+    """
+    Returns the (name, search) of every match-index entry point, where search
+    returns the matches of every text of a list of texts
+    """
+    def each(func, **kwargs):
+        return lambda texts: [func(t, pattern, **kwargs) for t in texts]
+
+    def together(func, **kwargs):
+        return lambda texts: func(texts, pattern, **kwargs)
+
+    def packed_texts(search):
+        return lambda texts: search([packed.PackedGenome.from_string(t)
+                                     for t in texts])
+
+    def spectra(texts):
+        m = len(pattern)
+        return [fftmatch.fft_match_index_patterns(fftmatch.TextSpectra(t,
+                    fftmatch.spectrum_size(len(t), m)), [pattern])[0]
+                if len(t) >= m else [] for t in texts]
+
+    points = [
+        ('naive', each(fftmatch.naive_string_match_index)),
+        ('nlogn_1d', each(fftmatch.fft_match_index_n_log_n)),
+        ('nlogm', each(fftmatch.fft_match_index_n_log_m)),
+        ('nlogm_chunk', each(fftmatch.fft_match_index_n_log_m,
+                             chunk_size=chunk_size, workers=2)),
+        ('boyermoore', each(boyermoore.boyer_moore_match_index)),
+        ('nlogn', together(fftmatch.fft_match_index_n_sq_log_n)),
+        ('nlogn_naive', together(fftmatch.fft_match_index_n_sq_log_n_naive)),
+        ('nlogm_naive', together(fftmatch.fft_match_index_n_sq_log_m_naive)),
+        ('n_sq_log_m', together(fftmatch.fft_match_index_n_sq_log_m)),
+        ('n_sq_log_m_chunk', together(fftmatch.fft_match_index_n_sq_log_m,
+                                      chunk_size=chunk_size, workers=3)),
+        ('nlogm_exact', each(fftmatch.fft_match_index_n_log_m,
+                             chunk_size=chunk_size, exact=True)),
+        ('n_sq_log_m_exact', together(fftmatch.fft_match_index_n_sq_log_m,
+                                      chunk_size=chunk_size, workers=2,
+                                      exact=True)),
+        ('opencv', together(cvmatch.cv_match_index)),
+        ('opencv_chunk', together(cvmatch.cv_match_index_chunk)),
+        ('opencv_chunk_size', together(cvmatch.cv_match_index_chunk,
+                                       chunk_size=chunk_size)),
+        ('nlogm_packed', packed_texts(each(fftmatch.fft_match_index_n_log_m,
+                                           chunk_size=chunk_size))),
+        ('n_sq_log_m_packed', packed_texts(together(
+            fftmatch.fft_match_index_n_sq_log_m, chunk_size=chunk_size))),
+        ('opencv_chunk_packed', packed_texts(together(
+            cvmatch.cv_match_index_chunk, chunk_size=chunk_size))),
+        ('boyermoore_mult', together(boyermoore.boyer_moore_mult_match_index)),
+        ('rabinkarp', together(rabinkarp.rabin_karp_match_index)),
+        ('kmer', together(kmerindex.kmer_match_index)),
+        ('kmer_short', together(kmerindex.kmer_match_index, k=2)),
+        ('spectra', spectra),
+    ]
+    if len(pattern) <= 64:
+        points += [('shiftor', each(shiftor.shift_or_match_index)),
+                   ('shiftor_mult', together(shiftor.shift_or_mult_match_index))]
+    return points
+
 class FFTStringMatchTestRig(unittest.TestCase):
     @string_match_decorator(oned_string_matching_algorithms)
     def test_single_char_single_occurrence(self, func):
@@ -154,6 +290,110 @@ class FFTStringMatchTestRig(unittest.TestCase):
             fftmatch.fft_match_index_n_log_m(text, pattern, chunk_size) == \
             np.array(boyermoore.boyer_moore_match_index(text,pattern))).all())
 
+        for chunk_size in [3, 4, 100]:
+            self.assertTrue((
+                fftmatch.fft_match_index_n_log_m(text, pattern, chunk_size) == \
+                np.array(boyermoore.boyer_moore_match_index(text,pattern))).all())
+
+    def test_workers(self):
+        np.random.seed(67+2)
+        text = ''.join(np.random.choice(list('AGCT'), size=100000))
+        pattern = ''.join(np.random.choice(list('AGTC'), size=3))
+        expected_output = boyermoore.boyer_moore_match_index(text, pattern)
+
+        for workers in [1, 2, 4]:
+            self.assertTrue((fftmatch.fft_match_index_n_log_m(text, pattern,
+                             workers=workers) == expected_output).all())
+
+    def test_workspace_reuse(self):
+        np.random.seed(67+2)
+        texts = [''.join(np.random.choice(list('AGCT'), size=1000))
+                 for _ in range(3)]
+        pattern = "ACG"
+        workspace = fftmatch.Workspace(
+            fftmatch.string_to_binary_array(pattern[::-1], size=1000), 3)
+
+        for text in texts:
+            out = fftmatch.fft_match_index(text, pattern, 1000, 3,
+                                           workspace=workspace)
+            self.assertTrue((out == \
+                boyermoore.boyer_moore_match_index(text, pattern)).all())
+
+    def test_shift_or_mismatches(self):
+        text = "ACGTACCTACGAACGT"
+        pattern = "ACGT"
+        expected_outputs = [[0, 12], [0, 4, 8, 12]]
+
+        for mismatches, expected_output in zip([0, 1], expected_outputs):
+            self.assertTrue((shiftor.shift_or_match_index(text, pattern,
+                mismatches) == np.array(expected_output)).all())
+
+    def test_fft_backends(self):
+        np.random.seed(67+2)
+        text = ''.join(np.random.choice(list('AGCT'), size=10000))
+        pattern = ''.join(np.random.choice(list('AGTC'), size=3))
+        expected_output = boyermoore.boyer_moore_match_index(text, pattern)
+
+        for backend in fftbackend.available_backends():
+            for func in [fftmatch.fft_match_index_n_log_n,
+                         fftmatch.fft_match_index_n_log_m]:
+                self.assertTrue((func(text, pattern, backend=backend) == \
+                                 expected_output).all(),
+                                msg=format_error_message(func))
+            out = fftmatch.fft_match_index_n_sq_log_n([text], pattern,
+                                                      backend=backend)
+            self.assertTrue((out[0] == expected_output).all())
+
+    @unittest.skipUnless('fftw' in fftbackend.available_backends(),
+                         'pyFFTW is not installed')
+    def test_fftw_plans(self):
+        backend = fftbackend.FFTWBackend()
+        arrays = [np.random.rand(n)
+                  for n in range(1, 2*backend.plan_cache_size)]
+        for a in arrays:
+            self.assertTrue(np.allclose(backend.fft(a), np.fft.fft(a)))
+        self.assertEqual(len(backend.local.plans), backend.plan_cache_size)
+
+        #every thread transforms with its own plan
+        plans = []
+        def transform():
+            self.assertTrue(np.allclose(backend.fft(arrays[0]),
+                                        np.fft.fft(arrays[0])))
+            plans.append(backend.local.plans.values()[0])
+        threads = [threading.Thread(target=transform) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(plans), 2)
+        self.assertTrue(plans[0] is not plans[1])
+
+    def test_wildcards(self):
+        np.random.seed(67+2)
+        texts = [''.join(np.random.choice(list('AGCTN'), size=n))
+                 for n in [2000, 1500]]
+        pattern = "ANGT"
+        #N matches any character, in the texts and in the pattern
+        expected = [np.array([i for i in range(len(t) - len(pattern) + 1)
+                              if all(a == b or 'N' in (a, b) for a, b in
+                                     zip(t[i:i+len(pattern)], pattern))])
+                    for t in texts]
+
+        for func in [fftmatch.fft_match_index_n_log_n,
+                     fftmatch.fft_match_index_n_log_m]:
+            self.assertTrue(np.array_equal(func(texts[0], pattern,
+                wildcard='N'), expected[0]), msg=format_error_message(func))
+        for func in [fftmatch.fft_match_index_n_sq_log_n,
+                     fftmatch.fft_match_index_n_sq_log_m]:
+            out = func(texts, pattern, wildcard='N')
+            for row, expected_row in zip(out, expected):
+                self.assertTrue(np.array_equal(row, expected_row),
+                                msg=format_error_message(func))
+        #without wildcards N is an ordinary character
+        self.assertTrue(np.array_equal(
+            fftmatch.fft_match_index_n_log_m(texts[0], pattern),
+            find_all(texts[0], pattern)))
+
 
 class MultiGenomeTestRig(unittest.TestCase):
     @string_match_decorator(twod_string_matching_algorithms)
@@ -235,5 +475,1003 @@ class MultiGenomeTestRig(unittest.TestCase):
         self.assertTrue(ndarrays_equal(out, expected_output),
                         msg = format_error_message(func))
 
+    @string_match_decorator(twod_string_matching_algorithms)
+    def test_duplicate_texts(self, func):
+        texts = ['ACGTCAG', 'CAGCAG', 'ACGTCAG', 'TTT', 'CAGCAG']
+        expected_output = np.array([boyermoore.boyer_moore_match_index(text,
+                                    'CAG') for text in texts])
+        out = func(texts=texts, pattern='CAG')
+        self.assertTrue(ndarrays_equal(out, expected_output),
+                        msg=format_error_message(func))
+
+    def test_search_unique(self):
+        searched = []
+
+        @fftmatch.search_unique
+        def search(texts, pattern):
+            searched.append(list(texts))
+            return np.array([text.count(pattern) for text in texts])
+
+        texts = ['ACGTCAG', 'CAGCAG', 'ACGTCAG', 'TTT', 'CAGCAG']
+        self.assertEqual(search(texts, 'CAG').tolist(), [1, 2, 1, 0, 2])
+        self.assertEqual(searched, [['ACGTCAG', 'CAGCAG', 'TTT']])
+        self.assertEqual(search([], 'CAG').tolist(), [])
+
+        #the per-text arguments follow the texts, by position or by name
+        @fftmatch.search_unique
+        def filtered(texts, pattern, blooms=None):
+            searched.append(list(blooms))
+            return np.array([text.count(pattern) if keep else 0
+                             for text, keep in zip(texts, blooms)])
+
+        keep = [True, False, True, True, False]
+        del searched[:]
+        self.assertEqual(filtered(texts, 'CAG', keep).tolist(),
+                         [1, 0, 1, 0, 0])
+        self.assertEqual(filtered(texts, 'CAG', blooms=keep).tolist(),
+                         [1, 0, 1, 0, 0])
+        self.assertEqual(searched, [[True, False, True]]*2)
+        #dispatch.match_index doesn't look for the copies a second time
+        profiler = stages.Profiler()
+        profiler.start()
+        out = dispatch.match_index(texts, 'CAG', 'boyermoore')
+        profiler.stop()
+        self.assertEqual([len(row) for row in out], [1, 2, 1, 0, 2])
+        self.assertEqual(sum(stat['calls'] for path, stat
+                             in profiler.stats.items()
+                             if path[-1] == 'unique'), 1)
+
+        #packed genomes are compared by their contents
+        genomes = [packed.PackedGenome.from_string(text)
+                   for text in ['ACGNNT', 'ACGNNT', 'ACGNNA']]
+        unique, inverse = fftmatch.unique_texts(genomes)
+        self.assertEqual(len(unique), 2)
+        self.assertEqual(inverse.tolist(), [0, 0, 1])
+        out = fftmatch.fft_match_index_n_sq_log_m(genomes, 'NN', mode='count')
+        self.assertEqual(out.tolist(), [1, 1, 1])
+
+class QueryModeTestRig(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(67+4)
+        self.texts = [''.join(np.random.choice(list('AGCT'), size=n))
+                      for n in [3000, 40, 700]]
+        self.expected = boyermoore.boyer_moore_mult_match_index(self.texts,
+                                                                "CA")
+
+    def test_count_and_limit(self):
+        single = [fftmatch.fft_match_index_n_log_n,
+                  fftmatch.fft_match_index_n_log_m,
+                  boyermoore.boyer_moore_match_index]
+        multiple = [fftmatch.fft_match_index_n_sq_log_n,
+                    fftmatch.fft_match_index_n_sq_log_m,
+                    cvmatch.cv_match_index, cvmatch.cv_match_index_chunk,
+                    boyermoore.boyer_moore_mult_match_index,
+                    rabinkarp.rabin_karp_match_index]
+
+        for limit in [None, 1, 7, 5000]:
+            first = [list(e[:limit]) for e in self.expected]
+            for func in single:
+                for text, matches in zip(self.texts, first):
+                    self.assertEqual(list(func(text, "CA", limit=limit)),
+                                     matches, msg=func)
+                    self.assertEqual(func(text, "CA", mode='count',
+                                          limit=limit), len(matches))
+            for func in multiple:
+                out = func(self.texts, "CA", limit=limit)
+                self.assertEqual([list(o) for o in out], first, msg=func)
+                counts = func(self.texts, "CA", mode='count', limit=limit)
+                self.assertEqual(list(counts), map(len, first), msg=func)
+
+        self.assertRaises(Exception, fftmatch.fft_match_index_n_log_m,
+                          "ACGT", "CG", mode='indices')
+        self.assertRaises(Exception, boyermoore.boyer_moore_match_index,
+                          "ACGT", "CG", limit=0)
+
+    def test_density(self):
+        for bin_size in [1, 100, 999, 5000]:
+            expected = np.zeros((3, -(-3000 // bin_size)), dtype=np.int64)
+            for row, matches in zip(expected, self.expected):
+                np.add.at(row, np.asarray(matches, dtype=int) // bin_size, 1)
+            for chunk_size, workers in [('m', 1), (64, 3)]:
+                density = fftmatch.fft_match_index_n_sq_log_m(self.texts, "CA",
+                    chunk_size, workers, density=bin_size)
+                self.assertEqual(density.tolist(), expected.tolist())
+            self.assertEqual(fftmatch.fft_match_index_n_log_m(self.texts[0],
+                "CA", density=bin_size).tolist(), expected[0].tolist())
+
+        for kwargs in [{'density': 0}, {'density': 10, 'mode': 'count'},
+                       {'density': 10, 'limit': 2}]:
+            self.assertRaises(Exception, fftmatch.fft_match_index_n_sq_log_m,
+                              self.texts, "CA", **kwargs)
+
+        directory = tempfile.mkdtemp()
+        try:
+            import graph
+            graph.save_to_files()
+            out = os.path.join(directory, 'density.png')
+            graph.plot_density(density, 5000, ['a', 'b', 'c'], out)
+            self.assertTrue(os.path.getsize(out) > 0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_limit_stops_scanning(self):
+        text = 'CA' + 'G'*200000
+        with stages.profiling() as profiler:
+            fftmatch.fft_match_index_n_log_m(text, "CA", limit=1)
+        self.assertEqual(profiler.stats[('correlate',)]['calls'], 1)
+
+        with stages.profiling() as profiler:
+            fftmatch.fft_match_index_n_log_m(text, "CA", mode='count')
+        self.assertTrue(profiler.stats[('correlate',)]['calls'] > 1)
+
+class RepeatsTestRig(unittest.TestCase):
+    def test_repeat_runs(self):
+        text = 'TT' + 'CAG'*5 + 'A' + 'CAG'*2 + 'CA' + 'CAG'
+        matches = boyermoore.boyer_moore_match_index(text, 'CAG')
+        self.assertEqual(repeats.repeat_runs(matches, 3).tolist(),
+                         [[2, 5], [18, 2], [26, 1]])
+        self.assertEqual(repeats.repeat_runs(matches, 3, 2).tolist(),
+                         [[2, 5], [18, 2]])
+        #AA overlaps itself, so AAAAA has two chains of AA
+        self.assertEqual(repeats.repeat_runs([0, 1, 2, 3], 2).tolist(),
+                         [[0, 2], [1, 2]])
+        self.assertEqual(repeats.repeat_runs([], 3).shape, (0, 2))
+
+    def test_streaming_runs(self):
+        np.random.seed(67+5)
+        texts = [''.join(np.random.choice(list(bases), size=n))
+                 for bases, n in [('CAG', 2000), ('AG', 500), ('A', 30)]]
+        for pattern in ['AG', 'CAG', 'AA']:
+            expected = [repeats.repeat_runs(m, len(pattern)).tolist()
+                        for m in boyermoore.boyer_moore_mult_match_index(
+                            texts, pattern)]
+            for chunk_size in ['m', 2, 7, 64]:
+                for workers in [1, 3]:
+                    runs = [fftmatch.fft_match_index_n_log_m(t, pattern,
+                                chunk_size, workers=workers, mode='runs')
+                            for t in texts]
+                    self.assertEqual([r.tolist() for r in runs], expected)
+                runs = fftmatch.fft_match_index_n_sq_log_m(texts, pattern,
+                                                           chunk_size,
+                                                           mode='runs')
+                self.assertEqual([r.tolist() for r in runs], expected)
+
+        self.assertRaises(Exception, fftmatch.fft_match_index_n_log_m,
+                          'AAA', 'A', mode='runs', limit=1)
+        self.assertRaises(Exception, fftmatch.fft_match_index_n_log_n,
+                          'AAA', 'A', mode='runs')
+
+    def test_read_results(self):
+        with tempfile.NamedTemporaryFile(suffix='.txt') as f:
+            f.write('>chr1 a1 : Found matches at indices [0, 3, 9]\n'
+                    '>chr2 b1 : Found matches at indices []\n')
+            f.flush()
+            results = repeats.read_results(f.name)
+        self.assertEqual([(t, m.tolist()) for t, m in results],
+                         [('>chr1 a1', [0, 3, 9]), ('>chr2 b1', [])])
+
+class DifferentialTestRig(unittest.TestCase):
+    """
+    Compares every entry point with str.find on random texts and patterns.
+
+    The fast tier runs small cases.  The slow tier, TEST_TIER=slow, also runs
+    large ones and times every entry point; with TEST_RECORDS=path it writes
+    the timings as bench.py records, so that two runs can be compared with
+
+        $ python bench.py before.json after.json
+    """
+    def check_case(self, texts, pattern, chunk_size, skip=()):
+        expected = [find_all(t, pattern) for t in texts]
+        for name, search in differential_entry_points(pattern, chunk_size):
+            if name in skip:
+                continue
+            matches = [np.asarray(a).astype(int).tolist()
+                       for a in search(texts)]
+            self.assertEqual(matches, expected, msg='{} {} {} {}'.format(
+                name, map(len, texts), pattern, chunk_size))
+
+    def test_random_cases(self):
+        random = np.random.RandomState(67+6)
+        for _ in range(60):
+            self.check_case(*differential_case(random, 300, 12))
+
+    def test_zeros(self):
+        #'0's at the ends of the texts, next to the padding of the shorter
+        #text and of the last chunk
+        self.check_case(['AA0A00AA0AAA0AA0AAA',
+                         'AAA00000AAA000000A00AA0AA000A0AA0'], 'AA00', 5)
+
+    def test_long_patterns(self):
+        random = np.random.RandomState(67+7)
+        for _ in range(10):
+            self.check_case(*differential_case(random, 2000, 200, k=2))
+
+    def test_counts(self):
+        random = np.random.RandomState(67+8)
+        for _ in range(20):
+            texts, pattern, chunk_size = differential_case(random, 300, 6)
+            expected = [len(find_all(t, pattern)) for t in texts]
+            for func in [fftmatch.fft_match_index_n_sq_log_n,
+                         fftmatch.fft_match_index_n_sq_log_m,
+                         cvmatch.cv_match_index, cvmatch.cv_match_index_chunk,
+                         boyermoore.boyer_moore_mult_match_index,
+                         rabinkarp.rabin_karp_match_index,
+                         kmerindex.kmer_match_index]:
+                self.assertEqual(list(func(texts, pattern, mode='count')),
+                                 expected, msg=func)
+
+    @unittest.skipUnless(TEST_TIER == 'slow', 'TEST_TIER=slow runs it')
+    def test_large_cases(self):
+        random = np.random.RandomState(67+9)
+        records = []
+        for n, m, k in [(10**5, 3, 4), (10**5, 300, 2), (10**6, 12, 2)]:
+            texts = [synth.random_genome(n, rng=random) for _ in range(k)]
+            pattern = texts[0][n // 2:n // 2 + m]
+            expected = [find_all(t, pattern) for t in texts]
+            algorithms = []
+            for name, search in differential_entry_points(pattern, 4*m):
+                if name in ['naive', 'nlogn_naive']:
+                    #quadratic
+                    continue
+                record, _ = bench.benchmark(name, functools.partial(search,
+                                            texts), expected, repeats=1,
+                                            warmup=0)
+                self.assertTrue(record['correct'], msg=name)
+                algorithms.append(record)
+            records.append(bench.run_record(substring_length=m,
+                text_length=n, k=k, algorithms=algorithms))
+
+        if os.environ.get('TEST_RECORDS'):
+            with open(os.environ['TEST_RECORDS'], 'w') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+
+class NTTTestRig(unittest.TestCase):
+    def test_transform(self):
+        random = np.random.RandomState(67+10)
+        for length in [2, 8, 64]:
+            a = random.randint(0, ntt.MODULUS, (3, length)).astype(np.uint64)
+            b = random.randint(0, 256, (1, length)).astype(np.uint64)
+            self.assertTrue((ntt.ntt(ntt.ntt(a), inverse=True) == a).all())
+
+            #the cyclic convolution, with python's arbitrary precision ints
+            expected = [[sum(int(row[(j - i) % length]) * int(b[0, i])
+                             for i in range(length)) % ntt.MODULUS
+                         for j in range(length)] for row in a]
+            key = ntt.ntt(a) * ntt.ntt(b) % ntt.P
+            self.assertEqual(ntt.ntt(key, inverse=True).tolist(), expected)
+
+    def test_exact_search(self):
+        np.random.seed(67+10)
+        text = ''.join(np.random.choice(list('AGCT'), size=50000))
+        pattern = text[1000:1300]
+        expected = find_all(text, pattern)
+        for chunk_size in ['m', 100, 4096]:
+            self.assertEqual(fftmatch.fft_match_index_n_log_m(text, pattern,
+                chunk_size, exact=True).tolist(), expected)
+        self.assertEqual(fftmatch.fft_match_index_n_sq_log_m([text, text[1:]],
+            "CAG", mode='count', exact=True).tolist(),
+            [len(find_all(text, "CAG")), len(find_all(text[1:], "CAG"))])
+
+    def test_limits(self):
+        with self.assertRaises(Exception):
+            fftmatch.fft_match_index_n_log_m("ACGNT", "CN", wildcard='N',
+                                             exact=True)
+        #scores of binary data could wrap around the modulus
+        with self.assertRaises(Exception):
+            fftmatch.fft_match_index_n_log_m('\xff' * 20000, '\x00' * 16000,
+                                             exact=True)
+
+class RabinKarpTestRig(unittest.TestCase):
+    def test_collisions_and_segments(self):
+        random = np.random.RandomState(67+12)
+        texts = [''.join(random.choice(list('ACGT'), size=n))
+                 for n in [3000, 10, 2500]]
+        saved = (rabinkarp.MODULI, rabinkarp.SEGMENT_LENGTH,
+                 rabinkarp.BATCH_ELEMENTS)
+        try:
+            #tiny moduli make most windows candidates, which the verification
+            #has to reject, and tiny segments and batches put matches across
+            #the segment boundaries
+            rabinkarp.MODULI = (7, 11)
+            rabinkarp.SEGMENT_LENGTH = 16
+            rabinkarp.BATCH_ELEMENTS = 200
+            for pattern in ["A", "CA", texts[0][1000:1040]]:
+                out = rabinkarp.rabin_karp_match_index(texts, pattern)
+                self.assertEqual([list(o) for o in out],
+                                 [find_all(t, pattern) for t in texts])
+            counts = rabinkarp.rabin_karp_match_index(texts, "CA",
+                                                      mode='count', limit=3)
+            self.assertEqual(list(counts), [3, min(3, len(find_all(texts[1],
+                                                                  "CA"))), 3])
+        finally:
+            (rabinkarp.MODULI, rabinkarp.SEGMENT_LENGTH,
+             rabinkarp.BATCH_ELEMENTS) = saved
+
+class FastqTestRig(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(67+13)
+        self.reads = [''.join(random.choice(list('ACGTN'), size=n))
+                      for n in random.randint(1, 40, size=50)]
+        self.reads[3] = 'CAGCAGCAGTT'
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, opener=open):
+        path = os.path.join(self.directory, name)
+        with opener(path, 'wb') as f:
+            for i, read in enumerate(self.reads):
+                f.write('@read{} length={}\n{}\n+\n{}\n'.format(i,
+                        len(read), read, 'I' * len(read)))
+        return path
+
+    def test_match_reads(self):
+        for pattern in ['CAG', 'ACGTN', 'A' * 45]:
+            expected = [('read{}'.format(i), offset)
+                        for i, read in enumerate(self.reads)
+                        for offset in find_all(read, pattern)]
+            for path in [self.write('reads.fastq'),
+                         self.write('reads.fastq.gz', gzip.open)]:
+                for batch_reads in [1, 7, 1000]:
+                    self.assertEqual(list(fastq.match_reads(path, pattern,
+                                                            batch_reads)),
+                                     expected)
+
+    def test_batches(self):
+        with open(self.write('reads.fastq')) as f:
+            batches = list(fastq.read_batches(f, 20))
+        self.assertEqual([len(ids) for ids, _, _ in batches], [20, 20, 10])
+        ids, codes, lengths = batches[0]
+        self.assertEqual(ids[3], 'read3')
+        self.assertEqual(codes.dtype, np.uint8)
+        self.assertEqual(codes.shape, (20, lengths.max()))
+        self.assertEqual(codes[3, :lengths[3]].tostring(), self.reads[3])
+        #the null character past the end of every read
+        for row, length in zip(codes, lengths):
+            self.assertFalse(row[length:].any())
+
+        with self.assertRaises(Exception):
+            list(fastq.read_batches(io.BytesIO('>fasta\nACGT\n')))
+
+class PackedTestRig(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(67+11)
+        text = list(np.random.choice(list('ACGT'), size=5003))
+        text[100:250] = 'N' * 150
+        text[251:253] = 'nn'
+        text[4999:] = 'RYKN'
+        self.text = ''.join(text)
+
+    def test_decode(self):
+        genome = packed.PackedGenome.from_string(self.text)
+        self.assertEqual(genome.to_string(), self.text)
+        self.assertEqual(genome.mask.tolist(), [[100, 250, ord('N')],
+            [251, 253, ord('n')], [4999, 5000, ord('R')],
+            [5000, 5001, ord('Y')], [5001, 5002, ord('K')],
+            [5002, 5003, ord('N')]])
+        for start, stop in [(0, 1), (3, 9), (99, 254), (4990, 5010),
+                            (6000, 6004)]:
+            expected = (self.text[start:stop] + '\0' * 20)[:stop - start]
+            self.assertEqual(genome.decode(start, stop).tostring(), expected)
+        self.assertEqual(len(packed.PackedGenome.from_string('')), 0)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'genome')
+            packed.PackedGenome.from_string(self.text).save(path)
+            genome = packed.PackedGenome.load(path)
+            self.assertTrue(isinstance(genome.bases, np.memmap))
+            self.assertEqual(genome.to_string(), self.text)
+            self.assertTrue(genome.nbytes < len(self.text) // 3)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_search(self):
+        genome = packed.PackedGenome.from_string(self.text)
+        pattern = self.text[240:260]
+        expected = find_all(self.text, pattern)
+        for chunk_size in ['m', 7, 1000]:
+            self.assertEqual(fftmatch.fft_match_index_n_log_m(genome, pattern,
+                chunk_size).tolist(), expected)
+        self.assertEqual(fftmatch.fft_match_index_n_log_m(genome, pattern,
+            exact=True, workers=2).tolist(), expected)
+        #a mix of packed and unpacked texts
+        out = fftmatch.fft_match_index_n_sq_log_m([genome, self.text[1:]],
+                                                  pattern)
+        self.assertEqual(out[1].tolist(), [i - 1 for i in expected])
+        out = cvmatch.cv_match_index_chunk([genome], "ACGT", chunk_size=64)
+        self.assertEqual(out[0].tolist(), find_all(self.text, "ACGT"))
+        #the masked characters are wildcards too
+        self.assertEqual(len(fftmatch.fft_match_index_n_log_m(genome, "ANA",
+            wildcard='N')), len(fftmatch.fft_match_index_n_log_m(self.text,
+            "ANA", wildcard='N')))
+
+class KmerIndexTestRig(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(67+19)
+        self.texts = [''.join(np.random.choice(list('ACGTN'), size=n,
+                                               p=[.24, .24, .24, .24, .04]))
+                      for n in [3000, 10, 0, 5000]]
+
+    def test_search(self):
+        for k in [1, 4, 10, 31]:
+            index = kmerindex.KmerIndex.build(self.texts, k)
+            self.assertEqual(index.offsets[-1], len(index.positions))
+            for pattern in [self.texts[0][100:140], self.texts[3][-35:],
+                            'ACGTACGTACGTACGTACGTACGTACGTACGTACG', 'N' * 32]:
+                expected = [find_all(t, pattern) for t in self.texts]
+                out = index.match_index(pattern)
+                self.assertEqual([a.tolist() for a in out], expected)
+                self.assertEqual(index.match_index(pattern, 'count').tolist(),
+                                 map(len, expected))
+        #the texts are indexed back to back, but don't match across
+        index = kmerindex.KmerIndex.build(['ACGTA', 'CGTAC'], 4)
+        self.assertEqual(index.match_index('TACG', 'count').tolist(), [0, 0])
+        with self.assertRaises(Exception):
+            index.match_index('TAC')
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'index')
+            kmerindex.KmerIndex.build(self.texts, 8, ['a', 'b', 'c', 'd']) \
+                .save(path)
+            index = kmerindex.KmerIndex.load(path)
+            self.assertTrue(isinstance(index.positions, np.memmap))
+            self.assertEqual((index.k, index.titles), (8, ['a', 'b', 'c', 'd']))
+            pattern = self.texts[3][2000:2020]
+            self.assertEqual([a.tolist() for a in index.match_index(pattern)],
+                             [find_all(t, pattern) for t in self.texts])
+        finally:
+            shutil.rmtree(directory)
+
+class BloomTestRig(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(67+23)
+        self.texts = [''.join(np.random.choice(list('ACGTN'), size=n,
+                                               p=[.24, .24, .24, .24, .04]))
+                      for n in [4000, 3000, 50, 0, 3000]]
+        self.texts[4] = self.texts[1]
+        self.blooms = [bloom.KmerBloom.from_string(t, 8) for t in self.texts]
+        self.blooms[2] = None
+
+    def test_might_contain(self):
+        genome = bloom.KmerBloom.from_string(self.texts[0], 8)
+        #the bits of every k-mer, packed like np.packbits
+        bits = np.zeros(8*len(genome.bits), dtype=bool)
+        bits[bloom.bit_indices(bloom.kmer_codes(self.texts[0], 8)[1],
+                               len(bits), genome.hashes)] = True
+        self.assertEqual(genome.bits.tolist(), np.packbits(bits).tolist())
+        #no false negatives
+        for i in range(0, 3980, 7):
+            self.assertTrue(genome.might_contain(self.texts[0][i:i + 20]))
+        #patterns that can't be ruled out
+        self.assertTrue(genome.might_contain('ACGT'))
+        self.assertTrue(genome.might_contain('NNNNNNNNNN'))
+        missing = sum(genome.might_contain(''.join(np.random.choice(
+            list('ACGT'), size=20))) for _ in range(100))
+        self.assertTrue(missing < 10)
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'genome.fa')
+            self.assertEqual(bloom.load_beside(path), None)
+            genome.save(path + bloom.SUFFIX)
+            loaded = bloom.load_beside(path)
+            self.assertEqual((loaded.k, loaded.hashes), (8, bloom.HASHES))
+            self.assertEqual(loaded.bits.tolist(), genome.bits.tolist())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_searches(self):
+        for pattern in [self.texts[1][500:520], self.texts[2][10:30],
+                        'ACGTACGTACGTACGTACGT', 'CAG']:
+            expected = [find_all(t, pattern) for t in self.texts]
+            keep = bloom.prefilter(self.blooms, pattern)
+            self.assertTrue(all(keep[i] for i, e in enumerate(expected) if e))
+            for func in [fftmatch.fft_match_index_n_sq_log_m,
+                         cvmatch.cv_match_index_chunk]:
+                out = func(self.texts, pattern, blooms=self.blooms)
+                self.assertEqual([list(a) for a in out], expected, msg=func)
+                out = func(self.texts, pattern, mode='count',
+                           blooms=self.blooms)
+                self.assertEqual(list(out), map(len, expected), msg=func)
+            plain = fftmatch.fft_match_index_n_sq_log_m(self.texts, pattern,
+                                                        density=100)
+            out = fftmatch.fft_match_index_n_sq_log_m(self.texts, pattern,
+                density=100, blooms=self.blooms)
+            self.assertEqual(out.tolist(), plain.tolist())
+        pattern = self.texts[1][500:520]
+        #the texts without a filter are always searched
+        self.assertEqual(bloom.prefilter(self.blooms, pattern).tolist(),
+                         [False, True, True, False, True])
+        out = fftmatch.fft_match_index_n_sq_log_m(self.texts, pattern,
+                                                  mode='runs',
+                                                  blooms=self.blooms)
+        self.assertEqual([len(r) for r in out], [0, 1, 0, 0, 1])
+
+class PipelineTestRig(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(67+17)
+        self.records = [('genome{}'.format(i),
+                         ''.join(np.random.choice(list('ACGT'), size=n)))
+                        for i, n in enumerate([300, 5, 1000, 0, 2000])]
+
+    def test_run(self):
+        expected = [(title, find_all(genome, 'CA'))
+                    for title, genome in self.records]
+        for depth in [1, 2, 10]:
+            written = []
+            throughput = pipeline.run(iter(self.records),
+                lambda genome: fftmatch.fft_match_index_n_log_m(genome,
+                    'CA').tolist(),
+                lambda title, matches: written.append((title, matches)),
+                packed.PackedGenome.from_string, depth)
+            self.assertEqual(written, expected)
+            self.assertEqual(throughput.records, 5)
+            self.assertEqual(throughput.bases, 3305)
+            self.assertTrue(throughput.bases_per_second > 0)
+
+    def test_failures(self):
+        def fail(*args):
+            raise ValueError('failed')
+
+        #the reader, the search and the writer each stop the others
+        with self.assertRaises(ValueError):
+            pipeline.run(iter(self.records), len, lambda *args: None, fail)
+        with self.assertRaises(ValueError):
+            pipeline.run(iter(self.records * 10), fail, lambda *args: None,
+                         depth=1)
+        with self.assertRaises(ValueError):
+            pipeline.run(iter(self.records * 10), len, fail, depth=1)
+        with self.assertRaises(Exception):
+            pipeline.run(iter(self.records), len, fail, depth=0)
+
+    def test_read_records(self):
+        directory = tempfile.mkdtemp()
+        try:
+            paths = []
+            for i, (_, genome) in enumerate(self.records[:3]):
+                paths.append(os.path.join(directory, '{}.fa'.format(i)))
+                with open(paths[-1], 'w') as f:
+                    f.write('>same\n{}\n{}\n'.format(genome[:70], genome[70:]))
+            self.assertEqual(list(pipeline.read_records(paths)),
+                [('>same{}'.format(i + 1), genome)
+                 for i, (_, genome) in enumerate(self.records[:3])])
+        finally:
+            shutil.rmtree(directory)
+
+class RegressionTestRig(unittest.TestCase):
+    def records(self, times, correct=True):
+        algorithms = [{'name': name, 'median_ms': median, 'iqr_ms': iqr,
+                       'correct': correct} for name, median, iqr in times]
+        return [bench.run_record(substring='CAG', text_length=1024, k=1,
+                                 chunk_size=size, algorithms=algorithms)
+                for size in ['m', 96]]
+
+    def test_compare(self):
+        baseline = self.records([('nlogn', 10.0, 0.1), ('opencv', 10.0, 0.1),
+                                 ('noisy', 10.0, 4.0), ('fast', 0.1, 0.0)])
+        current = self.records([('nlogn', 10.5, 0.1), ('opencv', 15.0, 0.1),
+                                ('noisy', 15.0, 4.0), ('fast', 0.2, 0.0)])
+        rows, failures = regression.compare(baseline, current, tolerance=0.2,
+                                            min_ms=0.5)
+        #once for every algorithm, although every chunk size has a record
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(failures, ['opencv m=3 n=1024 k=1 got 50% slower'])
+        self.assertTrue('REGRESSED' in regression.format_diff(rows))
+
+        current = self.records([('nlogn', 10.0, 0.1)], correct=False)
+        _, failures = regression.compare(baseline, current)
+        self.assertEqual(failures,
+                         ['nlogn m=3 n=1024 k=1 returned wrong matches'])
+
+    def test_run_and_plot(self):
+        subset = {'lengths': [64, 128], 'pattern_lengths': [3], 'ks': [1, 2],
+                  'chunk_sizes': ['m', 6]}
+        names = ['nlogn', 'nlogm', 'opencv', 'opencv_chunk']
+        records = regression.run_subset(names, repeats=1, warmup=0,
+                                        subset=subset)
+        self.assertEqual(len(records), 8)
+        self.assertTrue(all(a['correct'] for r in records
+                            for a in r['algorithms']))
+
+        out = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, out)
+        history = records + [dict(r, run='later') for r in records]
+        regression.plot_history(history, out, subset)
+        for name in ['algorithm performance vs text length.png',
+                     'nlogm performance by chunk size.png', 'history.png']:
+            self.assertTrue(os.path.getsize(os.path.join(out, name)) > 0)
+
+class DispatchTestRig(unittest.TestCase):
+    def test_match_index(self):
+        np.random.seed(67+2)
+        texts = [''.join(np.random.choice(list('AGCT'), size=1000))
+                 for _ in range(3)]
+        expected_output = boyermoore.boyer_moore_mult_match_index(texts, "CAG")
+
+        for algorithm in ['auto'] + dispatch.available_algorithms(3):
+            out = dispatch.match_index(texts, "CAG", algorithm=algorithm,
+                                       model=dispatch.CostModel())
+            self.assertTrue(ndarrays_equal(out, expected_output),
+                            msg=algorithm)
+
+    def test_cost_model_fit(self):
+        samples = [{'name': 'boyermoore', 'k': k, 'text_length': n,
+                    'substring_length': 3, 'time': 2.0 + 0.5*k*n}
+                   for k in [1, 4] for n in [100, 1000]]
+        model = dispatch.CostModel.fit(samples)
+
+        overhead, rate = model.params['boyermoore']
+        self.assertAlmostEqual(overhead, 2.0)
+        self.assertAlmostEqual(rate, 0.5)
+        self.assertEqual(model.params['nlogm'], dispatch.DEFAULT_MODEL['nlogm'])
+
+class BenchTestRig(unittest.TestCase):
+    def test_benchmark_record(self):
+        texts = ["ACGACG", "CCC"]
+        expected = boyermoore.boyer_moore_mult_match_index(texts, "ACG")
+        record, matches = bench.benchmark('nlogm',
+            lambda: fftmatch.fft_match_index_n_sq_log_m(texts, "ACG"),
+            expected, repeats=3, warmup=1)
+
+        self.assertEqual(record['repeats'], 3)
+        self.assertEqual(record['time'], record['median_ms'])
+        self.assertTrue(record['iqr_ms'] >= 0)
+        self.assertTrue(record['correct'])
+
+    def test_match_sets_equal(self):
+        expected = [np.array([0, 4]), np.array([])]
+        self.assertEqual(bench.match_sets_equal(
+            [np.array([4, 0]), np.array([])], expected), 1.0)
+        #a subset of the matches is not accurate, even if it has the same size
+        self.assertEqual(bench.match_sets_equal(
+            [np.array([0, 5]), np.array([])], expected), 0.5)
+
+    def test_diff_records(self):
+        baseline = [bench.run_record(substring='CAG', text_length=10,
+            algorithms=[{'name': 'nlogm', 'median_ms': 2.0}])]
+        current = [bench.run_record(substring='CAG', text_length=10,
+            algorithms=[{'name': 'nlogm', 'median_ms': 3.0},
+                        {'name': 'nlogn', 'median_ms': 1.0}])]
+
+        rows = bench.diff_records(baseline, current)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][1:], (2.0, 3.0, 1.5))
+
+class SynthTestRig(unittest.TestCase):
+    def test_generate_genomes(self):
+        genomes = synth.generate_genomes(3, 500, gc_content=0.6,
+                                         repeat_density=0.01, seed=5)
+        self.assertEqual(genomes, synth.generate_genomes(3, 500, 0.6,
+                                             repeat_density=0.01, seed=5))
+        self.assertEqual(genomes[:2], synth.generate_genomes(2, 500, 0.6,
+                                             repeat_density=0.01, seed=5))
+        self.assertEqual(map(len, genomes), [500]*3)
+        self.assertTrue(set(''.join(genomes)) <= set('ACGT'))
+
+    def test_add_repeats(self):
+        rng = np.random.RandomState(0)
+        genome, tracts = synth.add_repeats('A'*1000, 'CAG', density=0.005,
+                                           copies=5, rng=rng)
+        self.assertEqual(len(genome), 1000)
+        self.assertTrue(len(tracts) > 0)
+        for start, copies in tracts:
+            self.assertEqual(copies, 5)
+        #tracts can overwrite each other, so only the upper bound is exact
+        self.assertTrue(0 < 1000 - genome.count('A') <= 10*len(tracts))
+        matches = boyermoore.boyer_moore_match_index(genome, 'CAG')
+        self.assertTrue(any(start in matches for start, _ in tracts))
+
+    def test_benchmark_matrix(self):
+        records = benchmatrix.run_matrix([64, 200], [3], [1, 2], ['m', 2, 40],
+            ['nlogm', 'nlogn'], repeats=1, warmup=0, repeat_density=0.02)
+        #chunk size 2 is shorter than the pattern
+        self.assertEqual(len(records), 2*2*2)
+        for record in records:
+            names = [a['name'] for a in record['algorithms']]
+            self.assertEqual(names, ['boyermoore', 'nlogn', 'nlogm'])
+            self.assertTrue(all(a['correct'] for a in record['algorithms']))
+
+        selected = benchmatrix.select(records, ['boyermoore'], k=2,
+                                      chunk_size='m')
+        self.assertEqual([r['text_length'] for r in selected], [64, 200])
+        self.assertEqual(len(selected[0]['algorithms']), 1)
+
+class StagesTestRig(unittest.TestCase):
+    def test_profiling(self):
+        texts = ["ACGACG"*100, "CCC"*150]
+        with stages.profiling() as profiler:
+            fftmatch.fft_match_index_n_sq_log_m(texts, "ACG", workers=2)
+            with stages.stage('cv'):
+                cvmatch.cv_match_index_chunk(texts, "ACG")
+        self.assertTrue(stages.active is None)
+
+        for path in [('encode',), ('pattern',), ('correlate', 'rfft'),
+                     ('correlate', 'irfft'), ('merge',),
+                     ('cv', 'matchTemplate'), ('cv', 'concatenate')]:
+            self.assertIn(path, profiler.stats)
+        #one forward transform per batch, three with wildcards
+        self.assertEqual(profiler.stats[('correlate', 'rfft')]['calls'],
+                         profiler.stats[('correlate',)]['calls'])
+        self.assertTrue(profiler.stats[('correlate', 'irfft')]['bytes'] > 0)
+
+        with stages.profiling() as profiler:
+            fftmatch.fft_match_index_n_sq_log_m(texts, "ACG", wildcard='N')
+        self.assertEqual(profiler.stats[('correlate', 'rfft')]['calls'],
+                         3*profiler.stats[('correlate',)]['calls'])
+
+        folded = dict(line.rsplit(' ', 1)
+                      for line in profiler.to_folded().split('\n'))
+        self.assertIn('correlate;threshold', folded)
+        self.assertEqual(len(json.loads(profiler.to_json())),
+                         len(profiler.stats))
+
+    def test_threads(self):
+        #switch threads as often as possible, so that unlocked updates of the
+        #shared stage get lost
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            with stages.profiling() as profiler:
+                with stages.stage('parent'):
+                    parent = stages.current()
+
+                    def allocate():
+                        with stages.within(parent):
+                            for _ in range(10000):
+                                stages.allocated(1)
+
+                    threads = [threading.Thread(target=allocate)
+                               for _ in range(4)]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assertEqual(profiler.stats[('parent',)]['bytes'], 40000)
+
+    def test_disabled(self):
+        self.assertTrue(stages.stage('encode') is stages.NULL_STAGE)
+        profiler = stages.Profiler()
+        fftmatch.fft_match_index_n_log_m("ACGACG", "ACG")
+        self.assertEqual(len(profiler.stats), 0)
+
+class ServerTestRig(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(67+3)
+        self.genomes = dict(('>text{}'.format(i),
+                             ''.join(np.random.choice(list('AGCT'), size=n)))
+                            for i, n in enumerate([500, 2000, 2]))
+
+    def test_search(self):
+        match_server = server.MatchServer(('127.0.0.1', 0), self.genomes)
+        thread = threading.Thread(target=match_server.serve_forever)
+        thread.start()
+        try:
+            port = match_server.server_address[1]
+            self.assertEqual(sorted(client.genomes(port=port)),
+                sorted((t, len(g)) for t, g in self.genomes.items()))
+
+            patterns = ['CAG', 'ACGTA', 'G']
+            results = list(client.search(patterns, port=port))
+            self.assertEqual(len(results), len(patterns)*len(self.genomes))
+            for title, pattern, matches in results:
+                expected = boyermoore.boyer_moore_match_index(
+                    self.genomes[title], pattern)
+                self.assertEqual(matches.tolist(), list(expected),
+                                 msg=(title, pattern))
+
+            self.assertRaises(Exception, list,
+                              client.search(['CAG'], ['>missing'], port=port))
+        finally:
+            match_server.shutdown()
+            match_server.server_close()
+            thread.join()
+
+    def test_failed_search(self):
+        class BrokenGenome(server.ResidentGenome):
+            def correlate(self, patterns):
+                raise Exception('broken backend')
+
+        match_server = server.MatchServer(('127.0.0.1', 0), self.genomes)
+        titles = list(match_server.genomes)
+        match_server.genomes[titles[1]] = BrokenGenome(titles[1], 'ACGT')
+        thread = threading.Thread(target=match_server.serve_forever)
+        thread.start()
+        try:
+            port = match_server.server_address[1]
+            #a 500 before anything is streamed
+            with self.assertRaisesRegexp(Exception, 'error 500.*broken'):
+                list(client.search(['CAG'], titles[1:], port=port))
+            #an error line after the first genome
+            results = client.search(['CAG'], titles, port=port)
+            self.assertEqual(next(results)[0], titles[0])
+            with self.assertRaisesRegexp(Exception, 'broken backend'):
+                list(results)
+        finally:
+            match_server.shutdown()
+            match_server.server_close()
+            thread.join()
+
+    def test_coalescing(self):
+        class SlowGenome(server.ResidentGenome):
+            def correlate(self, patterns):
+                self.calls.append(patterns)
+                self.release.wait()
+                return server.ResidentGenome.correlate(self, patterns)
+
+        text = self.genomes['>text1']
+        genome = SlowGenome('>text1', text)
+        genome.calls, genome.release = [], threading.Event()
+        results = {}
+
+        def search(patterns):
+            results[tuple(patterns)] = genome.search(patterns)
+
+        def wait_for(condition):
+            for _ in range(500):
+                if condition():
+                    return
+                time.sleep(0.01)
+            self.fail('timed out')
+
+        threads = [threading.Thread(target=search, args=(p,))
+                   for p in [['CAG'], ['ACG'], ['CAG', 'TTT']]]
+        threads[0].start()
+        wait_for(lambda: len(genome.calls) == 1)
+        threads[1].start()
+        threads[2].start()
+        wait_for(lambda: len(genome.pending) == 2)
+        genome.release.set()
+        for thread in threads:
+            thread.join()
+
+        #the two queries that waited were searched with one correlation
+        self.assertEqual(genome.calls, [['CAG'], ['ACG', 'CAG', 'TTT']])
+        for patterns, matches in results.items():
+            for pattern, found in zip(patterns, matches):
+                self.assertEqual(found.tolist(), list(
+                    boyermoore.boyer_moore_match_index(text, pattern)))
+
+class StartupTestRig(unittest.TestCase):
+    #modules that a short query must not import
+    SLOW_MODULES = ['cv', 'cv2', 'pyfftw', 'scipy', 'matplotlib', 'yaml']
+
+    #seconds that cli.py may take on top of starting python and importing
+    #numpy, which it can't avoid
+    STARTUP_BUDGET = 0.25
+
+    def setUp(self):
+        self.directory = os.path.dirname(os.path.abspath(__file__))
+        fd, self.genome = tempfile.mkstemp(suffix='.fa')
+        with os.fdopen(fd, 'w') as f:
+            f.write('>chr test\nACGCAGCAGTTCAG\n')
+
+    def tearDown(self):
+        os.remove(self.genome)
+
+    def python(self, code):
+        """ Runs code in a new interpreter, returns its stdout and seconds """
+        start = time.time()
+        #a model path that doesn't exist, for the DEFAULT_MODEL choices
+        env = dict(os.environ, FFTMATCH_COST_MODEL=self.genome + '.model')
+        out = subprocess.check_output([sys.executable, '-c', code],
+                                      cwd=self.directory, env=env)
+        return out, time.time() - start
+
+    def cli_code(self, *options):
+        return ("import sys\n"
+                "sys.argv = ['cli.py'] + {!r} + ['CAG', {!r}]\n"
+                "execfile('cli.py')\n").format(list(options), self.genome)
+
+    def test_lazy_imports(self):
+        #the default -a auto, which only looks up the optional modules
+        code = self.cli_code() + ("import graph\n"
+            "print [m for m in {!r} if m in sys.modules]\n"
+            .format(self.SLOW_MODULES))
+        out, _ = self.python(code)
+        self.assertIn('Found matches at indices [3, 6, 11]', out)
+        self.assertEqual(out.strip().split('\n')[-1], '[]')
+
+    @unittest.skipUnless(TEST_TIER == 'slow', 'TEST_TIER=slow runs it')
+    def test_startup_time(self):
+        numpy_time = min(self.python('import numpy')[1] for _ in range(3))
+        cli_time = min(self.python(self.cli_code('-a', 'boyermoore'))[1]
+                       for _ in range(3))
+        self.assertTrue(cli_time - numpy_time < self.STARTUP_BUDGET,
+                        msg='cli.py took {:.3f} s, numpy {:.3f} s'
+                            .format(cli_time, numpy_time))
+
+class CLITestRig(unittest.TestCase):
+    def setUp(self):
+        fd, self.genome = tempfile.mkstemp(suffix='.fa')
+        with os.fdopen(fd, 'w') as f:
+            f.write('>chr test\nACGCAGCAGTTCAG\n')
+
+    def tearDown(self):
+        os.remove(self.genome)
+
+    def cli(self, *arguments):
+        """ Runs cli.py, returns its exit status and stderr """
+        process = subprocess.Popen([sys.executable, 'cli.py'] +
+                                   list(arguments) + [self.genome],
+                                   cwd=os.path.dirname(os.path.abspath(
+                                       __file__)),
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        _, err = process.communicate()
+        return process.returncode, err
+
+    def test_long_mismatch_patterns(self):
+        pattern = 'CAG' * 24
+        for options in [['-d', '1'], ['-a', 'shiftor', '-d', '1'],
+                        ['-a', 'shiftor']]:
+            status, err = self.cli(*(options + [pattern]))
+            self.assertEqual(status, 2, msg=err)
+            self.assertIn('a pattern of at most 64 characters', err)
+            self.assertNotIn('Traceback', err)
+        status, err = self.cli('-d', '1', pattern[:64])
+        self.assertEqual(status, 0, msg=err)
+
+class OutputTestRig(unittest.TestCase):
+    def test_delta_encode(self):
+        indices = np.array([5, 9, 9000, 2**32])
+        deltas = output.delta_encode(indices)
+        self.assertEqual(deltas.dtype, np.int64)
+        self.assertEqual(output.delta_decode(deltas).tolist(), indices.tolist())
+
+        deltas = output.delta_encode(indices[:3])
+        self.assertEqual(deltas.dtype, np.int32)
+        self.assertEqual(deltas.tolist(), [5, 4, 8991])
+        self.assertEqual(output.delta_encode([]).tolist(), [])
+
+    def test_npy(self):
+        stream = io.BytesIO()
+        writer = output.MatchWriter(stream, 'CAG', 'npy')
+        results = [('>a', np.arange(0, 3*10**5, 3)), ('>b', np.array([]))]
+        for title, matches in results:
+            writer.write(title, matches)
+
+        stream.seek(0)
+        read = list(output.read_npy(stream))
+        self.assertEqual([title for title, _ in read], ['>a', '>b'])
+        for (_, expected), (_, matches) in zip(results, read):
+            self.assertEqual(matches.tolist(), expected.tolist())
+
+    def test_line_formats(self):
+        expected = {
+            'text': '>chr1 x : Found matches at indices [3, 10]\n',
+            'tsv': '>chr1 x\t3\n>chr1 x\t10\n',
+            'bed': 'chr1\t3\t6\nchr1\t10\t13\n',
+            'jsonl': '{"matches": [3, 10], "pattern": "CAG", '
+                     '"genome": ">chr1 x"}\n',
+        }
+        for format, text in expected.items():
+            stream = io.BytesIO()
+            writer = output.MatchWriter(stream, 'CAG', format)
+            writer.write('>chr1 x', np.array([3, 10]))
+            writer.write('>chr2', np.array([]))
+            self.assertTrue(stream.getvalue().startswith(text), msg=format)
+
+    def test_long_lists(self):
+        #more matches than fit in one block
+        matches = np.arange(0, 3*10**5, 3)
+        for format in ['text', 'jsonl']:
+            stream = io.BytesIO()
+            output.MatchWriter(stream, 'CAG', format).write('>a', matches)
+            if format == 'text':
+                self.assertEqual(stream.getvalue(), '>a : Found matches at '
+                                 'indices {}\n'.format(matches.tolist()))
+            else:
+                self.assertEqual(json.loads(stream.getvalue()), {
+                    'genome': '>a', 'pattern': 'CAG',
+                    'matches': matches.tolist()})
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,15 +1,15 @@
-import time
+from timeit import default_timer
 
 class Timer(object):
     def __init__(self, verbose=False):
         self.verbose = verbose
 
     def __enter__(self):
-        self.start = time.time()
+        self.start = default_timer()
         return self
 
     def __exit__(self, *args):
-        self.end = time.time()
+        self.end = default_timer()
         self.secs = self.end - self.start
         self.msecs = self.secs * 1000  # millisecs
         if self.verbose: